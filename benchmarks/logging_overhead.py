@@ -0,0 +1,59 @@
+"""
+Micro-benchmark of the logging overhead on the request hot path.
+
+Compares the f-string messages the node used to log on every put and get
+against `hot_logger`, with a production handler at WARNING level, where the
+hot messages are disabled, and with an INFO handler that drops everything
+but a sample of the messages.
+
+    python benchmarks/logging_overhead.py
+"""
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+
+from loguru import logger  # noqa: E402
+
+from chord.log import HotLogger  # noqa: E402
+
+KEY = 2 ** 159 + 12345
+NODE = {"addr": "127.0.0.1:6501", "numeric_id": 2 ** 158}
+VALUE = os.urandom(1024)
+
+
+def f_strings():
+    logger.warning(f"Getting Key: {KEY} - {KEY}")
+    logger.debug(f"Getting key from responsible node {NODE}")
+    logger.info(f"finding key {KEY} => {VALUE}")
+
+
+def hot_path(hot: HotLogger):
+    hot.debug("Getting Key: {} - {}", KEY, KEY)
+    hot.debug("Getting key from responsible node {}", NODE)
+    hot.info("finding key {} => {}", KEY, hot.value(VALUE))
+
+
+def run(stmt, number):
+    return min(timeit.repeat(stmt, number=number, repeat=5)) / number * 1e9
+
+
+if __name__ == "__main__":
+    number = 20_000
+    logger.remove()
+    everything = HotLogger(1, log_values=True)
+    sampled = HotLogger(0.01, log_values=False)
+    results = []
+    for level in ("WARNING", "INFO"):
+        handler = logger.add(open(os.devnull, "w"), level=level)
+        everything.set_level(level)
+        sampled.set_level(level)
+        results += [
+            (f"f-strings ({level})", run(f_strings, number)),
+            (f"hot, all ({level})", run(lambda: hot_path(everything), number)),
+            (f"hot, 1% ({level})", run(lambda: hot_path(sampled), number)),
+        ]
+        logger.remove(handler)
+    for name, ns in results:
+        print(f"{name:<24} {ns:10.1f} ns/request")
@@ -0,0 +1,56 @@
+"""
+Micro-benchmark of the ring math on the lookup hot path.
+
+Compares `between` against the previous implementation that parsed
+`finger_table_sz` from the config and computed the ring size on every call.
+
+    python benchmarks/ring_math.py
+"""
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+
+from chord.helpers import between, ring  # noqa: E402
+from config.config import dht_config  # noqa: E402
+
+
+def between_config(_id: int, left: int, right: int, inclusive_left=False, inclusive_right=True) -> bool:
+    ring_sz = 2 ** (int(dht_config["finger_table_sz"]))
+    if left != right:
+        if inclusive_left:
+            left = (left - 1 + ring_sz) % ring_sz
+        if inclusive_right:
+            right = (right + 1) % ring_sz
+    if left < right:
+        return left < _id < right
+    else:
+        return (_id > max(left, right)) or (_id < min(left, right))
+
+
+def finger_starts_config(node_id: int):
+    m = int(dht_config["finger_table_sz"])
+    return [(node_id + (2 ** i)) % (2 ** m) for i in range(m)]
+
+
+def finger_starts_ring(node_id: int):
+    return [ring.finger_start(node_id, i) for i in range(ring.bits)]
+
+
+def run(stmt, number):
+    return min(timeit.repeat(stmt, number=number, repeat=5)) / number * 1e9
+
+
+if __name__ == "__main__":
+    number = 200_000
+    left, right, _id = ring.size // 4, 3 * ring.size // 4, ring.size // 2
+    results = [
+        ("between (config)", run(lambda: between_config(_id, left, right), number)),
+        ("between (ring)", run(lambda: between(_id, left, right), number)),
+        ("finger starts (config)", run(lambda: finger_starts_config(left), number // 100)),
+        ("finger starts (ring)", run(lambda: finger_starts_ring(left), number // 100)),
+    ]
+    print(f"ring bits: {ring.bits}")
+    for name, ns in results:
+        print(f"{name:<24} {ns:10.1f} ns/call")
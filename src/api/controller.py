@@ -1,24 +1,69 @@
 import asyncio
+import struct
+from collections import deque
 
 from loguru import logger
 
+from chord.log import hot_logger
+from config.config import dht_config
 from .service import ApiService
 
+# size of the message header: length (2 bytes) + message type (2 bytes)
+HEADER_SIZE = 4
+
 
 class ApiController(asyncio.Protocol):
     """
     This class represent the API controller (The entry class).
+    The byte stream of a connection is split into the length prefixed messages,
+    a client may send many requests without waiting for the replies. The requests
+    are processed concurrently and the replies are written in request order.
+
+    Reading from a connection pauses while it has `api_max_in_flight` requests
+    in flight or its unsent replies exceed `api_write_high_water` bytes. Once
+    `api_max_in_flight_total` requests are in flight on all connections, new
+    requests are answered with DHT_FAIL right away.
     """
 
+    # requests in flight on all connections
+    in_flight_total = 0
+
     def __init__(self, chord_node):
         self.transport = None
         self.service = ApiService(chord_node)
+        self._max_in_flight = int(dht_config["api_max_in_flight"])
+        self._max_in_flight_total = int(dht_config["api_max_in_flight_total"])
+        self._write_high_water = int(dht_config["api_write_high_water"])
+        # received bytes not forming a complete message yet
+        self._buffer = bytearray()
+        # requests being processed, in the order they arrived
+        self._pending = deque()
+        self._writer = None
+        self._reading_paused = False
+        self._can_write = asyncio.Event()
+        self._can_write.set()
 
     def connection_made(self, transport):
         """
         sets the connection.
         """
         self.transport = transport
+        transport.set_write_buffer_limits(high=self._write_high_water)
+
+    def connection_lost(self, exc):
+        for task in self._pending:
+            task.cancel()
+        self._pending.clear()
+        self.transport = None
+        self._can_write.set()
+
+    def pause_writing(self):
+        self._can_write.clear()
+        self._update_reading()
+
+    def resume_writing(self):
+        self._can_write.set()
+        self._update_reading()
 
     async def process_data(self, data):
         """
@@ -26,30 +71,103 @@ class ApiController(asyncio.Protocol):
             Args:
                 data (bytes): The message in bytes.
             Returns:
-                result (string): The result from processing the arg data
-                (if one exists).
+                result (bytes): The reply to the message, None if the message has
+                no reply and False if the message was invalid.
         """
-        result = await self.service.process_message(data)
-        logger.debug(f"API Result: {result}")
-
-        if not result:
-            return self.close_connection()
+        try:
+            result = await self.service.process_message(data)
+        except Exception as e:
+            logger.error(f"Failed to process message: {e}")
+            return False
+        hot_logger.debug("API Result: {}", hot_logger.value(result) if result else result)
 
         if isinstance(result, str):
             result = result.encode("utf-8")
-
-        if self.transport:
-            self.transport.write(result)
-
         return result
 
     def data_received(self, data):
-        asyncio.ensure_future(self.process_data(data))
+        self._buffer += data
+        self._parse_messages()
+
+    def _parse_messages(self):
+        """
+        Starts the complete messages in the buffer while the connection has less
+        than `api_max_in_flight` requests in flight, the rest waits in the buffer.
+        """
+        offset = 0
+        while len(self._pending) < self._max_in_flight and len(self._buffer) - offset >= HEADER_SIZE:
+            size = struct.unpack_from(">H", self._buffer, offset)[0]
+            if size < HEADER_SIZE:
+                logger.error(f"Invalid message size {size}.")
+                return self.close_connection()
+            if len(self._buffer) - offset < size:
+                break
+            self._pending.append(self._admit(bytes(self._buffer[offset : offset + size])))
+            offset += size
+        del self._buffer[:offset]
+
+        self._update_reading()
+        if self._pending and self._writer is None:
+            self._writer = asyncio.ensure_future(self._write_replies())
+
+    def _admit(self, message: bytes) -> asyncio.Future:
+        """
+        Starts processing a message, or rejects it if the node is overloaded.
+        """
+        if ApiController.in_flight_total >= self._max_in_flight_total:
+            logger.warning(f"Overloaded with {ApiController.in_flight_total} requests, rejecting.")
+            rejected = asyncio.get_event_loop().create_future()
+            rejected.set_result(self.service.reject(message))
+            return rejected
+        ApiController.in_flight_total += 1
+        task = asyncio.ensure_future(self.process_data(message))
+        task.add_done_callback(self._request_done)
+        return task
+
+    @staticmethod
+    def _request_done(_):
+        ApiController.in_flight_total -= 1
+
+    def _update_reading(self):
+        if not self.transport:
+            return
+        busy = len(self._pending) >= self._max_in_flight or not self._can_write.is_set()
+        if busy and not self._reading_paused:
+            self.transport.pause_reading()
+            self._reading_paused = True
+        elif not busy and self._reading_paused:
+            self.transport.resume_reading()
+            self._reading_paused = False
+
+    async def _write_replies(self):
+        """
+        Writes the replies of the pending requests in request order, waiting
+        while the write buffer is above its high-water mark.
+        An invalid request closes the connection.
+        """
+        try:
+            while self._pending:
+                result = await self._pending[0]
+                self._pending.popleft()
+                if result is False:
+                    return self.close_connection()
+                await self._can_write.wait()
+                if result and self.transport:
+                    self.transport.write(result)
+                # requests held back by the in-flight limit
+                self._parse_messages()
+        except asyncio.CancelledError:
+            pass
+        finally:
+            self._writer = None
 
     def close_connection(self):
         """
         Closes the currently open connection.
         """
+        for task in self._pending:
+            task.cancel()
+        self._pending.clear()
         if self.transport:
             self.transport.close()
             self.transport = None
@@ -1,17 +1,21 @@
 import struct
-from binascii import unhexlify
 from enum import Enum
 
 from loguru import logger
 
+from chord.log import hot_logger
 from chord.node import Node
 
+KEY_SIZE = 32
+
 
 class DhtMessageCodes(Enum):
     DHT_PUT = 650
     DHT_GET = 651
     DHT_SUCC = 652
     DHT_FAIL = 653
+    DHT_MULTI_GET = 654
+    DHT_MULTI_PUT = 655
 
 
 class ApiService:
@@ -28,61 +32,165 @@ class ApiService:
             Args:
                 data (bytes): The message in bytes.
         """
-        sz = struct.unpack(">H", data[:2])[0]
+        data = memoryview(data)
+        sz, msg_type = struct.unpack_from(">HH", data)
 
         # check size match
         if sz != len(data):
             logger.error(f"Message Size mismatch. Payload Size {len(data)}, Expected Size {sz}")
             return False
 
-        msg_type = struct.unpack(">H", data[2:4])[0]
-        logger.info(f"Got new message: {msg_type} => {DhtMessageCodes(msg_type)}")
+        hot_logger.info("Got new message: {}", msg_type)
         if msg_type == DhtMessageCodes.DHT_PUT.value:
-            await self._process_put(data[4:])
-            return
+            return await self._process_put(data[4:])
 
         if msg_type == DhtMessageCodes.DHT_GET.value:
             return await self._process_get(data[4:])
 
+        if msg_type == DhtMessageCodes.DHT_MULTI_PUT.value:
+            return await self._process_multi_put(data[4:])
+
+        if msg_type == DhtMessageCodes.DHT_MULTI_GET.value:
+            return await self._process_multi_get(data[4:])
+
         logger.error(f"Invalid message Type. Got {msg_type}.")
         return False
 
-    async def _process_get(self, data: bytes):
+    async def _process_get(self, data: memoryview):
         """
         Unpacks/parses and precesses the bytes message (the key) and
         attempts to get the value stored under that key from chord.
         (if one exists)
             Args:
-                data (bytes): The message in bytes (which is actually the key).
+                data (memoryview): The message in bytes (which is actually the key).
             Returns:
                 data (bytes): A success message containing the status code
                 DHT_SUCC, the key and the value.
         """
-        key = data
-        val = await self.chord_node.find_key(key.hex())
+        key = bytes(data)
+        val = await self.chord_node.find_key(key)
         if not val:
             return self._create_fail(key)
-        return self._create_succ(key, unhexlify(val))
+        return self._create_succ(key, val)
 
-    async def _process_put(self, data: bytes):
+    async def _process_put(self, data: memoryview):
         """
         Unpacks/parses and precesses the bytes message (the key) and
         creates a put request to the chord network to store the value under the
         given key.
             Args:
-                data (bytes): The message in bytes (which is actually the key).
+                data (memoryview): The message in bytes (which is actually the key).
             Returns:
-                keys (list): The updated list of keys
+                data (bytes): A DHT_FAIL message if the write quorum was not reached, else None.
         """
-        ttl, replication, _ = struct.unpack(">HBB", data[:4])
+        ttl, replication, _ = struct.unpack_from(">HBB", data)
 
-        key = data[4:36].hex()
-        value = data[36:].hex()
+        key = bytes(data[4:36])
+        value = bytes(data[36:])
 
-        logger.info(
-            f"Handling put message: Hex Key {key} [TTL {ttl}, replication {replication}] => Hex Value [{value}]"
+        hot_logger.info(
+            "Handling put message: Key {} [TTL {}, replication {}] => {}",
+            key.hex,
+            ttl,
+            replication,
+            hot_logger.value(value),
         )
-        await self.chord_node.put_key(key, value, int(ttl))
+        if not await self.chord_node.put_key(key, value, int(ttl)):
+            return self._create_fail(key)
+
+    @staticmethod
+    def _split_keys(data: memoryview):
+        """
+        Splits the body of a DHT_MULTI_GET message into its keys.
+            Args:
+                data (memoryview): The keys, 32 bytes each.
+            Returns:
+                keys (list): The keys as bytes, None if the body is malformed.
+        """
+        if not data or len(data) % KEY_SIZE:
+            return None
+        return [bytes(data[i : i + KEY_SIZE]) for i in range(0, len(data), KEY_SIZE)]
+
+    @staticmethod
+    def _split_items(data: memoryview):
+        """
+        Splits the body of a DHT_MULTI_PUT message into its key, value pairs.
+            Args:
+                data (memoryview): The entries, each a 32 byte key, the value size (2 bytes) and the value.
+            Returns:
+                items (list): [key, value] pairs as bytes, None if the body is malformed.
+        """
+        items = []
+        offset = 0
+        while offset < len(data):
+            if len(data) - offset < KEY_SIZE + 2:
+                return None
+            size = struct.unpack_from(">H", data, offset + KEY_SIZE)[0]
+            start = offset + KEY_SIZE + 2
+            if len(data) - start < size:
+                return None
+            items.append([bytes(data[offset : offset + KEY_SIZE]), bytes(data[start : start + size])])
+            offset = start + size
+        return items or None
+
+    async def _process_multi_get(self, data: memoryview):
+        """
+        Looks up multiple keys with a single message, the node reads the keys
+        stored on the same node with one request.
+            Args:
+                data (memoryview): The keys, 32 bytes each.
+            Returns:
+                data (bytes): A DHT_SUCC or DHT_FAIL message per key, in request order.
+        """
+        keys = self._split_keys(data)
+        if keys is None:
+            logger.error("Malformed multi get message.")
+            return False
+        values = await self.chord_node.find_keys(keys)
+        return b"".join(
+            self._create_succ(key, val) if val else self._create_fail(key) for key, val in zip(keys, values)
+        )
+
+    async def _process_multi_put(self, data: memoryview):
+        """
+        Stores multiple key, value pairs with a single message, the node writes
+        the keys stored on the same node with one request.
+            Args:
+                data (memoryview): TTL (2 bytes), replication (1 byte), reserved (1 byte)
+                and the entries, each a 32 byte key, the value size (2 bytes) and the value.
+            Returns:
+                data (bytes): A DHT_FAIL message per key that did not reach the write quorum, None if all did.
+        """
+        ttl, replication, _ = struct.unpack_from(">HBB", data)
+        items = self._split_items(data[4:])
+        if items is None:
+            logger.error("Malformed multi put message.")
+            return False
+        hot_logger.info("Handling multi put message: {} keys [TTL {}, replication {}]", len(items), ttl, replication)
+        stored = set(await self.chord_node.put_keys(items, int(ttl)))
+        return b"".join(self._create_fail(key) for key, _ in items if key not in stored) or None
+
+    def reject(self, data: bytes):
+        """
+        Builds the DHT_FAIL reply to a message that is not processed, e.g. when the node is overloaded.
+            Args:
+                data (bytes): The whole message in bytes.
+            Returns:
+                create_failed (bytes): a byte message with DHT_FAIL status code
+                and the key of the message, False if the message is invalid.
+        """
+        msg_type = struct.unpack_from(">H", data, 2)[0]
+        if msg_type == DhtMessageCodes.DHT_PUT.value:
+            return self._create_fail(bytes(data[8:40]))
+        if msg_type == DhtMessageCodes.DHT_GET.value:
+            return self._create_fail(bytes(data[4:]))
+        if msg_type == DhtMessageCodes.DHT_MULTI_GET.value:
+            keys = self._split_keys(memoryview(data)[4:])
+        elif msg_type == DhtMessageCodes.DHT_MULTI_PUT.value:
+            keys = [key for key, _ in self._split_items(memoryview(data)[8:]) or []]
+        else:
+            return False
+        return b"".join(self._create_fail(key) for key in keys or []) or False
 
     @staticmethod
     def _create_fail(key):
@@ -95,7 +203,6 @@ class ApiService:
                 create_failed (bytes): a byte message with DHT_FAIL status code
                 and key
         """
-        print("kk", len(key))
         length = len(key) + 4
         return struct.pack(">HH", length, DhtMessageCodes.DHT_FAIL.value) + key
 
@@ -106,7 +213,7 @@ class ApiService:
         given key.
             Args:
                 key (bytes): The key as bytes
-                value (string): The value stored under the given key.
+                value (bytes): The value stored under the given key.
             Returns:
                 create_success (bytes): a byte message with DHT_SUCC status
                 code, the key and the value.
@@ -0,0 +1,88 @@
+import asyncio
+
+from loguru import logger
+
+
+class Coalescer:
+    """
+    Gathers calls of a batched remote method to the same peer for a few
+    milliseconds and sends them with a single RPC. A batched method takes a
+    list of items and returns a list with one result per item.
+    """
+
+    def __init__(self, call, delay: float, max_batch: int):
+        """
+        Args:
+            call (coroutine function): `call(addr, method, items)` sends a batch.
+            delay (float): Seconds to wait for more items before a batch is sent.
+            max_batch (int): A batch is sent right away once it has that many items.
+        """
+        self._call = call
+        self._delay = delay
+        self._max_batch = max_batch
+        self._batches = {}  # (addr, method) -> ([(item, future)], timer)
+        self._sending = set()
+
+    async def call(self, addr: str, method: str, item):
+        """
+        Call the batched remote `method` at `addr` for a single `item`.
+          Args:
+              addr (string): Address of the peer.
+              method (string): Name of the batched remote method.
+              item: The argument of this call.
+          Returns:
+              The result of the remote method for `item`.
+        """
+        if self._delay <= 0:
+            return (await self._call(addr, method, [item]))[0]
+        loop = asyncio.get_event_loop()
+        key = (addr, method)
+        if key not in self._batches:
+            self._batches[key] = ([], loop.call_later(self._delay, self._flush, key))
+        batch, _ = self._batches[key]
+        fut = loop.create_future()
+        batch.append((item, fut))
+        if len(batch) >= self._max_batch:
+            self._flush(key)
+        return await fut
+
+    def _flush(self, key: tuple):
+        batch, timer = self._batches.pop(key, (None, None))
+        if batch is None:
+            return
+        timer.cancel()
+        task = asyncio.ensure_future(self._send(key, batch))
+        self._sending.add(task)
+        task.add_done_callback(self._sending.discard)
+
+    async def _send(self, key: tuple, batch: list):
+        addr, method = key
+        try:
+            results = await self._call(addr, method, [item for item, _ in batch])
+        except asyncio.CancelledError:
+            self._fail(batch, ConnectionError("Connection pool closed"))
+            raise
+        except Exception as e:
+            logger.warning(f"Batched {method} of {len(batch)} items to {addr} failed: {e!r}")
+            self._fail(batch, e)
+            return
+        for (_, fut), result in zip(batch, results):
+            if not fut.done():
+                fut.set_result(result)
+
+    @staticmethod
+    def _fail(batch: list, exc: Exception):
+        for _, fut in batch:
+            if not fut.done():
+                fut.set_exception(exc)
+
+    def close(self):
+        """
+        Fails all calls that are still waiting for their batch to be sent or answered.
+        """
+        for batch, timer in self._batches.values():
+            timer.cancel()
+            self._fail(batch, ConnectionError("Connection pool closed"))
+        self._batches.clear()
+        for task in self._sending:
+            task.cancel()
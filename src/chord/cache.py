@@ -0,0 +1,61 @@
+import time
+from collections import OrderedDict
+from typing import Optional
+
+
+class HotCache:
+    """
+    Bounded in-memory LRU cache of already verified values, sized in bytes.
+    Entries expire together with the stored key.
+    """
+
+    def __init__(self, max_bytes: int):
+        self._max_bytes = max_bytes
+        self._size = 0
+        self._entries = OrderedDict()  # key -> (value, expire_time)
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key):
+        return key in self._entries
+
+    @property
+    def size(self) -> int:
+        return self._size
+
+    def get(self, key):
+        """
+        Returns the cached value of `key`, None if it is not cached or expired.
+        """
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        value, expire_time = entry
+        if expire_time is not None and expire_time <= time.time():
+            self.invalidate(key)
+            return None
+        self._entries.move_to_end(key)
+        return value
+
+    def put(self, key, value, expire_time: Optional[float] = None):
+        """
+        Caches `value` until `expire_time`, evicting the least recently used values if needed.
+        """
+        if len(value) > self._max_bytes:
+            return
+        self.invalidate(key)
+        self._entries[key] = (value, expire_time)
+        self._size += len(value)
+        while self._size > self._max_bytes:
+            _, (evicted, _) = self._entries.popitem(last=False)
+            self._size -= len(evicted)
+
+    def invalidate(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self._size -= len(entry[0])
+
+    def clear(self):
+        self._entries.clear()
+        self._size = 0
@@ -0,0 +1,36 @@
+import msgpack
+from aiomas.codecs import Codec
+
+# msgpack extension type of integers wider than 64 bits, e.g. 160 bit ring ids
+_BIG_INT = 1
+
+
+class MsgPack(Codec):
+    """
+    Binary codec for the chord RPCs, keys and values are sent as raw bytes
+    instead of hex strings. Unlike `aiomas.codecs.MsgPack` it supports ring ids
+    wider than 64 bits, works with msgpack >= 1.0 and decodes arrays as lists.
+    """
+
+    def _default(self, obj):
+        if isinstance(obj, int):
+            return msgpack.ExtType(_BIG_INT, obj.to_bytes((obj.bit_length() + 8) // 8, "big", signed=True))
+        return self.serialize_obj(obj)
+
+    @staticmethod
+    def _ext_hook(code: int, data: bytes):
+        if code == _BIG_INT:
+            return int.from_bytes(data, "big", signed=True)
+        return msgpack.ExtType(code, data)
+
+    def encode(self, data):
+        return msgpack.packb(data, default=self._default, use_bin_type=True)
+
+    def decode(self, data):
+        return msgpack.unpackb(
+            data,
+            object_hook=self.deserialize_obj,
+            ext_hook=self._ext_hook,
+            raw=False,
+            strict_map_key=False,
+        )
@@ -0,0 +1,97 @@
+from bisect import bisect_left
+from typing import List, Optional
+
+from chord.helpers import ring
+
+
+class FingerTable:
+    """
+    Finger table of a node kept as parallel arrays of node ids and addresses.
+    Consecutive fingers usually point to the same node, so lookups go through
+    an index of the distinct fingers sorted by their distance from the owner,
+    which is rebuilt lazily after the table changed.
+    """
+
+    __slots__ = ("_owner_id", "_ids", "_addrs", "_dists", "_nodes", "_dirty")
+
+    def __init__(self, owner_id: int, size: int):
+        self._owner_id = owner_id
+        self._ids = [-1] * size
+        self._addrs = [""] * size
+        self._dists = []
+        self._nodes = []
+        self._dirty = True
+
+    def __len__(self):
+        return len(self._ids)
+
+    def __getitem__(self, i: int) -> Optional[dict]:
+        if self._ids[i] == -1:
+            return None
+        return {"addr": self._addrs[i], "numeric_id": self._ids[i]}
+
+    def __setitem__(self, i: int, node: dict):
+        if self._ids[i] != node["numeric_id"] or self._addrs[i] != node["addr"]:
+            self._ids[i] = node["numeric_id"]
+            self._addrs[i] = node["addr"]
+            self._dirty = True
+
+    def fill(self, node: dict):
+        """
+        Point every finger to `node`.
+        """
+        self._ids = [node["numeric_id"]] * len(self._ids)
+        self._addrs = [node["addr"]] * len(self._addrs)
+        self._dirty = True
+
+    def replace(self, addr: str, node: dict):
+        """
+        Point every finger that points to `addr` to `node` instead.
+        """
+        for i, finger_addr in enumerate(self._addrs):
+            if finger_addr == addr:
+                self._ids[i] = node["numeric_id"]
+                self._addrs[i] = node["addr"]
+                self._dirty = True
+
+    def _rebuild(self):
+        distinct = {}
+        for numeric_id, addr in zip(self._ids, self._addrs):
+            if numeric_id != -1:
+                distinct[numeric_id] = addr
+        dists = sorted(((numeric_id - self._owner_id) & ring.mask, numeric_id) for numeric_id in distinct)
+        self._dists = [dist for dist, _ in dists]
+        self._nodes = [{"addr": distinct[numeric_id], "numeric_id": numeric_id} for _, numeric_id in dists]
+        self._dirty = False
+
+    def closest_preceding(self, numeric_id: int) -> Optional[dict]:
+        """
+        Binary search for the finger closest to `numeric_id` that lies strictly
+        between the owner and `numeric_id` on the ring.
+          Args:
+              numeric_id (int): The id to look up.
+
+          Returns:
+              node (dict): The closest preceding finger, None if no finger precedes the id.
+        """
+        if self._dirty:
+            self._rebuild()
+        dist = (numeric_id - self._owner_id) & ring.mask or ring.size
+        pos = bisect_left(self._dists, dist) - 1
+        if pos < 0 or self._dists[pos] == 0:
+            return None
+        return self._nodes[pos]
+
+    def runs(self) -> List[dict]:
+        """
+        The fingers grouped into runs of consecutive entries that point to the same node.
+        """
+        runs = []
+        start = 0
+        for i in range(1, len(self._ids) + 1):
+            if i == len(self._ids) or self._ids[i] != self._ids[start] or self._addrs[i] != self._addrs[start]:
+                runs.append(
+                    {"fingers": f"{start}-{i - 1}", "addr": self._addrs[start], "numeric_id": self._ids[start]}
+                )
+                start = i
+        return runs
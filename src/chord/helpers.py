@@ -1,45 +1,94 @@
 import hashlib
-from typing import Union
+from typing import List, Union
 
 from config.config import dht_config
 
+# sha1 digest size
+HASH_BITS = 160
 
-def generate_id(key: Union[bytes, str]) -> str:
+
+class RingGeometry:
+    """
+    Constants of the identifier ring, computed once from the configured
+    number of id bits so the hot paths do not have to parse the config.
+    """
+
+    __slots__ = ("bits", "size", "mask", "id_bytes", "hash_shift", "finger_offsets")
+
+    def __init__(self, bits: int):
+        if not 0 < bits <= HASH_BITS:
+            raise ValueError(f"Ring ids must have between 1 and {HASH_BITS} bits, got {bits}.")
+        self.bits = bits
+        self.size = 1 << bits
+        self.mask = self.size - 1
+        self.id_bytes = (bits + 7) // 8
+        self.hash_shift = HASH_BITS - bits
+        self.finger_offsets = tuple(1 << i for i in range(bits))
+
+    def finger_start(self, node_id: int, i: int) -> int:
+        """
+        Start of the i-th finger interval of the node with `node_id`.
+        """
+        return (node_id + self.finger_offsets[i]) & self.mask
+
+
+ring = RingGeometry(int(dht_config["finger_table_sz"]))
+
+
+def generate_id(key: Union[bytes, str, int]) -> int:
     """Generate id for key or node on the ring.
       Args:
-          key (string): Key or node-ip to hash
+          key (string): Key or node-ip to hash, ids of other keys are hashed as
+          their big endian bytes. Raw API keys are hashed in their hex form, which
+          keeps keys at the ring position they had when the API passed them as hex.
 
       Returns:
-          string: the first m bits from the key hash.
+          int: the first m bits from the key hash.
     """
     _key = key
-    if not isinstance(_key, bytes):
+    if isinstance(_key, int):
+        _key = key.to_bytes(ring.id_bytes, "big")
+    elif isinstance(_key, bytes):
+        _key = key.hex().encode("ascii")
+    else:
         _key = key.encode("utf-8")
 
-    key_hash = hashlib.sha1(_key).hexdigest()
     # get first m bits from hash
-    return key_hash[: int(dht_config["finger_table_sz"]) // 4]
+    return int.from_bytes(hashlib.sha1(_key).digest(), "big") >> ring.hash_shift
+
+
+def replica_ids(key: Union[bytes, str, int], count: int) -> List[int]:
+    """Generate the dht keys of the replicas of a key, each one is the id of the previous.
+      Args:
+          key (string): Key to replicate.
+          count (int): Number of copies, including the primary one.
+
+      Returns:
+          list: the `count` dht keys, primary first.
+    """
+    ids = []
+    for _ in range(count):
+        key = generate_id(key)
+        ids.append(key)
+    return ids
 
 
 def gen_finger(addr: str):
     """
     Generate an entry in the finger table.
     """
-    _id = generate_id(addr.encode("utf-8"))
-    ring_sz = 2 ** (int(dht_config["finger_table_sz"]))
-    return {"addr": addr, "id": _id, "numeric_id": int(_id, 16) % ring_sz}
+    return {"addr": addr, "numeric_id": generate_id(addr)}
 
 
 def between(_id: int, left: int, right: int, inclusive_left=False, inclusive_right=True) -> bool:
     """
     Check if _id lies between left and right in a circular ring.
     """
-    ring_sz = 2 ** (int(dht_config["finger_table_sz"]))
     if left != right:
         if inclusive_left:
-            left = (left - 1 + ring_sz) % ring_sz
+            left = (left - 1) & ring.mask
         if inclusive_right:
-            right = (right + 1) % ring_sz
+            right = (right + 1) & ring.mask
     if left < right:
         return left < _id < right
     else:
@@ -0,0 +1,71 @@
+import time
+from bisect import bisect_left
+from typing import Optional
+
+from chord.helpers import ring
+
+
+class LocationCache:
+    """
+    Remembers which node was responsible for recently looked up ids.
+    For every known node it keeps the widest span of ids in front of it that
+    a lookup resolved to it: every id between a looked up id and its successor
+    belongs to that successor as well.
+    """
+
+    def __init__(self, ttl: float, max_nodes: int):
+        self._ttl = ttl
+        self._max_nodes = max_nodes
+        self._ids = []  # sorted ids of the cached nodes
+        self._entries = {}  # node id -> (node, span, expire_time), oldest first
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, numeric_id: int) -> Optional[dict]:
+        """
+        The node responsible for `numeric_id`, if it is known.
+        """
+        if not self._ids:
+            return None
+        pos = bisect_left(self._ids, numeric_id)
+        node_id = self._ids[pos % len(self._ids)]
+        node, span, expire_time = self._entries[node_id]
+        if expire_time <= time.monotonic():
+            self._remove(node_id)
+            return None
+        if (node_id - numeric_id) & ring.mask > span:
+            return None
+        return node
+
+    def add(self, numeric_id: int, node: dict):
+        """
+        Records that a lookup for `numeric_id` resolved to `node`.
+        """
+        node_id = node["numeric_id"]
+        span = (node_id - numeric_id) & ring.mask
+        entry = self._entries.pop(node_id, None)
+        if entry is None:
+            pos = bisect_left(self._ids, node_id)
+            self._ids.insert(pos, node_id)
+        elif entry[0]["addr"] == node["addr"] and entry[2] > time.monotonic():
+            span = max(span, entry[1])
+        self._entries[node_id] = (node, span, time.monotonic() + self._ttl)
+        if len(self._entries) > self._max_nodes:
+            self._remove(next(iter(self._entries)))
+
+    def _remove(self, node_id: int):
+        del self._entries[node_id]
+        del self._ids[bisect_left(self._ids, node_id)]
+
+    def invalidate(self, addr: str):
+        """
+        Forgets the node at `addr`, e.g. after an RPC to it failed.
+        """
+        for node_id, (node, _, _) in list(self._entries.items()):
+            if node["addr"] == addr:
+                self._remove(node_id)
+
+    def clear(self):
+        self._ids = []
+        self._entries = {}
@@ -0,0 +1,62 @@
+import random
+
+from loguru import logger
+
+from config.config import dht_config
+
+
+class HotLogger:
+    """
+    Logger for per-request messages on hot paths. Messages take loguru format
+    arguments instead of f-strings and are only formatted when a handler emits
+    them, callable arguments are only evaluated then as well. Messages below
+    `level` return before any loguru call, of the others only a `sample_rate`
+    share is passed to loguru at all.
+    """
+
+    def __init__(self, sample_rate: float = 1, log_values: bool = True, level: str = "DEBUG"):
+        self.sample_rate = sample_rate
+        self.log_values = log_values
+        self.set_level(level)
+
+    def set_level(self, level: str):
+        """
+        Sets the lowest level that is passed to loguru, keep it in line with the loguru handlers.
+        """
+        min_level = logger.level(level).no
+        self._debug = logger.level("DEBUG").no >= min_level
+        self._info = logger.level("INFO").no >= min_level
+        self._warning = logger.level("WARNING").no >= min_level
+
+    def _log(self, level: str, message: str, args: tuple):
+        if self.sample_rate < 1 and random.random() >= self.sample_rate:
+            return
+        args = [arg if callable(arg) else (lambda arg=arg: arg) for arg in args]
+        logger.opt(lazy=True, depth=2).log(level, message, *args)
+
+    def debug(self, message: str, *args):
+        if self._debug:
+            self._log("DEBUG", message, args)
+
+    def info(self, message: str, *args):
+        if self._info:
+            self._log("INFO", message, args)
+
+    def warning(self, message: str, *args):
+        if self._warning:
+            self._log("WARNING", message, args)
+
+    def value(self, value):
+        """
+        Format argument for a stored value, only its size unless `log_values` is set.
+        """
+        if self.log_values:
+            return lambda: value
+        return lambda: f"<{len(value)} bytes>"
+
+
+hot_logger = HotLogger(
+    sample_rate=float(dht_config["log_sample_rate"]),
+    log_values=dht_config.getboolean("log_values"),
+    level=dht_config["log_level"],
+)
@@ -0,0 +1,45 @@
+import hashlib
+from typing import Iterable, List
+
+from chord.helpers import ring
+
+
+def interval_length(left: int, right: int) -> int:
+    """
+    Number of ids in the ring interval (left, right], the whole ring if left == right.
+    """
+    return (right - left) & ring.mask or ring.size
+
+
+def split(left: int, right: int, fanout: int) -> List[tuple]:
+    """
+    Splits the ring interval (left, right] into `fanout` consecutive intervals of
+    (almost) equal length, these are the children of the interval in the hash tree.
+    """
+    length = interval_length(left, right)
+    bounds = [(left + length * k // fanout) & ring.mask for k in range(fanout + 1)]
+    return list(zip(bounds, bounds[1:]))
+
+
+def summarize(digests: Iterable[list], left: int, right: int, fanout: int) -> List[list]:
+    """
+    Hash and number of the stored values in each child of the ring interval (left, right].
+    A child's hash covers the ids and value digests, so changed values show as well.
+      Args:
+          digests (list): [id, value digest] of the stored values within the interval,
+          in ring order starting after `left`.
+          left (int): Start of the interval (exclusive).
+          right (int): End of the interval (inclusive).
+          fanout (int): Number of children.
+      Returns:
+          list: [hash, count] of every child as returned by `split`.
+    """
+    length = interval_length(left, right)
+    hashes = [hashlib.sha1() for _ in range(fanout)]
+    counts = [0] * fanout
+    for numeric_id, digest in digests:
+        child = (((numeric_id - left) & ring.mask) * fanout - 1) // length
+        hashes[child].update(numeric_id.to_bytes(ring.id_bytes, "big"))
+        hashes[child].update(digest)
+        counts[child] += 1
+    return [[child.hexdigest(), count] for child, count in zip(hashes, counts)]
@@ -1,7 +1,19 @@
 import asyncio
+import functools
+import itertools
 import os
+import random
+import time
+from typing import List, Union
 
-from chord.helpers import generate_id, between, print_table
+import aiomas
+
+from chord.fingers import FingerTable
+from chord.helpers import generate_id, between, print_table, replica_ids, ring
+from chord.location import LocationCache
+from chord.log import hot_logger
+from chord.merkle import interval_length, split, summarize
+from chord.pool import ConnectionPool
 from chord.rpc import *
 from chord.storage import Storage
 from config.config import dht_config
@@ -14,29 +26,74 @@ class Node:
 
     router = aiomas.rpc.Service()
 
+    # replica placement modes
+    REPLICATION_HASH = "hash"
+    REPLICATION_SUCCESSORS = "successors"
+
     def __init__(self, host: str, port: str):
         self._addr = f"{host}:{port}"
-        self._id = generate_id(self._addr.encode("utf-8"))
-
-        ring_sz = 2 ** (int(dht_config["finger_table_sz"]))
-        self._numeric_id = int(self._id, 16) % ring_sz
+        self._numeric_id = generate_id(self._addr)
+        # hex form of the id, the HMAC key of the values stored by every version so far
+        self._id = f"{self._numeric_id:0{ring.bits // 4}x}"
 
         self._MAX_STEPS = int(dht_config["max_steps"])
         self._MAX_SUCC = int(dht_config["max_succ"])
         self._REPLICATION_COUNT = 3
+        self._REPLICATION_MODE = dht_config["replication_mode"]
+        self._LOOKUP_MODE = dht_config["lookup_mode"]
+        self._RPC_TIMEOUT = float(dht_config["rpc_timeout"])
+        self._HEDGE_DELAY = float(dht_config["read_hedge_delay"])
+        self._WRITE_QUORUM = int(dht_config["write_quorum"])
+        self._READ_QUORUM = int(dht_config["read_quorum"])
 
-        self._fingers = [
-            {"addr": "", "id": "", "numeric_id": -1} for _ in range(int(dht_config["finger_table_sz"]))
-        ]
+        self._fingers = FingerTable(self._numeric_id, ring.bits)
 
         self._predecessor = None
         self._successor = None
 
-        self._storage = Storage(node_id=self._id)
+        self._storage = Storage(
+            node_id=self._id,
+            cache_bytes=int(dht_config["hot_cache_bytes"]),
+            verify_reads=dht_config["verify_reads"],
+            verify_sample_rate=float(dht_config["verify_sample_rate"]),
+        )
 
         # for stabilization
         self._successors = [None for _ in range(self._MAX_SUCC)]
         self._next = 0
+        self._MIN_FIX_INTERVAL = float(dht_config["fix_interval"])
+        self._MAX_FIX_INTERVAL = float(dht_config["max_fix_interval"])
+        self._FIX_JITTER = float(dht_config["fix_jitter"])
+        self._BULK_REFRESH = dht_config["finger_refresh"] == "bulk"
+        # set when churn is noticed outside of the maintenance rounds
+        self._churn = asyncio.Event()
+
+        # keys of our range still held by the successor we joined in front of
+        self._handoff = None
+        self._HANDOFF_BATCH = int(dht_config["handoff_batch_size"])
+        self._HANDOFF_RETRIES = int(dht_config["handoff_retries"])
+        self._HANDOFF_MAX_BACKOFF = float(dht_config["handoff_max_backoff"])
+        # range we still hand off to our new predecessor, writes to it are accepted meanwhile
+        self._handing_off = None
+        # set while leaving the ring, writes are rejected from then on
+        self._leaving = False
+
+        # anti-entropy with our successors
+        self._ANTI_ENTROPY_SUCCESSORS = int(dht_config["anti_entropy_successors"])
+        self._MERKLE_FANOUT = int(dht_config["merkle_fanout"])
+        self._MERKLE_LEAF_SIZE = int(dht_config["merkle_leaf_size"])
+
+        # owners of recently looked up keys
+        self._locations = LocationCache(
+            ttl=float(dht_config["location_cache_ttl"]), max_nodes=int(dht_config["location_cache_size"])
+        )
+
+        # pending recursive lookups started by this node
+        self._lookups = {}
+        self._lookup_ids = itertools.count()
+
+        # background tasks, referenced until they are done
+        self._background = set()
 
         tls_dir = os.environ.get("TLS_DIR", "node_1")
 
@@ -49,6 +106,16 @@ class Node:
             keyfile=os.path.join(certs_dir, "node.key"),
         )
         self.client_ssl_ctx.check_hostname = False
+        self._pool = ConnectionPool(
+            self.client_ssl_ctx,
+            max_size=int(dht_config["pool_max_size"]),
+            idle_timeout=float(dht_config["pool_idle_timeout"]),
+            multiplex=dht_config.getboolean("rpc_multiplex"),
+            max_in_flight=int(dht_config["rpc_max_in_flight"]),
+            call_timeout=float(dht_config["rpc_timeout"]),
+            batch_delay=float(dht_config["rpc_batch_delay"]),
+            max_batch=int(dht_config["rpc_max_batch"]),
+        )
 
     ##################################
     # Node Initialization(s)
@@ -59,9 +126,7 @@ class Node:
         Generate empty finger table with my address as fingers.
         """
         addr = self._successor["addr"] if self._successor else self._addr
-        _id = generate_id(addr.encode("utf-8"))
-        for i in range(int(dht_config["finger_table_sz"])):
-            self._fingers[i] = {"addr": addr, "id": _id, "numeric_id": int(_id, 16)}
+        self._fingers.fill(gen_finger(addr))
 
         self._successor = self._fingers[0]
         self._successors = [self._successor.copy() for _ in range(len(self._successors))]
@@ -74,14 +139,17 @@ class Node:
         else:
             if self._successor is None:
                 _, self._successor = await rpc_ask_for_succ(
-                    gen_finger(bootstrap_node), self._numeric_id, ssl_ctx=self.client_ssl_ctx,
+                    gen_finger(bootstrap_node), self._numeric_id, pool=self._pool,
                 )
                 self._init_empty_fingers()
-                # get keys from succ
-                keys, values = await rpc_get_all_keys(
-                    next_node=self._successor, node_id=self._numeric_id, ssl_ctx=self.client_ssl_ctx,
-                )
-                self._storage.put_keys(keys, values)
+                if self._BULK_REFRESH:
+                    self._spawn(self.refresh_fingers())
+                # our range starts after the predecessor of our successor, which owns
+                # the whole ring while it is alone
+                pred, _ = await rpc_ask_for_pred_and_succlist(self._successor["addr"], pool=self._pool)
+                # get keys from succ, in the background so we serve our range right away
+                self._handoff = {"source": self._successor.copy(), "after": (pred or self._successor)["numeric_id"]}
+                self._spawn(self._pull_keys())
             else:
                 raise Exception("Attempting to join after joining before.")
 
@@ -91,6 +159,21 @@ class Node:
         self._predecessor = None
         self._init_empty_fingers()
 
+    def _spawn(self, coro) -> asyncio.Future:
+        """
+        Runs `coro` in the background, keeping a reference to it until it is done.
+        Failures are logged.
+        """
+        task = asyncio.ensure_future(coro)
+        self._background.add(task)
+        task.add_done_callback(self._background_done)
+        return task
+
+    def _background_done(self, task: asyncio.Future):
+        self._background.discard(task)
+        if not task.cancelled() and task.exception() is not None:
+            logger.error(f"Background task failed: {task.exception()!r}")
+
     ##################################
     # Find Successor
     ##################################
@@ -103,19 +186,7 @@ class Node:
           Returns:
               node (dict): the closest preceding node.
         """
-        for i in range(len(self._fingers) - 1, -1, -1):
-            if self._fingers[i]["numeric_id"] != -1:
-                if between(
-                    self._fingers[i]["numeric_id"],
-                    self._numeric_id,
-                    numeric_id,
-                    inclusive_left=False,
-                    inclusive_right=False,
-                ):
-                    # logger.info(
-                    #     f"Using finger {i} => {self._fingers[i]} {numeric_id} is between ({self._fingers[i]['numeric_id']},{self._numeric_id}]")
-                    return self._fingers[i]
-        return self._successor
+        return self._fingers.closest_preceding(numeric_id) or self._successor
 
     def _find_successor(self, _numeric_id: int):
         """
@@ -144,7 +215,10 @@ class Node:
     @aiomas.expose
     async def find_successor(self, numeric_id: int):
         """
-        Find the successor for a given node id.
+        Find the successor for a given node id using the configured `lookup_mode`:
+            * nested: ask the next node, which runs its own lookup (hop-by-hop).
+            * iterative: walk the path ourselves, asking each hop for its closest node.
+            * recursive: forward the query along the path and let the last hop reply to us.
           Args:
               numeric_id (int): The numeric id of the node.
 
@@ -153,26 +227,145 @@ class Node:
               successor (dict): The successor if it exists.
         """
         found, next_node = self._find_successor(numeric_id)
+        if found:
+            return True, next_node
+        if self._LOOKUP_MODE == "iterative":
+            return await self._find_successor_iterative(numeric_id, next_node)
+        if self._LOOKUP_MODE == "recursive":
+            return await self._find_successor_recursive(numeric_id, next_node)
+
         i = 0
         while not found and i < self._MAX_STEPS:
-            found, next_node = await rpc_ask_for_succ(next_node, numeric_id, ssl_ctx=self.client_ssl_ctx)
+            found, next_node = await rpc_ask_for_succ(next_node, numeric_id, pool=self._pool)
             i += 1
         if found:
             return True, next_node
         return False, None
 
+    async def _find_successor_iterative(self, numeric_id: int, next_node: dict):
+        """
+        Walk the lookup path from this node, every hop only answers with its
+        successor or its closest preceding finger for `numeric_id`.
+        """
+        for _ in range(self._MAX_STEPS):
+            found, next_node = await rpc_find_successor_step(next_node, numeric_id, pool=self._pool)
+            if found:
+                return True, next_node
+            if next_node is None:
+                break
+        return False, None
+
+    async def _find_successor_recursive(self, numeric_id: int, next_node: dict):
+        """
+        Hand the lookup to the next hop and wait for the responsible node to
+        deliver the successor straight back to us.
+        """
+        request_id = next(self._lookup_ids)
+        reply = asyncio.get_event_loop().create_future()
+        self._lookups[request_id] = reply
+        try:
+            sent = await rpc_route_successor(
+                next_node, numeric_id, self._addr, request_id, self._MAX_STEPS - 1, pool=self._pool
+            )
+            if not sent:
+                return False, None
+            succ = await asyncio.wait_for(reply, self._RPC_TIMEOUT)
+        except asyncio.TimeoutError:
+            logger.warning(f"Recursive lookup for {numeric_id} timed out.")
+            succ = None
+        finally:
+            self._lookups.pop(request_id, None)
+        return succ is not None, succ
+
+    @aiomas.expose
+    def find_successor_step(self, numeric_id: int):
+        """
+        A single step of an iterative lookup.
+          Args:
+              numeric_id (int): The numeric id of the node.
+
+          Returns:
+              found (bool): Whether the returned node is the successor.
+              node (dict): The successor or the next node to ask.
+        """
+        return self._find_successor(numeric_id)
+
+    @aiomas.expose
+    def route_successor(self, numeric_id: int, origin: str, request_id: int, hops: int):
+        """
+        Forward a recursive lookup, the answer is delivered to `origin` by the last hop.
+          Args:
+              numeric_id (int): The numeric id of the node.
+              origin (string): Address of the node that started the lookup.
+              request_id (int): Id of the lookup at the origin.
+              hops (int): How many more times the lookup may be forwarded.
+        """
+        self._spawn(self._route_successor(numeric_id, origin, request_id, hops))
+        return True
+
+    async def _route_successor(self, numeric_id: int, origin: str, request_id: int, hops: int):
+        found, next_node = self._find_successor(numeric_id)
+        if not found:
+            sent = hops > 0 and await rpc_route_successor(
+                next_node, numeric_id, origin, request_id, hops - 1, pool=self._pool
+            )
+            if sent:
+                return
+            # tell the origin right away instead of letting it time out
+            next_node = None
+        await rpc_deliver_successor(origin, request_id, next_node, pool=self._pool)
+
+    @aiomas.expose
+    def deliver_successor(self, request_id: int, successor: Optional[dict]):
+        """
+        Receives the result of a recursive lookup started by this node.
+          Args:
+              request_id (int): Id of the lookup.
+              successor (dict): The successor or None if the lookup failed.
+        """
+        reply = self._lookups.get(request_id)
+        if reply is not None and not reply.done():
+            reply.set_result(successor)
+
+    async def _locate(self, numeric_id: int, use_cache: bool = True):
+        """
+        Find the node responsible for a key, answering from the location cache
+        when the owner was resolved recently.
+          Args:
+              numeric_id (int): The numeric id of the key.
+              use_cache (bool): Whether a cached owner may be returned.
+
+          Returns:
+              found (bool): Whether or not a successor exist.
+              successor (dict): The successor if it exists.
+              cached (bool): Whether the successor came from the cache.
+        """
+        if use_cache:
+            node = self._locations.get(numeric_id)
+            if node is not None:
+                return True, node, True
+        found, node = await self.find_successor(numeric_id)
+        if found:
+            self._locations.add(numeric_id, node)
+        return found, node, False
+
     ##################################
     # Network Stabilization
     ##################################
 
-    async def check_predecessor(self):
-        _fix_interval = int(dht_config["fix_interval"])
-        while True:
-            await asyncio.sleep(_fix_interval)
-            if self._predecessor:
-                res = await rpc_ping(self._predecessor["addr"], ssl_ctx=self.client_ssl_ctx)
-                if not res:
-                    self._predecessor = None
+    async def check_predecessor(self) -> bool:
+        """
+        Forgets the predecessor if it does not answer anymore.
+          Returns:
+              bool: Whether the predecessor failed.
+        """
+        if self._predecessor:
+            res = await rpc_ping(self._predecessor["addr"], pool=self._pool)
+            if not res:
+                self._predecessor = None
+                self._handing_off = None
+                return True
+        return False
 
     @aiomas.expose
     def get_pred_and_succlist(self):
@@ -183,83 +376,212 @@ class Node:
         """
         return self._predecessor, self._successors
 
-    async def stabilize(self):
+    async def stabilize(self) -> bool:
         """
-        Called periodically. verifies current node’s successor, and tells the
-        successor about the current node.
+        verifies current node’s successor, and tells the successor about the current node.
+          Returns:
+              bool: Whether the successor or successor list changed or the successor failed.
         """
         # if succ not yet set don't run stabilize
-        _fix_interval = int(dht_config["fix_interval"])
+        if not self._successor:
+            return False
+        # logger.info("Stabilizing the network")
+        successors = list(self._successors)
+        try:
+            pred, succ_list = await rpc_ask_for_pred_and_succlist(self._successor["addr"], pool=self._pool)
+            if pred is not None:
+                if between(
+                    pred["numeric_id"],
+                    self._numeric_id,
+                    self._successor["numeric_id"],
+                    inclusive_right=False,
+                    inclusive_left=False,
+                ):
+                    self._successor = pred.copy()
+                    self._fingers[0] = self._successor
+                    self._locations.clear()
+            self._successors = [self._successor] + succ_list[:-1]
+            await rpc_notify(self._successor["addr"], self._addr, pool=self._pool)
+        except Exception as e:
+            logger.error(e)
+            logger.error("Succ is no longer working switch to next succ.")
+            logger.info(self._successor)
+            self._abort_handoff(self._successor["addr"])
+            self._locations.clear()
+            self._successors = self._successors[1:]
+            if len(self._successors) == 0:
+                self._successors.append(gen_finger(self._addr))
+                self._successor = self._successors[0].copy()
+            else:
+                self._successor = self._successors[0].copy()
+            return True
+        return self._successors != successors
+
+    async def fix_fingers(self) -> bool:
+        """
+        Updates the next finger of the finger table to fix entries in case of change.
+          Returns:
+              bool: Whether the finger changed or could not be looked up.
+        """
+        self._next = (self._next + 1) % len(self._fingers)
+        next_id = ring.finger_start(self._numeric_id, self._next)
+        found, succ = await self.find_successor(next_id)
+        # logger.info(f"Result for fixing finger {self._next} {next_id} => {found} {succ}")
+        if not found:
+            logger.warning("No suitable node found to fix this finger.")
+            return True
+        if self._fingers[self._next] == succ:
+            return False
+        # logger.info(f"Finger {self._next} updated from {self._fingers[self._next]['addr']} to {succ}.")
+        self._fingers[self._next] = succ
+        # # TODO: optimization need to check for correctness
+        for i in range(self._next + 1, len(self._fingers)):
+            __id = ring.finger_start(self._numeric_id, i)
+            if between(
+                __id, self._numeric_id, succ["numeric_id"], inclusive_right=False, inclusive_left=False,
+            ):
+                self._fingers[i] = succ
+        # print_table(self._fingers)
+        return True
+
+    async def refresh_fingers(self) -> bool:
+        """
+        Rebuilds the whole finger table in one walk around the ring. The node found
+        for a finger is also the finger of all following fingers up to that node, and
+        its successor list resolves the fingers up to the last successor, so only one
+        lookup and one successor list RPC per distinct finger are needed.
+          Returns:
+              bool: Whether a finger changed or could not be looked up.
+        """
+        changed = False
+        i = 0
+        while i < len(self._fingers):
+            found, succ = await self.find_successor(ring.finger_start(self._numeric_id, i))
+            if not found:
+                logger.warning("No suitable node found to fix this finger.")
+                changed = True
+                i += 1
+                continue
+            i, assigned = self._assign_fingers(i, [succ] + await self._successor_list_of(succ))
+            changed = changed or assigned
+        return changed
+
+    async def _successor_list_of(self, node: dict) -> List[dict]:
+        """
+        The successor list of `node`, empty if it could not be fetched.
+        """
+        if node["addr"] == self._addr:
+            return list(self._successors)
+        try:
+            _, succ_list = await rpc_ask_for_pred_and_succlist(node["addr"], pool=self._pool)
+            return succ_list
+        except Exception as e:
+            logger.error(e)
+            return []
+
+    def _assign_fingers(self, i: int, known: List[dict]) -> tuple:
+        """
+        Points finger `i` and the following fingers to the first of the `known` nodes,
+        the looked up successor followed by its successor list, at or after their start.
+          Args:
+              i (int): The first finger to assign.
+              known (list): Nodes in ring order starting with the successor of finger `i`.
+          Returns:
+              int: The first finger that is not assigned yet.
+              bool: Whether a finger changed.
+        """
+        changed = False
+        start = i
+        bound = 0
+        for node in known:
+            if not node:
+                break
+            # distance from us, the nodes of the list are ordered until it wraps around us
+            dist = (node["numeric_id"] - self._numeric_id) & ring.mask or ring.size
+            if dist <= bound:
+                break
+            while i < len(self._fingers) and ring.finger_offsets[i] <= dist:
+                if self._fingers[i] != node:
+                    self._fingers[i] = node
+                    changed = True
+                i += 1
+            bound = dist
+        if i == start:
+            # the lookup returned a node in front of the finger, keep it anyway
+            self._fingers[i] = known[0]
+            i += 1
+        return i, changed
+
+    def _next_interval(self, interval: float, changed: bool) -> float:
+        """
+        The wait before the next maintenance round: back to `fix_interval` after
+        churn, else twice the previous wait up to `max_fix_interval`.
+        """
+        if changed:
+            return self._MIN_FIX_INTERVAL
+        return min(interval * 2, self._MAX_FIX_INTERVAL)
+
+    async def maintain(self):
+        """
+        Runs the periodic maintenance of the node: every round checks the predecessor,
+        stabilizes and fixes one finger, or in the `bulk` finger refresh mode all
+        fingers at once after a round that saw churn. While the rounds change nothing the wait
+        between them backs off exponentially, a change, failed RPC or a new
+        predecessor notifying us speeds them up again. Waits are jittered by
+        `fix_jitter` so nodes do not run their rounds in lockstep.
+        """
         print_interval = 60
-        time_since_last_print = print_interval
+        last_print = time.monotonic()
+        interval = self._MIN_FIX_INTERVAL
+        changed = False
         while True:
-            await asyncio.sleep(_fix_interval)
-            if not self._successor:
-                continue
-            # logger.info("Stabilizing the network")
+            self._churn.clear()
+            wait = interval * random.uniform(1 - self._FIX_JITTER, 1 + self._FIX_JITTER)
             try:
-                pred, succ_list = await rpc_ask_for_pred_and_succlist(
-                    self._successor["addr"], ssl_ctx=self.client_ssl_ctx
-                )
-                if pred is not None:
-                    if between(
-                        pred["numeric_id"],
-                        self._numeric_id,
-                        self._successor["numeric_id"],
-                        inclusive_right=False,
-                        inclusive_left=False,
-                    ):
-                        self._successor = pred.copy()
-                        self._fingers[0] = self._successor
-                self._successors = [self._successor] + succ_list[:-1]
-                await rpc_notify(self._successor["addr"], self._addr, ssl_ctx=self.client_ssl_ctx)
-            except Exception as e:
-                logger.error(e)
-                logger.error("Succ is no longer working switch to next succ.")
-                logger.info(self._successor)
-                self._successors = self._successors[1:]
-                if len(self._successors) == 0:
-                    self._successors.append(gen_finger(self._addr))
-                    self._successor = self._successors[0].copy()
-                else:
-                    self._successor = self._successors[0].copy()
+                await asyncio.wait_for(self._churn.wait(), wait)
+            except asyncio.TimeoutError:
+                pass
+            bulk = self._BULK_REFRESH and (changed or self._churn.is_set())
+            fingers = self.refresh_fingers if bulk else self.fix_fingers
+            changed = self._churn.is_set()
+            for step in (self.check_predecessor, self.stabilize, fingers):
+                try:
+                    changed = await step() or changed
+                except Exception as e:
+                    logger.error(e)
+                    changed = True
+            interval = self._next_interval(interval, changed)
 
-            # logger.debug("Dumping after stabilizing the network...")
-            time_since_last_print -= _fix_interval
-            if time_since_last_print <= 0:
-                time_since_last_print = print_interval
+            if time.monotonic() - last_print >= print_interval:
+                last_print = time.monotonic()
                 self.dump_me()
-            # logger.info(f"Sleeping for {SECS_TO_WAIT} secs before stabilizing again")
 
-    async def fix_fingers(self):
+    async def scrub(self):
         """
-        Updates finger table to fix entries in case of change.
+        Verifies the integrity tags of the stored values in the background and
+        deletes corrupted ones, unless every read verifies them anyway.
+        A batch is verified in small slices, yielding to the event loop between them.
         """
-        _fix_interval = int(dht_config["fix_interval"])
+        if dht_config["verify_reads"] == Storage.VERIFY_ALWAYS:
+            return
+        _scrub_interval = float(dht_config["scrub_interval"])
+        _scrub_batch = int(dht_config["scrub_batch"])
         while True:
-            await asyncio.sleep(_fix_interval)
-            self._next = (self._next + 1) % len(self._fingers)
-            next_id = (self._numeric_id + (2 ** self._next)) % (2 ** len(self._fingers))
-            found, succ = await self.find_successor(next_id)
-            # logger.info(f"Result for fixing finger {self._next} {next_id} => {found} {succ}")
-            if not found:
-                logger.warning("No suitable node found to fix this finger.")
-            else:
-                if self._fingers[self._next] != succ:
-                    # logger.info(f"Finger {self._next} updated from {self._fingers[self._next]['addr']} to {succ}.")
-                    self._fingers[self._next] = succ
-                    # # TODO: optimization need to check for correctness
-                    for i in range(self._next + 1, len(self._fingers)):
-                        __id = (self._numeric_id + (2 ** i)) % (2 ** len(self._fingers))
-                        if between(
-                            __id,
-                            self._numeric_id,
-                            succ["numeric_id"],
-                            inclusive_right=False,
-                            inclusive_left=False,
-                        ):
-                            self._fingers[i] = succ
-            # print_table(self._fingers)
+            await asyncio.sleep(_scrub_interval)
+            await self.scrub_batch(_scrub_batch)
+
+    async def scrub_batch(self, limit: int, slice_size: int = 16) -> int:
+        """
+        Verifies the next `limit` stored values, `slice_size` at a time.
+        Returns:
+            corrupted (int): Number of deleted values.
+        """
+        corrupted = 0
+        while limit > 0:
+            corrupted += self._storage.scrub(min(limit, slice_size))
+            limit -= slice_size
+            await asyncio.sleep(0)
+        return corrupted
 
     @aiomas.expose
     def notify(self, n):
@@ -275,129 +597,794 @@ class Node:
             inclusive_left=False,
             inclusive_right=False,
         ):
+            if n != self._predecessor:
+                self._locations.clear()
+                self._churn.set()
             self._predecessor = n
 
     @aiomas.expose
-    def save_key(self, key: str, value: str, ttl: int):
+    def save_key(self, key: int, value: bytes, ttl: int):
         """
         Stores key, val pair in the actual storage.
         Args:
             key (string): The key under which a vlue shall be stored.
-            value (string): The value / data being stored.
+            value (bytes): The value / data being stored.
             ttl (int): time to live. How long this should remain in the network.
         """
-        logger.info(f"Saving key {key} => {value} in my storage.")
+        hot_logger.info("Saving key {} => {} in my storage.", key, hot_logger.value(value))
         return self._storage.put_key(key, value, ttl=ttl)
 
     @aiomas.expose
-    async def put_key(self, key: str, value: str, ttl: int):
+    async def put_key(self, key: Union[bytes, int], value: bytes, ttl: int):
         """
         Generates multiple dht keys for each value for replication.
         Finds the node based on the key, where the value should be stored.
         Save it using save_key after a detination node is chosen.
+        All replicas are looked up and written concurrently, the put returns as
+        soon as `write_quorum` replicas confirmed the write.
         Args:
             key (string): The key under which a vlue shall be stored.
-            value (string): The value / data being stored.
+            value (bytes): The value / data being stored.
             ttl (int): time to live. How long this should remain in the network.
         Returns:
-            keys (list): The update list of keys.
+            keys (list): The keys of the confirmed replicas, empty if the quorum was not reached.
         """
+        if self._REPLICATION_MODE == self.REPLICATION_SUCCESSORS:
+            return await self._put_on_successors(key, value, ttl)
         # generate multiple dht keys for each each
+        chain = [key] + replica_ids(key, 1 + self._REPLICATION_COUNT)
+
+        async def put_replica(parent_key: Union[bytes, int], dht_key: int):
+            hot_logger.debug("Putting Key: {} - {}", parent_key, dht_key)
+            for use_cache in (True, False):
+                found, next_node, cached = await self._locate(dht_key, use_cache=use_cache)
+                if not found:
+                    logger.warning(f"Replica {dht_key} of {key} not written, no node found.")
+                    return None
+                hot_logger.info("putting key {} on node {}", dht_key, next_node["addr"])
+                saved = await rpc_save_key(
+                    next_node=next_node, key=dht_key, value=value, ttl=ttl, pool=self._pool
+                )
+                if saved:
+                    return parent_key
+                if not cached:
+                    logger.warning(f"Replica {dht_key} of {key} not written by {next_node['addr']}.")
+                    return None
+                # the cached owner is gone, route the write again
+                self._locations.invalidate(next_node["addr"])
+
+        # failures of the replicas still running after the quorum are logged by put_replica and _spawn
+        writes = [self._spawn(put_replica(parent, dht_key)) for parent, dht_key in zip(chain, chain[1:])]
+        quorum = min(self._WRITE_QUORUM, len(writes))
         keys = []
-        for replica in range(1 + self._REPLICATION_COUNT):
-            dht_key = generate_id(key)
-            numeric_id = int(dht_key, 16)
-            logger.warning(f"Putting Key: {key} - {dht_key} - {numeric_id}")
-            found, next_node = await self.find_successor(numeric_id)
-            if not found:
-                continue
-            logger.info(f"putting key {dht_key} on node {next_node['addr']}")
-            await rpc_save_key(
-                next_node=next_node, key=dht_key, value=value, ttl=ttl, ssl_ctx=self.client_ssl_ctx
-            )
-            keys.append(key)
-            key = dht_key
-        return keys
+        for write in asyncio.as_completed(writes):
+            parent_key = await write
+            if parent_key is not None:
+                keys.append(parent_key)
+            if len(keys) >= quorum:
+                # the slower replicas finish in the background
+                return keys
+        logger.error(f"Write quorum not reached for {key}: {len(keys)}/{quorum} replicas confirmed.")
+        return []
 
     @aiomas.expose
-    async def find_key(self, key: str, ttl: int = 4, is_replica: bool = False):
+    async def find_key(self, key: Union[bytes, int], ttl: int = 4, is_replica: bool = False):
         """
         checks current node for the value or deligates to appropriate succsorsself.
         Returns the value if it is stored on the ring.
+        Replicas are read with hedged requests: `read_quorum` replicas are asked
+        at once and the next replica is asked when the running reads did not answer
+        within `read_hedge_delay` seconds or came back empty. The value wins once
+        `read_quorum` replicas returned it.
         Args:
             key (string): The key under which a vlue shall be stored.
-            value (string): The value / data being stored.
+            value (bytes): The value / data being stored.
             ttl (int): time to live. How long this should remain in the network.
             is_replica (Boolean): Whether or not the current node is a replica.
         Returns:
             Boolean: Whether or not the value is found
-            String: Value if one is found.
+            Bytes: Value if one is found.
         """
-        logger.debug(f"Finding key with TTL => {ttl} {key}")
+        hot_logger.debug("Finding key with TTL => {} {}", ttl, key)
         if ttl <= 0:
             return None
+        if self._REPLICATION_MODE == self.REPLICATION_SUCCESSORS and not is_replica:
+            return await self._find_on_successors(key)
         search_cnt = 1 if is_replica else self._REPLICATION_COUNT + 1
-        for idx in range(search_cnt):
-            dht_key = generate_id(key)
-            numeric_id = int(dht_key, 16)
-            logger.warning(f"Getting Key: {key} - {dht_key} - {numeric_id}")
+        chain = [key] + replica_ids(key, search_cnt)
+        for dht_key in chain[1:]:
             found, value = self._find_key(dht_key)
             if found:
                 return value
-            found, node = await self.find_successor(numeric_id)
+
+        async def get_replica(parent_key: Union[bytes, int], dht_key: int):
+            hot_logger.debug("Getting Key: {} - {}", parent_key, dht_key)
+            for use_cache in (True, False):
+                found, node, cached = await self._locate(dht_key, use_cache=use_cache)
+                if not found:
+                    return None
+                if node["addr"] == self._addr and self._in_handoff(dht_key):
+                    # not transferred to us yet, the previous owner still has it
+                    node = self._handoff["source"]
+                hot_logger.debug("Getting key from responsible node {}", node)
+                res = await rpc_get_key(
+                    next_node=node, key=parent_key, ttl=ttl - 1, is_replica=True, pool=self._pool
+                )
+                if res or not cached:
+                    return res
+                # the cached owner may be gone or no longer responsible, route the read again
+                self._locations.invalidate(node["addr"])
+
+        return await self._hedged_read(
+            [functools.partial(get_replica, parent, dht_key) for parent, dht_key in zip(chain, chain[1:])],
+            quorum=1 if is_replica else self._READ_QUORUM,
+        )
+
+    def _replica_successors(self) -> List[dict]:
+        """
+        The successors holding copies of our keys in the `successors` replication mode.
+        """
+        nodes = []
+        for node in self._successors:
+            if node and node["addr"] != self._addr and node not in nodes:
+                nodes.append(node)
+        return nodes[: self._REPLICATION_COUNT]
+
+    async def _put_on_successors(self, key: Union[bytes, int], value: bytes, ttl: int) -> List[int]:
+        """
+        Stores a key on the node responsible for it, which forwards the copies to
+        its successors. Needs a single lookup.
+        Returns:
+            keys (list): The dht key once per confirmed copy, empty if the quorum was not reached.
+        """
+        dht_key = generate_id(key)
+        copies = 0
+        for use_cache in (True, False):
+            found, node, cached = await self._locate(dht_key, use_cache=use_cache)
             if not found:
-                continue
-            logger.debug(f"Getting key from responsible node {node}")
-            res = await rpc_get_key(
-                next_node=node, key=key, ttl=ttl - 1, is_replica=idx > 0, ssl_ctx=self.client_ssl_ctx
+                break
+            hot_logger.info("putting key {} on node {} and its successors", dht_key, node["addr"])
+            if node["addr"] == self._addr:
+                copies = (await self.replicate_keys([[dht_key, value, ttl]]))[0]
+            else:
+                copies = await rpc_replicate_key(
+                    next_node=node, key=dht_key, value=value, ttl=ttl, pool=self._pool
+                )
+            if copies or not cached:
+                break
+            # the cached owner is gone, route the write again
+            self._locations.invalidate(node["addr"])
+        quorum = min(self._WRITE_QUORUM, 1 + self._REPLICATION_COUNT)
+        if copies < quorum:
+            logger.error(f"Write quorum not reached for {key}: {copies}/{quorum} copies confirmed.")
+            return []
+        return [dht_key] * copies
+
+    async def _find_on_successors(self, key: Union[bytes, int]):
+        """
+        Reads a key from the node responsible for it and, hedged like `find_key`,
+        from the successors of that node holding its copies. The successor list
+        is asked from the owner directly, without another lookup.
+        """
+        dht_key = generate_id(key)
+        found, value = self._find_key(dht_key)
+        if found:
+            return value
+        return await self._read_copies(dht_key)
+
+    async def _read_copies(self, dht_key: int):
+        """
+        Hedged read of `dht_key` from its owner and the successors holding its copies.
+        A read from a cached owner that finds nothing is routed again without the cache.
+        """
+        for use_cache in (True, False):
+            found, owner, cached = await self._locate(dht_key, use_cache=use_cache)
+            if not found:
+                return None
+            if owner["addr"] == self._addr and self._in_handoff(dht_key):
+                # not transferred to us yet, the previous owner still has it
+                owner = self._handoff["source"]
+            holders = {}
+            value = await self._hedged_read(
+                [
+                    functools.partial(self._get_copy, dht_key, owner, holders, idx)
+                    for idx in range(1 + self._REPLICATION_COUNT)
+                ],
+                quorum=self._READ_QUORUM,
             )
-            if res:
-                return res
-            key = dht_key
+            if value or not cached:
+                return value
+            # the cached owner may be gone or no longer responsible, route the read again
+            self._locations.invalidate(owner["addr"])
+        return None
+
+    async def _get_copy(self, dht_key: int, owner: dict, holders: dict, idx: int):
+        """
+        Reads the copy of `dht_key` held by `owner` for idx 0, else by the idx-th
+        successor of `owner` holding a copy. The successor list is only asked for by
+        the first read of a copy and shared with the other reads through `holders`.
+        """
+        node = owner
+        if idx > 0:
+            if "successors" not in holders:
+                holders["successors"] = asyncio.ensure_future(self._copy_holders(owner))
+            successors = await asyncio.shield(holders["successors"])
+            if idx > len(successors):
+                return None
+            node = successors[idx - 1]
+        if node["addr"] == self._addr:
+            return self._find_key(dht_key)[1]
+        hot_logger.debug("Getting key from node {}", node)
+        return await rpc_get_copy(next_node=node, key=dht_key, pool=self._pool)
+
+    async def _copy_holders(self, owner: dict) -> List[dict]:
+        """
+        The successors of `owner` holding copies of its keys, asked from `owner` directly.
+        """
+        if owner["addr"] == self._addr:
+            return self._replica_successors()
+        _, succ_list = await rpc_ask_for_pred_and_succlist(owner["addr"], pool=self._pool)
+        holders = []
+        for node in succ_list:
+            if node and node["addr"] != owner["addr"] and node not in holders:
+                holders.append(node)
+        return holders[: self._REPLICATION_COUNT]
+
+    async def _hedged_read(self, reads: list, quorum: int = 1):
+        """
+        Runs the `reads` in order, starting the next one whenever the running ones
+        are slower than the hedge delay or failed, and returns the first value
+        returned by `quorum` reads.
+        Args:
+            reads (list): Coroutine functions, one per replica.
+            quorum (int): How many reads have to agree on the value.
+        Returns:
+            The value or None if no value reached the quorum.
+        """
+        quorum = max(1, min(quorum, len(reads)))
+        votes = {}
+        reads = iter(reads)
+        pending = {asyncio.ensure_future(read()) for read in itertools.islice(reads, quorum - 1)}
+        try:
+            while True:
+                read = next(reads, None)
+                if read is not None:
+                    pending.add(asyncio.ensure_future(read()))
+                if not pending:
+                    logger.warning(f"Read quorum not reached: {votes}")
+                    return None
+                done, pending = await asyncio.wait(
+                    pending,
+                    timeout=self._HEDGE_DELAY if read is not None else None,
+                    return_when=asyncio.FIRST_COMPLETED,
+                )
+                for task in done:
+                    value = task.result() if task.exception() is None else None
+                    if value:
+                        votes[value] = votes.get(value, 0) + 1
+                        if votes[value] >= quorum:
+                            return value
+        finally:
+            for task in pending:
+                task.cancel()
 
-    def _find_key(self, key: str):
+    def _find_key(self, key: int):
         """
         A 'helper' function that returns the value if the key is store in the current node.
         Args:
             key (string): The key for whic the value is to be retrieved.
         Returns:
             Boolean: Whether or not the value is found
-            String: Value if one is found.
+            Bytes: Value if one is found.
         """
         value = self._storage.get_key(key)
-        logger.info(f"finding key {key} => {value}")
+        hot_logger.info("finding key {} => {}", key, hot_logger.value(value) if value else None)
         if value is not None:
             return True, value
         # get the succ responsible for the key
         return False, None
 
+    ##################################
+    # Batched keys
+    ##################################
+
+    async def _group_by_owner(self, dht_keys: List[int], reads: bool = False) -> dict:
+        """
+        Groups dht keys by the node responsible for them. The keys are resolved in
+        ring order, after one lookup the following keys up to the found node are
+        answered by the location cache, so there is one lookup per node.
+        Args:
+            dht_keys (list): The dht keys.
+            reads (bool): Whether keys still being handed over to us go to their previous owner.
+        Returns:
+            groups (dict): addr -> (node, dht keys) of every node found.
+        """
+        groups = {}
+        for dht_key in sorted(set(dht_keys)):
+            found, node, _ = await self._locate(dht_key)
+            if not found:
+                continue
+            if reads and node["addr"] == self._addr and self._in_handoff(dht_key):
+                node = self._handoff["source"]
+            groups.setdefault(node["addr"], (node, []))[1].append(dht_key)
+        return groups
+
+    async def _call_owners(
+        self, dht_keys: List[int], call, reads: bool = False, retry_rejected: bool = False
+    ) -> dict:
+        """
+        Runs `call(node, dht_keys)` once for every node responsible for some of the keys.
+        The keys of a node that fails are looked up again and retried once.
+        Args:
+            dht_keys (list): The dht keys.
+            call (coroutine function): Batched RPC returning one result per key, None on failure.
+            reads (bool): Whether keys still being handed over to us go to their previous owner.
+            retry_rejected (bool): Whether keys with a falsy result are looked up again and
+            retried once as well, e.g. writes a node rejected as it is no longer responsible.
+        Returns:
+            results (dict): dht key -> result of every key that was answered.
+        """
+        results = {}
+
+        async def run(node: dict, keys: List[int], retry: bool):
+            res = await call(node, keys)
+            if res is not None:
+                results.update(zip(keys, res))
+                keys = [key for key, result in zip(keys, res) if not result] if retry_rejected else []
+                if not keys:
+                    return
+            self._locations.invalidate(node["addr"])
+            if retry:
+                groups = await self._group_by_owner(keys, reads=reads)
+                await asyncio.gather(*[run(n, ks, False) for n, ks in groups.values()])
+
+        groups = await self._group_by_owner(dht_keys, reads=reads)
+        await asyncio.gather(*[run(node, keys, True) for node, keys in groups.values()])
+        return results
+
+    async def put_keys(self, items: List[list], ttl: int) -> list:
+        """
+        Stores multiple key, value pairs. The replicas of all keys are grouped by
+        the node responsible for them and each node gets a single batched write.
+        Args:
+            items (list): [key, value] pairs.
+            ttl (int): time to live. How long this should remain in the network.
+        Returns:
+            keys (list): The keys of the items that reached the write quorum.
+        """
+        if self._REPLICATION_MODE == self.REPLICATION_SUCCESSORS:
+            return await self._put_keys_on_successors(items, ttl)
+        copies = 1 + self._REPLICATION_COUNT
+        # a key given more than once is written once, with its last value
+        values = dict(items)
+        replicas = {}  # dht key -> key
+        for key in values:
+            for dht_key in replica_ids(key, copies):
+                replicas[dht_key] = key
+
+        async def save(node: dict, dht_keys: List[int]):
+            entries = [[dht_key, values[replicas[dht_key]], ttl] for dht_key in dht_keys]
+            return await rpc_save_keys(next_node=node, entries=entries, pool=self._pool)
+
+        confirmed = dict.fromkeys(values, 0)
+        for dht_key, saved in (await self._call_owners(list(replicas), save, retry_rejected=True)).items():
+            if saved:
+                confirmed[replicas[dht_key]] += 1
+        quorum = min(self._WRITE_QUORUM, copies)
+        return [key for key, _ in items if confirmed[key] >= quorum]
+
+    async def _put_keys_on_successors(self, items: List[list], ttl: int) -> list:
+        """
+        Stores multiple key, value pairs with one batched write per node
+        responsible for some of them, which forwards them to its successors.
+        """
+        # a key given more than once is written once, with its last value
+        values = dict(items)
+        primaries = {generate_id(key): key for key in values}  # dht key -> key
+
+        async def replicate(node: dict, dht_keys: List[int]):
+            entries = [[dht_key, values[primaries[dht_key]], ttl] for dht_key in dht_keys]
+            if node["addr"] == self._addr:
+                return await self.replicate_keys(entries)
+            return await rpc_replicate_keys(next_node=node, entries=entries, pool=self._pool)
+
+        confirmed = dict.fromkeys(values, 0)
+        results = await self._call_owners(list(primaries), replicate, retry_rejected=True)
+        for dht_key, copies in results.items():
+            confirmed[primaries[dht_key]] = copies
+        quorum = min(self._WRITE_QUORUM, 1 + self._REPLICATION_COUNT)
+        return [key for key, _ in items if confirmed[key] >= quorum]
+
+    async def find_keys(self, keys: list) -> list:
+        """
+        Finds the values of multiple keys. The primary replicas are grouped by the
+        node responsible for them and read with one batched call per node, keys
+        missing there are looked up with `find_key`.
+        Args:
+            keys (list): The keys to look up.
+        Returns:
+            values (list): The value or None of every key.
+        """
+        if self._READ_QUORUM > 1:
+            return list(await asyncio.gather(*[self.find_key(key) for key in keys]))
+
+        primaries = [generate_id(key) for key in keys]
+        values = {}
+        remote = []
+        for dht_key in primaries:
+            found, value = self._find_key(dht_key)
+            if found:
+                values[dht_key] = value
+            else:
+                remote.append(dht_key)
+
+        async def read(node: dict, dht_keys: List[int]):
+            return await rpc_get_keys(next_node=node, keys=dht_keys, pool=self._pool)
+
+        values.update(await self._call_owners(remote, read, reads=True))
+        missing = [idx for idx, dht_key in enumerate(primaries) if not values.get(dht_key)]
+        fallback = await asyncio.gather(*[self.find_key(keys[idx]) for idx in missing])
+        results = [values.get(dht_key) for dht_key in primaries]
+        for idx, value in zip(missing, fallback):
+            results[idx] = value
+        return results
+
+    @aiomas.expose
+    async def get_keys(self, keys: List[int]) -> list:
+        """
+        Reads multiple dht keys from our storage. Keys of our range that did not
+        arrive from the previous owner yet are read from it.
+        Args:
+            keys (list): The dht keys.
+        Returns:
+            values (list): The value or None of every key.
+        """
+        values = [self._storage.get_key(key) for key in keys]
+        pending = [idx for idx, value in enumerate(values) if value is None and self._in_handoff(keys[idx])]
+        if pending:
+            source = self._handoff["source"]
+            fetched = await rpc_get_keys(next_node=source, keys=[keys[idx] for idx in pending], pool=self._pool)
+            for idx, value in zip(pending, fetched or []):
+                values[idx] = value
+        return values
+
+    def _responsible(self, numeric_id: int) -> bool:
+        """
+        Whether `numeric_id` lies in our range (predecessor, us] or in the range we
+        still hand off to a new predecessor, every id does while we know no other
+        node and none does once we are leaving.
+        """
+        if self._leaving:
+            return False
+        if not self._predecessor or self._predecessor["numeric_id"] == self._numeric_id:
+            return True
+        if between(numeric_id, self._predecessor["numeric_id"], self._numeric_id):
+            return True
+        handing = self._handing_off
+        return handing is not None and between(numeric_id, handing["left"], handing["node_id"])
+
+    def _forward_handed_off(self, entries: List[list]):
+        """
+        Forwards the stored pairs of the range we hand off to our new predecessor
+        once the transfer streamed past them, later batches carry the others.
+        """
+        handing = self._handing_off
+        if handing is None or not self._predecessor or self._predecessor["numeric_id"] != handing["node_id"]:
+            return
+        forward = [entry for entry in entries if between(entry[0], handing["left"], handing["after"])]
+        if forward:
+            self._spawn(rpc_save_replicas(next_node=self._predecessor, entries=forward, pool=self._pool))
+
+    @aiomas.expose
+    def save_keys(self, entries: List[list]) -> List[bool]:
+        """
+        Stores multiple key, val pairs we are responsible for in our storage in a
+        single transaction. Pairs outside our range are rejected, so a writer that
+        used a stale cached owner looks the key up again. Pairs of a range we still
+        hand off to our new predecessor are stored and forwarded to it.
+        Args:
+            entries (list): [dht key, value, ttl] of every pair.
+        Returns:
+            saved (list): Whether each pair was stored.
+        """
+        owned = [idx for idx, entry in enumerate(entries) if self._responsible(entry[0])]
+        if len(owned) < len(entries):
+            hot_logger.info("Rejecting {} keys outside of my range.", len(entries) - len(owned))
+        saved = [False] * len(entries)
+        for idx, ok in zip(owned, self.save_replicas([entries[idx] for idx in owned])):
+            saved[idx] = ok
+        self._forward_handed_off([entries[idx] for idx in owned if saved[idx]])
+        return saved
+
+    @aiomas.expose
+    def save_replicas(self, entries: List[list]) -> List[bool]:
+        """
+        Stores multiple key, val pairs in our storage in a single transaction,
+        whether or not they are in our range.
+        Args:
+            entries (list): [dht key, value, ttl] of every pair.
+        Returns:
+            saved (list): Whether each pair was stored.
+        """
+        if self._leaving:
+            return [False] * len(entries)
+        hot_logger.info("Saving {} keys in my storage.", len(entries))
+        keys, values, ttls = zip(*entries) if entries else ((), (), ())
+        return self._storage.put_keys(keys, values, ttl=list(ttls))
+
+    @aiomas.expose
+    async def replicate_keys(self, entries: List[list]) -> List[int]:
+        """
+        Stores multiple key, val pairs we are responsible for and forwards them to
+        our successors in the `successors` replication mode. Returns once every
+        pair has `write_quorum` copies, the slower successors finish in the background.
+        Args:
+            entries (list): [dht key, value, ttl] of every pair.
+        Returns:
+            copies (list): The number of nodes that stored each pair.
+        """
+        copies = [int(saved) for saved in self.save_keys(entries)]
+        # pairs outside our range are not forwarded, the writer routes them again
+        stored = [idx for idx, count in enumerate(copies) if count]
+        if not stored:
+            return copies
+        quorum = min(self._WRITE_QUORUM, 1 + self._REPLICATION_COUNT)
+        forward = [entries[idx] for idx in stored]
+
+        async def save_copies(node: dict):
+            saved = await rpc_save_replicas(next_node=node, entries=forward, pool=self._pool)
+            if not saved or not all(saved):
+                logger.warning(f"{node['addr']} did not store all of {len(forward)} copies.")
+            return saved
+
+        # the forwards still running after the quorum are tracked and cancelled on leave
+        forwards = [self._spawn(save_copies(node)) for node in self._replica_successors()]
+        if min(copies[idx] for idx in stored) >= quorum:
+            return copies
+        for done in asyncio.as_completed(forwards):
+            saved = await done
+            for idx, ok in zip(stored, saved or []):
+                copies[idx] += bool(ok)
+            if min(copies[idx] for idx in stored) >= quorum:
+                break
+        return copies
+
     @staticmethod
     @aiomas.expose
     def ping():
         return "pong"
 
     @aiomas.expose
-    def get_all(self, node_id: int):
+    def get_keys_batch(self, node_id: int, left: int, cursor: Optional[list], limit: int):
         """
-        Gets all key, value pairs of the node with the given node_id
+        Streams the keys a joining node with the given node_id takes over from us.
+        Every call acknowledges the previous batch, which is then deleted here
+        unless we keep copies of our predecessor's range, and returns the next one.
         Args:
-            node_id (int): The id of the node.
+            node_id (int): The id of the joining node.
+            left (int): The predecessor the joining node expects, it takes over (left, node_id].
+            cursor (list): None for the first batch, else the cursor returned with the previous batch.
+            limit (int): Maximum number of keys in the batch.
         Returns:
-            keys (list): The keys on the node as a list of strings
-            values (list): Valus stored on the node as a list of string.
+            entries (list): [key, value, seconds left to live, tag] of the keys in the batch.
+            cursor (list): Cursor for the next call, None once the transfer is complete.
         """
-        if not self._predecessor or not between(
-            node_id,
-            self._predecessor["numeric_id"],
-            self._numeric_id,
-            inclusive_right=False,
-            inclusive_left=False,
-        ):
-            return [], []
+        if cursor is None:
+            if not self._hands_off(node_id, left):
+                return [], None
+            after = left
+            self._handing_off = {"left": left, "node_id": node_id, "after": left}
+        else:
+            acked_from, after = cursor
+            if not self._keeps_copies():
+                self._storage.del_range(acked_from, (after + 1) & ring.mask)
+
+        entries = self._storage.get_entries(after, (node_id + 1) & ring.mask, limit=limit)
+        handing = self._handing_off if self._handing_off and self._handing_off["node_id"] == node_id else None
+        if not entries:
+            if handing is not None:
+                self._handing_off = None
+            return [], None
+        if handing is not None:
+            handing["after"] = entries[-1][0]
+        return entries, [after, entries[-1][0]]
 
-        keys, values = self._storage.get_keys(self._predecessor["numeric_id"], node_id)
-        self._storage.del_keys(keys)
-        return keys, values
+    def _hands_off(self, node_id: int, left: int) -> bool:
+        """
+        Whether the range (left, node_id] a joining node asks for is still ours: it
+        lies before us and our predecessor is still `left` or already the joining node.
+        """
+        if not between(node_id, left, self._numeric_id, inclusive_right=False):
+            return False
+        return self._predecessor is None or self._predecessor["numeric_id"] in (left, node_id)
+
+    async def _pull_keys(self):
+        """
+        Pulls the keys of our range from the previous owner in batches, the
+        next batch is only requested once the current one is stored.
+        Entries keep their expiry and integrity tag.
+        An interrupted transfer resumes from the last stored batch. Failed batches
+        are retried with backoff, reads of the range not transferred yet keep going
+        to the previous owner until the transfer is complete. The rest of the range
+        is given up after `handoff_retries` failed attempts or once stabilization
+        notices that the previous owner failed.
+        """
+        handoff = self._handoff
+        source = handoff["source"]
+        cursor = None
+        retries = 0
+        while True:
+            rep = await rpc_get_keys_batch(
+                source, self._numeric_id, handoff["after"], cursor, self._HANDOFF_BATCH, pool=self._pool
+            )
+            if self._handoff is not handoff:
+                return
+            if rep is None:
+                retries += 1
+                if retries > self._HANDOFF_RETRIES:
+                    logger.error(f"Key handoff from {source['addr']} failed {retries}x, giving up the rest.")
+                    break
+                delay = min(2 ** retries, self._HANDOFF_MAX_BACKOFF)
+                logger.warning(f"Key handoff from {source['addr']} failed {retries}x, retry in {delay}s.")
+                await asyncio.sleep(delay)
+                continue
+            retries = 0
+            entries, cursor = rep
+            self._storage.put_entries(entries)
+            if entries:
+                self._handoff["after"] = entries[-1][0]
+            if cursor is None:
+                break
+        self._handoff = None
+
+    @aiomas.expose
+    def put_entries(self, entries: List[list]) -> bool:
+        """
+        Stores the entries a leaving node hands over to us.
+        Args:
+            entries (list): [key, value, seconds left to live, tag] of every entry.
+        Returns:
+            bool: Whether the entries were stored, not once we are leaving.
+        """
+        if self._leaving:
+            return False
+        self._storage.put_entries(entries)
+        return True
+
+    async def _push_keys(self, target: dict) -> bool:
+        """
+        Pushes all our keys to `target` in batches, every batch is deleted here
+        once the target stored it.
+        Returns:
+            bool: Whether all keys were handed over.
+        """
+        after = -1
+        while True:
+            entries = self._storage.get_entries(after, ring.size, self._HANDOFF_BATCH)
+            if not entries:
+                return True
+            if not await rpc_put_entries(target, entries, pool=self._pool):
+                logger.error(f"Key handoff to {target['addr']} failed.")
+                return False
+            self._storage.del_keys([entry[0] for entry in entries])
+            after = entries[-1][0]
+
+    async def leave(self, tasks: list = ()) -> bool:
+        """
+        Leaves the ring gracefully: hands our keys over to the successor, stops
+        the maintenance `tasks`, tells the successor and predecessor to link to each
+        other, stops taking writes, hands over the keys written in the meantime and
+        closes all connections. A successor that does not take our keys or does
+        not relink is skipped for the next one.
+        Args:
+            tasks (list): Maintenance tasks of the node, cancelled before relinking.
+        Returns:
+            bool: Whether all keys were handed over and both neighbours relinked.
+        """
+        candidates = []
+        for node in self._successors:
+            if node and node["addr"] != self._addr and node not in candidates:
+                candidates.append(node)
+        successor = await self._hand_over(candidates, tasks)
+        if candidates and successor is None:
+            logger.error("Could not hand over our keys to any successor, staying in the ring.")
+            return False
+
+        left = await self._relink_predecessor(successor, candidates)
+        self._leaving = True
+        # keys written until we stopped taking writes
+        if successor and not await self._push_keys(successor):
+            left = False
+        for task in self._background:
+            task.cancel()
+        await asyncio.gather(*self._background, return_exceptions=True)
+        await self._pool.close()
+        if not successor:
+            logger.info("Left the ring as its last node.")
+        elif left:
+            logger.info(f"Left the ring, keys handed over to {successor['addr']}.")
+        else:
+            logger.error(f"Left the ring, {len(self._storage.get_ids(0, 0))} keys were not handed over.")
+        return left
+
+    async def _hand_over(self, candidates: List[dict], tasks: list) -> Optional[dict]:
+        """
+        Pushes our keys to the first of the `candidates` that takes them and links
+        it to our predecessor, the maintenance `tasks` are cancelled before.
+          Returns:
+              dict: The successor that took over, None if none did.
+        """
+        me = gen_finger(self._addr)
+        stopped = False
+        for idx, node in enumerate(candidates):
+            if not await self._push_keys(node):
+                continue
+            if not stopped:
+                # a stabilize round would notify the successor again and undo the relink
+                for task in tasks:
+                    task.cancel()
+                await asyncio.gather(*tasks, return_exceptions=True)
+                stopped = True
+            if await rpc_relink(node, me, self._predecessor, candidates[idx:], pool=self._pool):
+                return node
+            logger.error(f"{node['addr']} did not relink, trying the next successor.")
+        return None
+
+    async def _relink_predecessor(self, successor: Optional[dict], candidates: List[dict]) -> bool:
+        """
+        Links our predecessor to `successor` and the candidates after it.
+          Returns:
+              bool: Whether the predecessor relinked or there is none to relink.
+        """
+        if not successor or not self._predecessor or self._predecessor["addr"] == self._addr:
+            return True
+        remaining = candidates[candidates.index(successor) :]
+        me = gen_finger(self._addr)
+        if not await rpc_relink(self._predecessor, me, self._predecessor, remaining, pool=self._pool):
+            logger.error(f"Predecessor {self._predecessor['addr']} did not relink.")
+            return False
+        return True
+
+    @aiomas.expose
+    def relink(self, leaving: dict, predecessor: Optional[dict], successors: List[dict]):
+        """
+        Called by a leaving neighbour, links to its predecessor or successor instead.
+        Fingers pointing to the leaving node point to its successor afterwards.
+        Args:
+            leaving (dict): The leaving node.
+            predecessor (dict): The predecessor of the leaving node.
+            successors (list): The successor list of the leaving node.
+        """
+        addr = leaving["addr"]
+        remaining = [n for n in successors if n and n["addr"] != addr] or [gen_finger(self._addr)]
+        if self._predecessor and self._predecessor["addr"] == addr:
+            self._predecessor = predecessor if predecessor and predecessor["addr"] != self._addr else None
+        if self._successor and self._successor["addr"] == addr:
+            self._successor = remaining[0].copy()
+            self._successors = remaining[: self._MAX_SUCC]
+        else:
+            self._successors = [n for n in self._successors if not n or n["addr"] != addr]
+        self._fingers.replace(addr, remaining[0])
+        self._locations.invalidate(addr)
+        self._pool.evict(addr)
+        self._churn.set()
+        logger.info(f"{addr} left the ring.")
+
+    def _abort_handoff(self, addr: str):
+        """
+        Gives up the key handoff from `addr` once it failed, reads of our range stay with us.
+        """
+        if self._handoff is not None and self._handoff["source"]["addr"] == addr:
+            logger.warning(f"Handoff source {addr} failed, giving up the rest of the range.")
+            self._handoff = None
+
+    def _in_handoff(self, numeric_id: int) -> bool:
+        """
+        Whether the key with `numeric_id` still has to be transferred to us.
+        """
+        if self._handoff is None:
+            return False
+        return between(numeric_id, self._handoff["after"], self._numeric_id)
 
     def dump_me(self):
         """
@@ -408,7 +1395,7 @@ class Node:
             * _fingers: The finger table.
         """
         logger.debug("My data, succ and pred")
-        my_data = [{"addr": self._addr, "id": self._id, "numeric_id": self._numeric_id}]
+        my_data = [{"addr": self._addr, "numeric_id": self._numeric_id}]
         my_data += [self._successor]
         my_data += [self._predecessor]
         print_table(my_data)
@@ -417,8 +1404,130 @@ class Node:
         print_table(self._successors)
 
         logger.debug("My Fingers")
-        print_table(self._fingers)
+        print_table(self._fingers.runs())
 
     @staticmethod
     def completed():
         return "completed"
+
+    ##################################
+    # Anti-entropy
+    ##################################
+
+    @aiomas.expose
+    def range_summary(self, left: int, right: int, fanout: int) -> List[list]:
+        """
+        Hash and number of our values in each child of the ring interval (left, right].
+        """
+        return summarize(self._storage.get_digests(left, right), left, right, fanout)
+
+    @aiomas.expose
+    def range_digests(self, left: int, right: int) -> List[list]:
+        """
+        Our stored ids in the ring interval (left, right] with the digest of their value.
+        """
+        return self._storage.get_digests(left, right)
+
+    @aiomas.expose
+    def get_entries(self, keys: List[int]) -> List[list]:
+        """
+        Our entries of the given keys with their expiry and integrity tag.
+        """
+        return self._storage.get_entries_for(keys)
+
+    def _keeps_copies(self) -> bool:
+        """
+        Whether we keep copies of our predecessor's range: in the `successors`
+        replication mode we are one of its replicas, with anti-entropy the keys we
+        hand to a joining predecessor would otherwise be pushed right back to us.
+        """
+        return self._ANTI_ENTROPY_SUCCESSORS > 0 or self._REPLICATION_MODE == self.REPLICATION_SUCCESSORS
+
+    async def anti_entropy(self) -> int:
+        """
+        Syncs the keys of our range (predecessor, us] with our first
+        `anti_entropy_successors` successors, so they can take over our range
+        with its keys when we fail and we recover keys we lost from them.
+        Returns:
+            moved (int): The number of keys transferred.
+        """
+        if not self._predecessor or not self._successor:
+            return 0
+        peers = []
+        for node in self._successors:
+            if node and node["addr"] != self._addr and node not in peers:
+                peers.append(node)
+        count = self._ANTI_ENTROPY_SUCCESSORS
+        if count > 0 and self._REPLICATION_MODE == self.REPLICATION_SUCCESSORS:
+            # our successors hold the copies of our keys
+            count = max(count, self._REPLICATION_COUNT)
+        moved = 0
+        for peer in peers[:count]:
+            moved += await self._sync_range(peer, self._predecessor["numeric_id"], self._numeric_id)
+        return moved
+
+    async def _sync_range(self, peer: dict, left: int, right: int) -> int:
+        """
+        Makes us and `peer` hold the same values in the ring interval (left, right],
+        which is our range. Descends the hash tree of the interval and only compares
+        the ids and value digests of the subintervals whose hashes differ, so the
+        traffic grows with the difference.
+        Returns:
+            moved (int): The number of keys transferred.
+        """
+        moved = 0
+        pending = [(left, right)]
+        while pending:
+            left, right = pending.pop()
+            theirs = await rpc_range_summary(peer, left, right, self._MERKLE_FANOUT, pool=self._pool)
+            if theirs is None:
+                break
+            ours = self.range_summary(left, right, self._MERKLE_FANOUT)
+            for child, (our_hash, our_count), (their_hash, their_count) in zip(
+                split(left, right, self._MERKLE_FANOUT), ours, theirs
+            ):
+                if our_hash == their_hash:
+                    continue
+                if max(our_count, their_count) <= self._MERKLE_LEAF_SIZE or interval_length(*child) <= 1:
+                    moved += await self._sync_values(peer, *child)
+                else:
+                    pending.append(child)
+        return moved
+
+    async def _sync_values(self, peer: dict, left: int, right: int) -> int:
+        """
+        Exchanges the values in (left, right] only one of us and `peer` holds.
+        Where both hold a different value our version wins, as we own the range.
+        """
+        theirs = await rpc_range_digests(peer, left, right, pool=self._pool)
+        if theirs is None:
+            return 0
+        theirs = {key: digest for key, digest in theirs}
+        ours = {key: digest for key, digest in self._storage.get_digests(left, right)}
+        moved = 0
+        push = sorted(key for key, digest in ours.items() if theirs.get(key) != digest)
+        if push and await rpc_put_entries(peer, self._storage.get_entries_for(push), pool=self._pool):
+            moved += len(push)
+        pull = sorted(key for key in theirs if key not in ours)
+        if pull:
+            entries = await rpc_get_entries(peer, pull, pool=self._pool)
+            if entries:
+                self._storage.put_entries(entries)
+                moved += len(entries)
+        return moved
+
+    async def repair(self):
+        """
+        Runs the anti-entropy sync with our successors every `anti_entropy_interval` seconds.
+        """
+        if self._ANTI_ENTROPY_SUCCESSORS <= 0:
+            return
+        _interval = float(dht_config["anti_entropy_interval"])
+        while True:
+            await asyncio.sleep(_interval * random.uniform(1 - self._FIX_JITTER, 1 + self._FIX_JITTER))
+            try:
+                moved = await self.anti_entropy()
+                if moved:
+                    logger.info(f"Anti-entropy transferred {moved} keys.")
+            except Exception as e:
+                logger.error(e)
@@ -0,0 +1,280 @@
+import asyncio
+import ssl
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import Optional
+
+import aiomas
+from loguru import logger
+
+from chord.batch import Coalescer
+from chord.codec import MsgPack
+
+
+class _Peer:
+    """
+    Book-keeping for the connections to a single remote node.
+    """
+
+    def __init__(self, max_size: int, max_in_flight: int):
+        # exclusive mode
+        self.idle = deque()  # (rpc_con, last_used)
+        self.slots = asyncio.Semaphore(max_size)
+        # multiplexed mode
+        self.shared = {}  # rpc_con -> number of calls in flight
+        self.last_used = {}  # rpc_con -> last time it had no calls in flight
+        self.window = asyncio.Semaphore(max_in_flight)
+        self.opening = asyncio.Lock()
+
+
+class ConnectionPool:
+    """
+    Keeps warm TLS connections to other chord nodes so that consecutive RPCs
+    to the same peer skip the TCP and TLS handshakes.
+
+    In exclusive mode connections are checked out for a single call at a time,
+    returned to the pool after a successful call and dropped (together with all
+    other idle connections to that peer) once a call on them fails.
+
+    In multiplexed mode a handful of channels per peer are shared by all callers,
+    aiomas tags every request with a message id so many calls can be in flight
+    on one channel. The number of outstanding calls per peer is bounded by
+    `max_in_flight`; further callers wait for a free slot.
+
+    Calls of batched remote methods made through `call_batched` within
+    `batch_delay` seconds are coalesced into one RPC per peer.
+    """
+
+    def __init__(
+        self,
+        ssl_ctx: Optional[ssl.SSLContext],
+        max_size: int = 4,
+        idle_timeout: float = 60,
+        connect_timeout: float = 5,
+        multiplex: bool = False,
+        max_in_flight: int = 256,
+        call_timeout: Optional[float] = None,
+        batch_delay: float = 0,
+        max_batch: int = 128,
+    ):
+        self._ssl_ctx = ssl_ctx
+        self._max_size = max_size
+        self._idle_timeout = idle_timeout
+        self._connect_timeout = connect_timeout
+        self._multiplex = multiplex
+        self._max_in_flight = max_in_flight
+        self._call_timeout = call_timeout
+        # calls a channel carries before another channel to the same peer is opened
+        self._channel_load = max(1, max_in_flight // max_size)
+        self._peers = {}
+        self._coalescer = Coalescer(self.call, batch_delay, max_batch)
+
+    def _peer(self, addr: str) -> _Peer:
+        peer = self._peers.get(addr)
+        if peer is None:
+            peer = self._peers[addr] = _Peer(self._max_size, self._max_in_flight)
+        return peer
+
+    @staticmethod
+    def _is_alive(rpc_con) -> bool:
+        transport = rpc_con.channel.transport
+        return transport is not None and not transport.is_closing()
+
+    @staticmethod
+    def _close(rpc_con):
+        """
+        Close a connection without waiting for the peer.
+        """
+        transport = rpc_con.channel.transport
+        if transport is not None:
+            transport.close()
+
+    async def _open(self, addr: str):
+        host, port = addr.split(":")
+        return await asyncio.wait_for(
+            aiomas.rpc.open_connection((host, port), ssl=self._ssl_ctx, codec=MsgPack), self._connect_timeout
+        )
+
+    ##################################
+    # Exclusive connections
+    ##################################
+
+    async def acquire(self, addr: str):
+        """
+        Check out a connection to `addr`, reusing an idle one if possible.
+          Args:
+              addr (string): Address of the peer.
+          Returns:
+              rpc_con (aiomas.rpc.RpcClient): A connection owned by the caller.
+        """
+        peer = self._peer(addr)
+        await peer.slots.acquire()
+        try:
+            now = time.monotonic()
+            while peer.idle:
+                rpc_con, last_used = peer.idle.pop()
+                if now - last_used <= self._idle_timeout and self._is_alive(rpc_con):
+                    return rpc_con
+                self._close(rpc_con)
+            return await self._open(addr)
+        except BaseException:
+            peer.slots.release()
+            raise
+
+    def release(self, addr: str, rpc_con):
+        """
+        Return a healthy connection to the pool.
+        """
+        peer = self._peer(addr)
+        if self._is_alive(rpc_con):
+            peer.idle.append((rpc_con, time.monotonic()))
+        peer.slots.release()
+
+    def discard(self, addr: str, rpc_con):
+        """
+        Close a failed connection and evict the idle connections to the same peer,
+        they most likely point to a dead node as well.
+        """
+        self._close(rpc_con)
+        self.evict(addr)
+        self._peer(addr).slots.release()
+
+    @asynccontextmanager
+    async def connection(self, addr: str):
+        """
+        Context manager to check out a connection and give it back afterwards.
+        """
+        rpc_con = await self.acquire(addr)
+        try:
+            yield rpc_con
+        except aiomas.RemoteException:
+            # the peer answered with an error, the channel itself is fine
+            self.release(addr, rpc_con)
+            raise
+        except BaseException:
+            self.discard(addr, rpc_con)
+            raise
+        else:
+            self.release(addr, rpc_con)
+
+    ##################################
+    # Multiplexed connections
+    ##################################
+
+    async def _shared_connection(self, addr: str, peer: _Peer):
+        """
+        Pick the least loaded live channel to `addr`, opening another one while
+        all channels are saturated and the peer has less than `max_size` channels.
+        """
+        now = time.monotonic()
+        for rpc_con in list(peer.shared):
+            idle_for = now - peer.last_used.get(rpc_con, now)
+            if not self._is_alive(rpc_con) or (peer.shared[rpc_con] == 0 and idle_for > self._idle_timeout):
+                self._drop_shared(peer, rpc_con)
+
+        if peer.shared:
+            rpc_con = min(peer.shared, key=peer.shared.get)
+            if peer.shared[rpc_con] < self._channel_load or len(peer.shared) >= self._max_size:
+                return rpc_con
+
+        async with peer.opening:
+            # another caller may have opened a channel while we were waiting
+            if len(peer.shared) < self._max_size and all(
+                load >= self._channel_load for load in peer.shared.values()
+            ):
+                rpc_con = await self._open(addr)
+                peer.shared[rpc_con] = 0
+            return min(peer.shared, key=peer.shared.get)
+
+    @classmethod
+    def _drop_shared(cls, peer: _Peer, rpc_con):
+        cls._close(rpc_con)
+        peer.shared.pop(rpc_con, None)
+        peer.last_used.pop(rpc_con, None)
+
+    @staticmethod
+    def _consume_result(fut: asyncio.Future):
+        # keeps late replies of timed out calls from being reported as never retrieved
+        if not fut.cancelled():
+            fut.exception()
+
+    async def _call_multiplexed(self, addr: str, method: str, timeout, args, kwargs):
+        peer = self._peer(addr)
+        async with peer.window:
+            rpc_con = await self._shared_connection(addr, peer)
+            peer.shared[rpc_con] = peer.shared.get(rpc_con, 0) + 1
+            try:
+                fut = getattr(rpc_con.remote, method)(*args, **kwargs)
+                fut.add_done_callback(self._consume_result)
+                # never cancel the channel's future, a late reply to a cancelled
+                # request makes aiomas tear down the whole channel
+                return await asyncio.wait_for(asyncio.shield(fut), timeout)
+            except asyncio.TimeoutError:
+                raise
+            except (ConnectionError, OSError):
+                self._drop_shared(peer, rpc_con)
+                self.evict(addr)
+                raise
+            finally:
+                if rpc_con in peer.shared:
+                    peer.shared[rpc_con] -= 1
+                    if peer.shared[rpc_con] == 0:
+                        peer.last_used[rpc_con] = time.monotonic()
+
+    ##################################
+    # Public API
+    ##################################
+
+    def evict(self, addr: str):
+        """
+        Close all idle connections to `addr`, and in multiplexed mode all of its channels.
+        """
+        peer = self._peers.get(addr)
+        if peer is None:
+            return
+        while peer.idle:
+            rpc_con, _ = peer.idle.pop()
+            self._close(rpc_con)
+        for rpc_con in list(peer.shared):
+            self._drop_shared(peer, rpc_con)
+        logger.debug(f"Evicted connections to {addr}")
+
+    async def call(self, addr: str, method: str, *args, timeout: Optional[float] = None, **kwargs):
+        """
+        Call the exposed `method` on the node at `addr`.
+          Args:
+              addr (string): Address of the peer.
+              method (string): Name of the remote method.
+              timeout (float): Seconds to wait for the reply, defaults to `call_timeout`.
+          Returns:
+              The result of the remote call.
+        """
+        timeout = self._call_timeout if timeout is None else timeout
+        if self._multiplex:
+            return await self._call_multiplexed(addr, method, timeout, args, kwargs)
+        async with self.connection(addr) as rpc_con:
+            return await asyncio.wait_for(getattr(rpc_con.remote, method)(*args, **kwargs), timeout)
+
+    async def call_batched(self, addr: str, method: str, item):
+        """
+        Call the batched `method` on the node at `addr`, which takes a list of items
+        and returns one result per item, for a single `item`. Calls to the same peer
+        within `batch_delay` seconds are sent together.
+          Args:
+              addr (string): Address of the peer.
+              method (string): Name of the batched remote method.
+              item: The argument of this call.
+          Returns:
+              The result of the remote call for `item`.
+        """
+        return await self._coalescer.call(addr, method, item)
+
+    async def close(self):
+        """
+        Close all pooled connections.
+        """
+        self._coalescer.close()
+        for addr in list(self._peers):
+            self.evict(addr)
+        self._peers.clear()
@@ -1,10 +1,10 @@
-import ssl
-from typing import Optional, List
+from typing import Optional, List, Union
 
-import aiomas
 from loguru import logger
 
-from chord.helpers import gen_finger
+from chord.helpers import gen_finger, generate_id
+from chord.log import hot_logger
+from chord.pool import ConnectionPool
 
 
 ######################
@@ -13,136 +13,292 @@ from chord.helpers import gen_finger
 
 
 async def rpc_ask_for_succ(
-    next_node: dict, numeric_id: int, ssl_ctx: ssl.SSLContext
+    next_node: dict, numeric_id: int, pool: ConnectionPool
 ) -> (bool, Optional[dict]):
     """
     Find the successor.
       Args:
           next_node (dict): The next node.
           numeric_id (int): The numeric id of the node.
-          ssl_ctx (ssl.SSLContext): Used for tls.
+          pool (ConnectionPool): Connections to other nodes.
       Returns:
           found (Boolean): Whether or not a successor exist.
           successor (dict): The successor node if it exists.
     """
     try:
-        host, port = next_node["addr"].split(":")
-        rpc_con = await aiomas.rpc.open_connection((host, port), ssl=ssl_ctx)
-        found, rep = await rpc_con.remote.find_successor(numeric_id)
-        await rpc_con.close()
+        found, rep = await pool.call(next_node["addr"], "find_successor", numeric_id)
         return found, rep
     except Exception as e:
         logger.error(e, next_node, numeric_id)
         return False, None
 
 
-async def rpc_ask_for_pred_and_succlist(addr: str, ssl_ctx: ssl.SSLContext) -> (dict, List):
+async def rpc_find_successor_step(
+    next_node: dict, numeric_id: int, pool: ConnectionPool
+) -> (bool, Optional[dict]):
+    """
+    Asks a node for a single step of an iterative lookup.
+      Args:
+          next_node (dict): The next node.
+          numeric_id (int): The numeric id of the node.
+          pool (ConnectionPool): Connections to other nodes.
+      Returns:
+          found (Boolean): Whether the returned node is the successor.
+          node (dict): The successor or the next node to ask, None on failure.
+    """
+    try:
+        found, rep = await pool.call(next_node["addr"], "find_successor_step", numeric_id)
+        return found, rep
+    except Exception as e:
+        logger.error(e, next_node, numeric_id)
+        return False, None
+
+
+async def rpc_route_successor(
+    next_node: dict, numeric_id: int, origin: str, request_id: int, hops: int, pool: ConnectionPool
+) -> bool:
+    """
+    Forwards a recursive lookup to the next node.
+      Args:
+          next_node (dict): The next node.
+          numeric_id (int): The numeric id of the node.
+          origin (string): Address of the node waiting for the answer.
+          request_id (int): Id of the lookup at the origin.
+          hops (int): How many more times the lookup may be forwarded.
+          pool (ConnectionPool): Connections to other nodes.
+      Returns:
+          (Boolean): Whether the next node accepted the lookup.
+    """
+    try:
+        return await pool.call(next_node["addr"], "route_successor", numeric_id, origin, request_id, hops)
+    except Exception as e:
+        logger.error(e)
+        return False
+
+
+async def rpc_deliver_successor(
+    origin: str, request_id: int, successor: Optional[dict], pool: ConnectionPool
+) -> None:
+    """
+    Sends the result of a recursive lookup back to the node that started it.
+      Args:
+          origin (string): Address of the node waiting for the answer.
+          request_id (int): Id of the lookup at the origin.
+          successor (dict): The successor or None if the lookup failed.
+          pool (ConnectionPool): Connections to other nodes.
+    """
+    try:
+        await pool.call(origin, "deliver_successor", request_id, successor)
+    except Exception as e:
+        logger.error(e)
+
+
+async def rpc_ask_for_pred_and_succlist(addr: str, pool: ConnectionPool) -> (dict, List):
     """
     Gets the predecessor and successor list of the current node.
       Args:
-          ssl_ctx (ssl.SSLContext): Used for tls.
+          pool (ConnectionPool): Connections to other nodes.
       Returns
           (dict): predecessor
           (array): The list of successors
     """
-    host, port = addr.split(":")
-    rpc_con = await aiomas.rpc.open_connection((host, port), ssl=ssl_ctx)
-    rep = await rpc_con.remote.get_pred_and_succlist()
-    await rpc_con.close()
+    rep = await pool.call(addr, "get_pred_and_succlist")
     return rep
 
 
-async def rpc_ping(addr: str, ssl_ctx: ssl.SSLContext) -> bool:
+async def rpc_ping(addr: str, pool: ConnectionPool) -> bool:
     """
     Pings a node with a given address.
       Args:
           addr: The address of target node to ping.
-          ssl_ctx (ssl.SSLContext): Used for tls.
+          pool (ConnectionPool): Connections to other nodes.
       Returns
           (dict): predecessor
           (array): The list of successors
     """
     try:
-        host, port = addr.split(":")
-        rpc_con = await aiomas.rpc.open_connection((host, port), ssl=ssl_ctx)
-        rep = await rpc_con.remote.ping()
-        await rpc_con.close()
+        rep = await pool.call(addr, "ping")
         return rep == "pong"
     except Exception as e:
         logger.error(e)
         return False
 
 
-async def rpc_notify(succ_addr: str, my_addr: str, ssl_ctx: ssl.SSLContext) -> None:
+async def rpc_notify(succ_addr: str, my_addr: str, pool: ConnectionPool) -> None:
     """
     Notifies nodes that the calling node  is now their predecessor.
     Args:
         succ_addr (string): The address of the successor node.
         my_addr (string): Address of the calling node.
-        ssl_ctx (ssl.SSLContext): Used for tls.
+        pool (ConnectionPool): Connections to other nodes.
     """
     try:
-        host, port = succ_addr.split(":")
-        rpc_con = await aiomas.rpc.open_connection((host, port), ssl=ssl_ctx)
-        await rpc_con.remote.notify(gen_finger(my_addr))
-        await rpc_con.close()
+        await pool.call(succ_addr, "notify", gen_finger(my_addr))
     except Exception as e:
         logger.debug(e)
 
 
 async def rpc_get_key(
-    next_node: dict, key: str, ttl: int, is_replica: bool, ssl_ctx: ssl.SSLContext
-) -> Optional[str]:
+    next_node: dict, key: Union[bytes, int], ttl: int, is_replica: bool, pool: ConnectionPool
+) -> Optional[bytes]:
     """
     checks current node for the value or deligates to appropriate succsorsself.
     Returns the value if it is stored on the ring.
+    Replicas are read from the storage of `next_node` directly, reads to the same
+    node are coalesced into batched `get_keys` calls.
     Args:
         next_node (dict): the next node.
         key (string): The key under which a vlue shall be stored.
-        value (string): The value / data being stored.
+        value (bytes): The value / data being stored.
         ttl (int): Time to live for the message, after that the message is discared and no value is returned for that key.
         is_replica (Boolean): Whether or not the current node is a replica.
-        ssl_ctx (ssl.SSLContext): Used for tls.
+        pool (ConnectionPool): Connections to other nodes.
     Returns:
         Boolean: Whether or not the value is found
-        String: Value if one is found.
+        Bytes: Value if one is found.
     """
     try:
-        host, port = next_node["addr"].split(":")
-        rpc_con = await aiomas.rpc.open_connection((host, port), ssl=ssl_ctx)
-        rep = await rpc_con.remote.find_key(key, ttl, is_replica=is_replica)
-        logger.info("response from node =>", rep)
-        await rpc_con.close()
+        if is_replica:
+            rep = await pool.call_batched(next_node["addr"], "get_keys", generate_id(key))
+        else:
+            rep = await pool.call(next_node["addr"], "find_key", key, ttl, is_replica=is_replica)
+        hot_logger.debug("response from node {} => {}", next_node["addr"], hot_logger.value(rep) if rep else None)
         return rep
     except Exception as e:
         logger.error(e)
         return None
 
 
+async def rpc_get_copy(next_node: dict, key: int, pool: ConnectionPool) -> Optional[bytes]:
+    """
+    Reads a dht key from the storage of a node only, the node does not look it up
+    elsewhere. Reads from the same node are coalesced into batched `get_keys` calls.
+    Args:
+        next_node (dict): The node storing a copy of the key.
+        key (int): The dht key.
+        pool (ConnectionPool): Connections to other nodes.
+    Returns:
+        Bytes: The value, None if the node has no copy or the call failed.
+    """
+    try:
+        return await pool.call_batched(next_node["addr"], "get_keys", key)
+    except Exception as e:
+        logger.error(e)
+        return None
+
+
 async def rpc_save_key(
-    next_node: dict, key: str, value: str, ttl: int, ssl_ctx: ssl.SSLContext
+    next_node: dict, key: int, value: bytes, ttl: int, pool: ConnectionPool
 ) -> Optional[str]:
     """
     Stores key, val pair in the actual storage.
+    Writes to the same node are coalesced into batched `save_keys` calls.
     Args:
         next_node (dict): The next node.
         key (string): The key under which a vlue shall be stored.
-        value (string): The value / data being stored.
+        value (bytes): The value / data being stored.
         ttl (int): time to live. How long this should remain in the network.
-        ssl_ctx (ssl.SSLContext): Used for tls.
+        pool (ConnectionPool): Connections to other nodes.
     """
     try:
-        host, port = next_node["addr"].split(":")
-        rpc_con = await aiomas.rpc.open_connection((host, port), ssl=ssl_ctx)
-        rep = await rpc_con.remote.save_key(key, value, ttl)
-        await rpc_con.close()
+        rep = await pool.call_batched(next_node["addr"], "save_keys", [key, value, ttl])
         return rep
     except Exception as e:
         logger.error(e)
         return None
 
 
-async def rpc_put_key(next_node: dict, key: str, value: str, ssl_ctx: ssl.SSLContext) -> Optional[str]:
+async def rpc_get_keys(next_node: dict, keys: List[int], pool: ConnectionPool) -> Optional[List]:
+    """
+    Reads multiple keys from the storage of a node with a single call.
+    Args:
+        next_node (dict): The node storing the keys.
+        keys (list): The dht keys to read.
+        pool (ConnectionPool): Connections to other nodes.
+    Returns:
+        values (list): The value or None of every key, None if the call failed.
+    """
+    try:
+        return await pool.call(next_node["addr"], "get_keys", keys)
+    except Exception as e:
+        logger.error(e)
+        return None
+
+
+async def rpc_save_keys(next_node: dict, entries: List[list], pool: ConnectionPool) -> Optional[List]:
+    """
+    Stores multiple key, val pairs in the storage of a node with a single call.
+    Args:
+        next_node (dict): The node storing the keys.
+        entries (list): [dht key, value, ttl] of every pair.
+        pool (ConnectionPool): Connections to other nodes.
+    Returns:
+        saved (list): Whether each pair was stored, None if the call failed.
+    """
+    try:
+        return await pool.call(next_node["addr"], "save_keys", entries)
+    except Exception as e:
+        logger.error(e)
+        return None
+
+
+async def rpc_save_replicas(next_node: dict, entries: List[list], pool: ConnectionPool) -> Optional[List]:
+    """
+    Stores copies of multiple key, val pairs in the storage of a node with a
+    single call, the node need not be responsible for them.
+    Args:
+        next_node (dict): The node storing the copies.
+        entries (list): [dht key, value, ttl] of every pair.
+        pool (ConnectionPool): Connections to other nodes.
+    Returns:
+        saved (list): Whether each pair was stored, None if the call failed.
+    """
+    try:
+        return await pool.call(next_node["addr"], "save_replicas", entries)
+    except Exception as e:
+        logger.error(e)
+        return None
+
+
+async def rpc_replicate_key(next_node: dict, key: int, value: bytes, ttl: int, pool: ConnectionPool) -> int:
+    """
+    Stores key, val pair on the node responsible for it, which forwards it to its successors.
+    Writes to the same node are coalesced into batched `replicate_keys` calls.
+    Args:
+        next_node (dict): The node responsible for the key.
+        key (int): The dht key.
+        value (bytes): The value / data being stored.
+        ttl (int): time to live. How long this should remain in the network.
+        pool (ConnectionPool): Connections to other nodes.
+    Returns:
+        copies (int): The number of nodes that stored the pair, 0 if the call failed.
+    """
+    try:
+        return await pool.call_batched(next_node["addr"], "replicate_keys", [key, value, ttl])
+    except Exception as e:
+        logger.error(e)
+        return 0
+
+
+async def rpc_replicate_keys(next_node: dict, entries: List[list], pool: ConnectionPool) -> Optional[List[int]]:
+    """
+    Stores multiple key, val pairs on the node responsible for them with a single
+    call, the node forwards them to its successors.
+    Args:
+        next_node (dict): The node responsible for the keys.
+        entries (list): [dht key, value, ttl] of every pair.
+        pool (ConnectionPool): Connections to other nodes.
+    Returns:
+        copies (list): The number of nodes that stored each pair, None if the call failed.
+    """
+    try:
+        return await pool.call(next_node["addr"], "replicate_keys", entries)
+    except Exception as e:
+        logger.error(e)
+        return None
+
+
+async def rpc_put_key(next_node: dict, key: bytes, value: bytes, pool: ConnectionPool) -> Optional[str]:
     """
     Generates multiple dht keys for each value for replication.
     Finds the node based on the key, where the value should be stored.
@@ -150,38 +306,133 @@ async def rpc_put_key(next_node: dict, key: str, value: str, ssl_ctx: ssl.SSLCon
     Args:
         next_node (dict): The next node.
         key (string): The key under which a vlue shall be stored.
-        value (string): The value / data being stored.
+        value (bytes): The value / data being stored.
         ttl (int): time to live. How long this should remain in the network.
-        ssl_ctx (ssl.SSLContext): Used for tls.
+        pool (ConnectionPool): Connections to other nodes.
     """
     try:
-        host, port = next_node["addr"].split(":")
-        rpc_con = await aiomas.rpc.open_connection((host, port), ssl=ssl_ctx)
-        rep = await rpc_con.remote.put_key(key, value)
-        await rpc_con.close()
+        rep = await pool.call(next_node["addr"], "put_key", key, value)
         return rep
     except Exception as e:
         logger.error(e)
         return None
 
 
-async def rpc_get_all_keys(next_node: dict, node_id: int, ssl_ctx: ssl.SSLContext):
+async def rpc_put_entries(next_node: dict, entries: List[list], pool: ConnectionPool) -> bool:
     """
-    Gets all key, value pairs of the node with the given node_id
+    Hands over stored entries to another node, keeping their expiry and integrity tag.
     Args:
-        node_id (int): The id of the node.
+        next_node (dict): The node taking over the entries.
+        entries (list): [key, value, seconds left to live, tag] of every entry.
+        pool (ConnectionPool): Connections to other nodes.
     Returns:
-        next_node (dict): The next node.
-        keys (list): The keys on the node as a list of strings
-        values (list): Valus stored on the node as a list of string.
-        ssl_ctx (ssl.SSLContext): Used for tls.
+        bool: Whether the node stored the entries.
     """
     try:
-        host, port = next_node["addr"].split(":")
-        rpc_con = await aiomas.rpc.open_connection((host, port), ssl=ssl_ctx)
-        rep = await rpc_con.remote.get_all(node_id)
-        await rpc_con.close()
-        return rep
+        return bool(await pool.call(next_node["addr"], "put_entries", entries))
+    except Exception as e:
+        logger.error(e)
+        return False
+
+
+async def rpc_range_summary(
+    next_node: dict, left: int, right: int, fanout: int, pool: ConnectionPool
+) -> Optional[List[list]]:
+    """
+    Gets the hash and number of the stored ids in each child of the ring interval (left, right].
+    Args:
+        next_node (dict): The node to ask.
+        left (int): Start of the interval (exclusive).
+        right (int): End of the interval (inclusive).
+        fanout (int): Number of children.
+        pool (ConnectionPool): Connections to other nodes.
+    Returns:
+        list: [hash, count] of every child, None if the call failed.
+    """
+    try:
+        return await pool.call(next_node["addr"], "range_summary", left, right, fanout)
+    except Exception as e:
+        logger.error(e)
+        return None
+
+
+async def rpc_range_digests(
+    next_node: dict, left: int, right: int, pool: ConnectionPool
+) -> Optional[List[list]]:
+    """
+    Gets the stored ids of a node in the ring interval (left, right] with the digest of their value.
+    Args:
+        next_node (dict): The node to ask.
+        left (int): Start of the interval (exclusive).
+        right (int): End of the interval (inclusive).
+        pool (ConnectionPool): Connections to other nodes.
+    Returns:
+        list: [id, digest] per stored value, None if the call failed.
+    """
+    try:
+        return await pool.call(next_node["addr"], "range_digests", left, right)
+    except Exception as e:
+        logger.error(e)
+        return None
+
+
+async def rpc_get_entries(next_node: dict, keys: List[int], pool: ConnectionPool) -> Optional[List[list]]:
+    """
+    Gets stored entries of a node with their expiry and integrity tag.
+    Args:
+        next_node (dict): The node holding the entries.
+        keys (list): The keys of the entries.
+        pool (ConnectionPool): Connections to other nodes.
+    Returns:
+        entries (list): [key, value, seconds left to live, tag] of every entry found, None if the call failed.
+    """
+    try:
+        return await pool.call(next_node["addr"], "get_entries", keys)
+    except Exception as e:
+        logger.error(e)
+        return None
+
+
+async def rpc_relink(
+    next_node: dict, leaving: dict, predecessor: Optional[dict], successors: List[dict], pool: ConnectionPool
+) -> bool:
+    """
+    Tells a neighbour of a leaving node to link to the other neighbours instead.
+    Args:
+        next_node (dict): The neighbour.
+        leaving (dict): The leaving node.
+        predecessor (dict): The predecessor of the leaving node.
+        successors (list): The successor list of the leaving node.
+        pool (ConnectionPool): Connections to other nodes.
+    Returns:
+        bool: Whether the neighbour was reached.
+    """
+    try:
+        await pool.call(next_node["addr"], "relink", leaving, predecessor, successors)
+        return True
+    except Exception as e:
+        logger.error(e)
+        return False
+
+
+async def rpc_get_keys_batch(
+    next_node: dict, node_id: int, left: int, cursor: Optional[list], limit: int, pool: ConnectionPool
+) -> Optional[tuple]:
+    """
+    Gets the next batch of keys the node with the given node_id takes over from `next_node`.
+    Args:
+        next_node (dict): The node holding the keys.
+        node_id (int): The id of the joining node.
+        left (int): The predecessor the joining node expects, it takes over (left, node_id].
+        cursor (list): None for the first batch, else the cursor returned with the previous batch.
+        limit (int): Maximum number of keys in the batch.
+        pool (ConnectionPool): Connections to other nodes.
+    Returns:
+        entries (list): [key, value, seconds left to live, tag] of the keys in the batch.
+        cursor (list): Cursor for the next batch, None once the transfer is complete.
+    """
+    try:
+        return await pool.call(next_node["addr"], "get_keys_batch", node_id, left, cursor, limit)
     except Exception as e:
         logger.error(e)
         return None
@@ -1,13 +1,18 @@
 import hashlib
 import hmac
 import os
+import random
+import time
 from binascii import unhexlify
-from typing import List
+from bisect import bisect_left, bisect_right
+from typing import List, Optional, Union
 
 from diskcache import Cache
 from loguru import logger
 
-from chord.helpers import between
+from chord.cache import HotCache
+from chord.helpers import ring
+from chord.log import hot_logger
 
 
 class Storage:
@@ -17,60 +22,212 @@ class Storage:
     successor about the current node.
     """
 
+    # marks stores with integer ids and raw byte values
+    _FORMAT_KEY = "format"
+    _FORMAT = 2
+
+    # policies to verify the tag of a value when it is read
+    VERIFY_ALWAYS = "always"
+    VERIFY_SAMPLED = "sampled"
+    VERIFY_SCRUB = "scrub"
+
     def make_digest(self, message: bytes) -> str:
-        secret_key = os.environ.get("SEC_KEY", self.node_id)
-        return hmac.new(secret_key.encode("utf-8"), message, hashlib.sha256,).hexdigest()
+        digest = self._hmac.copy()
+        digest.update(message)
+        return digest.hexdigest()
 
-    def __init__(self, node_id: str):
-        self._store = Cache("./chord_data")
+    def __init__(
+        self,
+        node_id: str,
+        directory: str = "./chord_data",
+        cache_bytes: int = 0,
+        verify_reads: str = VERIFY_ALWAYS,
+        verify_sample_rate: float = 0.05,
+    ):
+        """
+        Args:
+            node_id (string): Hex id of the node, the HMAC key unless SEC_KEY is set.
+            directory (string): Directory of the disk cache.
+            cache_bytes (int): Size of the in-memory cache of popular values, 0 disables it.
+            verify_reads (string): Verify the tag on every read (always), on a
+            `verify_sample_rate` share of the reads (sampled) or only in `scrub`.
+            verify_sample_rate (float): Share of the reads verified by the sampled policy.
+        """
+        self._store = Cache(directory)
+        # values of popular keys, served without disk I/O and HMAC
+        self._hot = HotCache(cache_bytes) if cache_bytes > 0 else None
         self.node_id = node_id
+        # with a ring-wide key the tags of other nodes are valid here as well
+        self._shared_key = "SEC_KEY" in os.environ
+        # keyed HMAC state, copied for every message
+        secret_key = os.environ.get("SEC_KEY", self.node_id)
+        self._hmac = hmac.new(secret_key.encode("utf-8"), digestmod=hashlib.sha256)
+        if verify_reads not in (self.VERIFY_ALWAYS, self.VERIFY_SAMPLED, self.VERIFY_SCRUB):
+            raise ValueError(f"Unknown read verification policy {verify_reads}")
+        self._verify_rate = {self.VERIFY_ALWAYS: 1, self.VERIFY_SAMPLED: verify_sample_rate}.get(verify_reads, 0)
+        # the scrubber continues after this id
+        self._scrub_after = -1
+        # all stored ring ids in ascending order, for range queries
+        self._index = []
+        # sha1 of the stored values, computed when anti-entropy first asks for them
+        self._digests = {}
+        self._load_index()
+
+    def _load_index(self):
+        """
+        Builds the sorted index of stored ids and migrates stores of older versions:
+        hex string keys of the ring id are moved to integer keys and hex string
+        values are stored as raw bytes, their tags stay valid as they were computed
+        over the raw bytes already. Hex keys of a ring with a different id width are
+        left untouched, they migrate once the node runs with their `finger_table_sz`.
+        """
+        migrate = self._store.get(self._FORMAT_KEY) != self._FORMAT
+        keys = []
+        for key in list(self._store.iterkeys()):
+            if key == self._FORMAT_KEY:
+                continue
+            if not migrate and not isinstance(key, str):
+                keys.append(key)
+                continue
+            value, expire_time, tag = self._store.get(key, expire_time=True, tag=True)
+            new_key = key
+            if isinstance(key, str):
+                if len(key) * 4 != ring.bits:
+                    logger.warning(f"Keeping legacy key {key}, it does not belong to a {ring.bits} bit ring.")
+                    continue
+                self._store.delete(key)
+                if value is None:
+                    continue
+                new_key = int(key, 16)
+            elif not isinstance(value, str):
+                if value is not None:
+                    keys.append(key)
+                continue
+            if isinstance(value, str):
+                value = unhexlify(value)
+            expire = None if expire_time is None else max(expire_time - time.time(), 0)
+            self._store.set(new_key, value, expire=expire, tag=tag)
+            keys.append(new_key)
+        self._store.set(self._FORMAT_KEY, self._FORMAT)
+        self._index = sorted(set(keys))
+
+    def _invalidate(self, key: int):
+        self._digests.pop(key, None)
+        if self._hot is not None:
+            self._hot.invalidate(key)
+
+    def _index_add(self, key: int):
+        pos = bisect_left(self._index, key)
+        if pos == len(self._index) or self._index[pos] != key:
+            self._index.insert(pos, key)
+
+    def _index_remove(self, key: int):
+        self._digests.pop(key, None)
+        pos = bisect_left(self._index, key)
+        if pos < len(self._index) and self._index[pos] == key:
+            del self._index[pos]
 
-    def get_key(self, key: str):
+    def _index_range(self, left: int, right: int, limit: Optional[int] = None) -> List[int]:
+        """
+        Stored ids in the ring interval (left, right), both exclusive, at most `limit` of them.
+        """
+        lo = bisect_right(self._index, left)
+        hi = bisect_left(self._index, right)
+        if limit is None:
+            limit = len(self._index)
+        if left < right:
+            return self._index[lo : min(hi, lo + limit)]
+        # the interval wraps around zero
+        head = self._index[lo : lo + limit]
+        return head + self._index[: min(hi, limit - len(head))]
+
+    def get_key(self, key: int):
         """
         If they a key maps to a stored value, return the value.
           Args:
-            key (string): The key that ideally maps to a desired value
+            key (int): The ring id that ideally maps to a desired value
           Returns:
-            value (string): The value stored under the provided key. (if one exists)
+            value (bytes): The value stored under the provided key. (if one exists)
         """
+        if self._hot is not None:
+            value = self._hot.get(key)
+            if value is not None:
+                return value
         value = None
         try:
-            value, tag = self._store.get(f"{key}", tag=True)
-            if value:
-                _val_bytes = unhexlify(value)
-                logger.debug(f"Got {value} with digest {tag} - {self.make_digest(_val_bytes)}")
-                if tag != self.make_digest(_val_bytes):
+            value, expire_time, tag = self._store.get(key, expire_time=True, tag=True)
+            if value and self._should_verify():
+                digest = self.make_digest(value)
+                hot_logger.debug("Got {} bytes with digest {} - {}", len(value), tag, digest)
+                if tag != digest:
                     return None
+                # only verified values are cached, scrub could not protect the others
+                if self._hot is not None:
+                    self._hot.put(key, value, expire_time)
         except (TimeoutError, AttributeError) as e:
             logger.error(e)
             pass
         return value
 
-    def put_key(self, key: str, value: str, ttl: int = 3600) -> bool:
+    def _should_verify(self) -> bool:
+        return self._verify_rate >= 1 or (self._verify_rate > 0 and random.random() < self._verify_rate)
+
+    def scrub(self, limit: int = 256) -> int:
+        """
+        Verifies the tags of the next `limit` stored values and deletes the corrupted ones.
+        Every call continues where the previous one stopped, wrapping around the ring.
+            Args:
+                limit (int): Maximum number of values to verify.
+            Returns:
+                corrupted (int): Number of deleted values.
+        """
+        keys = self._index_range(self._scrub_after, self._scrub_after, limit)
+        if not keys:
+            self._scrub_after = -1
+            return 0
+        corrupted = 0
+        for key in keys:
+            value, tag = self._store.get(key, tag=True)
+            if value is None:
+                # expired or evicted
+                self._index_remove(key)
+            elif tag != self.make_digest(value):
+                logger.warning(f"Deleting corrupted value of key {key}.")
+                self._del_key(key)
+                corrupted += 1
+        self._scrub_after = keys[-1]
+        return corrupted
+
+    def put_key(self, key: int, value: bytes, ttl: int = 3600) -> bool:
         """
         Stores the `value` under the provided  `key`.
             Args:
-                key (string): The key under which a vlue shall be stored.
-                value (string): The value / data being stored.
+                key (int): The ring id under which a vlue shall be stored.
+                value (bytes): The value / data being stored.
                 ttl (int): time to live. How long this should remain in the network.
         """
-        _byte_val = unhexlify(value)
-        logger.debug(f"Saving Key: {key} with ttl {ttl}secs")
+        hot_logger.debug("Saving Key: {} with ttl {}secs", key, ttl)
+        self._invalidate(key)
         try:
-            return self._store.set(key, value=value, expire=ttl, tag=self.make_digest(_byte_val))
+            is_set = self._store.set(key, value=value, expire=ttl, tag=self.make_digest(value))
+            if is_set:
+                self._index_add(key)
+            return is_set
         except Exception as e:
             logger.error(e)
             return False
 
-    def _del_key(self, key):
+    def _del_key(self, key: int):
         """
         Deletes the given `key` from storage.
             Args:
-                key (string): The key to be deleted.
+                key (int): The key to be deleted.
         """
+        self._index_remove(key)
+        self._invalidate(key)
         return self._store.delete(key)
 
-    def del_keys(self, keys: List[str]):
+    def del_keys(self, keys: List[int]):
         """
         Deletes multiple keys from storage.
         Args:
@@ -87,43 +244,148 @@ class Storage:
         """
         keys = []
         values = []
-        for key in self._store.iterkeys():
+        for key in list(self._index):
             val = self.get_key(key)
             if val:
                 keys.append(key)
                 values.append(val)
         return keys, values
 
-    def get_keys(self, left: int, right: int):
+    def del_range(self, left: int, right: int):
+        """
+        Deletes all keys within range: left (exclusive) to right (exclusive).
+            Args:
+                left (int): The start interval (exclusive).
+                right (int): The end intervale (exclusive).
+        """
+        self.del_keys(self._index_range(left, right))
+
+    def get_keys(self, left: int, right: int, limit: Optional[int] = None):
         """
         Gets all keys and values of the current storage instance within range:
-        left (exclusive) to right (exclusive).
+        left (exclusive) to right (exclusive), in ring order starting at left.
+        Uses the sorted id index, so only the keys inside the range are read.
             Args:
                 left (int): The start interval (exclusive).
                 right (int): The end intervale (exclusive).
+                limit (int): Maximum number of keys to return.
         """
         keys = []
         values = []
-        logger.debug(list(self._store.iterkeys()))
-        for key in self._store.iterkeys():
-            logger.debug(
-                f"{key} - ({left}, {right}) => {between(int(key, 16), left, right, inclusive_left=False, inclusive_right=False)}"
-            )
-            if between(int(key, 16), left, right, inclusive_left=False, inclusive_right=False):
-                val = self.get_key(key)
-                if val:
-                    keys.append(key)
-                    values.append(val)
+        for key in self._index_range(left, right, limit):
+            val = self.get_key(key)
+            if val:
+                keys.append(key)
+                values.append(val)
+            elif key not in self._store:
+                # expired or evicted
+                self._index_remove(key)
 
-        logger.debug(f"Got {keys} => {values}")
+        hot_logger.debug("Got {} keys in ({}, {})", len(keys), left, right)
         return keys, values
 
-    def put_keys(self, keys, values):
+    def put_keys(self, keys, values, ttl: Union[int, List[int]] = 3600) -> List[bool]:
         """
-        Stroes multiple key value pairs.
+        Stroes multiple key value pairs in a single transaction.
             Args:
                 keys (list): The list of keys.
                 values (list): The list of values.
+                ttl (int): time to live of all values, or a list with the time to live of each value.
+            Returns:
+                saved (list): Whether each pair was stored.
+        """
+        ttls = ttl if isinstance(ttl, list) else [ttl] * len(keys)
+        with self._store.transact():
+            return [self.put_key(key, values[idx], ttl=ttls[idx]) for idx, key in enumerate(keys)]
+
+    def get_ids(self, left: int, right: int) -> List[int]:
+        """
+        Stored ids within range: left (exclusive) to right (inclusive), in ring order
+        starting at left. The whole ring if left == right.
+            Args:
+                left (int): The start interval (exclusive).
+                right (int): The end intervale (inclusive).
+        """
+        if left != right:
+            return self._index_range(left, (right + 1) & ring.mask)
+        ids = self._index_range(left, left)
+        pos = bisect_left(self._index, left)
+        if pos < len(self._index) and self._index[pos] == left:
+            ids.append(left)
+        return ids
+
+    def get_digests(self, left: int, right: int) -> List[list]:
+        """
+        Stored ids within range: left (exclusive) to right (inclusive) with the
+        sha1 digest of their value, in ring order starting at left. Unlike the
+        tags the digests are the same on every node storing the value.
+            Args:
+                left (int): The start interval (exclusive).
+                right (int): The end intervale (inclusive).
+            Returns:
+                digests (list): [id, digest] per stored value.
+        """
+        digests = []
+        for key in self.get_ids(left, right):
+            digest = self._digests.get(key)
+            if digest is None:
+                value = self._store.get(key)
+                if value is None:
+                    # expired or evicted
+                    self._index_remove(key)
+                    continue
+                digest = self._digests[key] = hashlib.sha1(value).digest()
+            digests.append([key, digest])
+        return digests
+
+    def get_entries(self, left: int, right: int, limit: Optional[int] = None) -> List[list]:
+        """
+        Gets the stored entries within range: left (exclusive) to right (exclusive),
+        with their remaining time to live and integrity tag, for transfer to another node.
+            Args:
+                left (int): The start interval (exclusive).
+                right (int): The end intervale (exclusive).
+                limit (int): Maximum number of entries to return.
+            Returns:
+                entries (list): [key, value, seconds left to live or None, tag] per entry.
+        """
+        return self.get_entries_for(self._index_range(left, right, limit))
+
+    def get_entries_for(self, keys: List[int]) -> List[list]:
+        """
+        Gets the stored entries of the given keys, like `get_entries`. Missing keys are skipped.
+            Args:
+                keys (list): The keys of the entries.
+            Returns:
+                entries (list): [key, value, seconds left to live or None, tag] per entry.
+        """
+        entries = []
+        now = time.time()
+        for key in keys:
+            value, expire_time, tag = self._store.get(key, expire_time=True, tag=True)
+            if value is None:
+                # expired or evicted
+                self._index_remove(key)
+                continue
+            if not self._shared_key and tag != self.make_digest(value):
+                # the receiver cannot check our tags, so only hand out intact values
+                continue
+            entries.append([key, value, None if expire_time is None else expire_time - now, tag])
+        return entries
+
+    def put_entries(self, entries: List[list]):
+        """
+        Stores entries received from another node in a single transaction,
+        keeping their remaining time to live and integrity tag.
+            Args:
+                entries (list): [key, value, seconds left to live or None, tag] per entry.
         """
-        for idx, key in enumerate(keys):
-            self.put_key(key, values[idx])
+        with self._store.transact():
+            for key, value, expire, tag in entries:
+                if expire is not None and expire <= 0:
+                    continue
+                if not self._shared_key:
+                    tag = self.make_digest(value)
+                self._invalidate(key)
+                self._store.set(key, value, expire=expire, tag=tag)
+                self._index_add(key)
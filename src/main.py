@@ -1,12 +1,15 @@
 import argparse
 import asyncio
 import os
+import signal
+import sys
 
 import aiomas
 import nest_asyncio
 from loguru import logger
 
 from api.controller import ApiController
+from chord.codec import MsgPack
 from chord.node import Node
 from config.config import dht_config
 
@@ -32,15 +35,31 @@ async def _start_chord_node(args):
     return host, int(port), Node(host=host, port=port)
 
 
+def _leave_on_signal(loop, chord_node: Node, maintenance: list, servers: list):
+    """
+    Leave the ring gracefully on SIGTERM / SIGINT before the process exits.
+    """
+
+    async def _leave():
+        logger.info("Leaving the ring...")
+        if not await chord_node.leave(maintenance):
+            logger.error("Could not leave the ring gracefully.")
+        for task in maintenance + servers:
+            task.cancel()
+
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        loop.add_signal_handler(sig, lambda: asyncio.ensure_future(_leave()))
+
+
 async def _start(args: argparse.Namespace):
     nest_asyncio.apply()
 
     dht_host, dht_port, chord_node = await _start_chord_node(args)
     loop = asyncio.get_event_loop()
 
-    stabilize_task = loop.create_task(chord_node.stabilize())
-    fix_fingers_task = loop.create_task(chord_node.fix_fingers())
-    check_pred_task = loop.create_task(chord_node.check_predecessor())
+    maintain_task = loop.create_task(chord_node.maintain())
+    scrub_task = loop.create_task(chord_node.scrub())
+    repair_task = loop.create_task(chord_node.repair())
 
     if args.bootstrap_node:
         await chord_node.join(bootstrap_node=args.bootstrap_node)
@@ -56,7 +75,9 @@ async def _start(args: argparse.Namespace):
         keyfile=os.path.join(certs_dir, "node.key"),
     )
 
-    chord_rpc_server = await aiomas.rpc.start_server((dht_host, dht_port), chord_node, ssl=server_ctx)
+    chord_rpc_server = await aiomas.rpc.start_server(
+        (dht_host, dht_port), chord_node, ssl=server_ctx, codec=MsgPack
+    )
 
     logger.info(f"Chord RPC Server start at: {dht_host}:{dht_port}")
 
@@ -69,21 +90,19 @@ async def _start(args: argparse.Namespace):
         api_port = int(api_address.split(":")[1])
         api_server = await _start_api_server(api_host, str(api_port), chord_node)
         async with api_server, chord_rpc_server:
-            return await asyncio.gather(
-                api_server.serve_forever(),
-                loop.run_until_complete(chord_rpc_server.serve_forever()),
-                loop.run_until_complete(stabilize_task),
-                loop.run_until_complete(fix_fingers_task),
-                loop.run_until_complete(check_pred_task),
-            )
+            servers = [
+                loop.create_task(api_server.serve_forever()),
+                loop.create_task(chord_rpc_server.serve_forever()),
+            ]
+            maintenance = [maintain_task, scrub_task, repair_task]
+            _leave_on_signal(loop, chord_node, maintenance, servers)
+            return await asyncio.gather(*servers, *maintenance, return_exceptions=True)
     else:
         async with chord_rpc_server:
-            return await asyncio.gather(
-                loop.run_until_complete(chord_rpc_server.serve_forever()),
-                loop.run_until_complete(stabilize_task),
-                loop.run_until_complete(fix_fingers_task),
-                loop.run_until_complete(check_pred_task),
-            )
+            servers = [loop.create_task(chord_rpc_server.serve_forever())]
+            maintenance = [maintain_task, scrub_task, repair_task]
+            _leave_on_signal(loop, chord_node, maintenance, servers)
+            return await asyncio.gather(*servers, *maintenance, return_exceptions=True)
 
 
 if __name__ == "__main__":
@@ -97,4 +116,6 @@ if __name__ == "__main__":
         "--bootstrap-node", help="Start a new Chord Ring if argument no present", default=None,
     )
     arguments = parser.parse_args()
+    logger.remove()
+    logger.add(sys.stderr, level=dht_config["log_level"])
     asyncio.run(_start(arguments))
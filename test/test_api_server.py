@@ -1,3 +1,4 @@
+import asyncio
 import struct
 
 import pytest
@@ -6,10 +7,10 @@ from api.controller import ApiController
 
 
 class MockNode:
-    async def find_key(self, key: str):
-        if key != "found".encode("utf-8").ljust(32, b"\0").hex():
+    async def find_key(self, key: bytes):
+        if key != "found".encode("utf-8").ljust(32, b"\0"):
             return None
-        return "value".encode("utf-8").hex()
+        return "value".encode("utf-8")
 
 
 @pytest.fixture(autouse=True)
@@ -33,3 +34,129 @@ async def test_api_get_existing_key(controller, mocker):
     res = await controller.process_data(data)
     val = "value".encode("utf-8")
     assert res == (struct.pack(">HH", 4 + 32 + len(val), 652) + key + val)
+
+
+@pytest.mark.asyncio
+async def test_api_put_passes_raw_bytes(controller, mocker):
+    controller.service.chord_node.put_key = mocker.AsyncMock()
+    key = "put".encode("utf-8").ljust(32, b"\0")
+    val = b"\x00\xffvalue"
+    data = struct.pack(">HHHBB", 8 + 32 + len(val), 650, 60, 3, 0) + key + val
+    assert await controller.service.process_message(data) is None
+    controller.service.chord_node.put_key.assert_awaited_once_with(key, val, 60)
+
+
+@pytest.mark.asyncio
+async def test_api_put_fails_without_quorum(controller, mocker):
+    controller.service.chord_node.put_key = mocker.AsyncMock(return_value=[])
+    key = "put".encode("utf-8").ljust(32, b"\0")
+    data = struct.pack(">HHHBB", 8 + 32 + 5, 650, 60, 3, 0) + key + b"value"
+    assert await controller.service.process_message(data) == struct.pack(">HH", 4 + 32, 653) + key
+
+
+class SlowNode:
+    async def find_key(self, key: bytes):
+        # the first requests take longest
+        await asyncio.sleep(0.01 * (3 - key[0]))
+        return b"value" + key[:1]
+
+
+def get_message(i: int):
+    key = bytes([i]).ljust(32, b"\0")
+    return key, struct.pack(">HH", 36, 651) + key
+
+
+@pytest.mark.asyncio
+async def test_api_reassembles_split_and_coalesced_frames(mocker):
+    controller = ApiController(SlowNode())
+    transport = mocker.Mock()
+    controller.connection_made(transport)
+    stream = b"".join(get_message(i)[1] for i in range(3))
+
+    # the first message arrives in two chunks, the rest in one
+    controller.data_received(stream[:10])
+    controller.data_received(stream[10:])
+    await asyncio.sleep(0.1)
+
+    replies = [call.args[0] for call in transport.write.call_args_list]
+    expected = []
+    for i in range(3):
+        key, _ = get_message(i)
+        val = b"value" + bytes([i])
+        expected.append(struct.pack(">HH", 4 + 32 + len(val), 652) + key + val)
+    # processed concurrently, replied in request order
+    assert replies == expected
+    transport.close.assert_not_called()
+
+
+@pytest.mark.asyncio
+async def test_api_closes_connection_on_invalid_message(mocker):
+    controller = ApiController(SlowNode())
+    transport = mocker.Mock()
+    controller.connection_made(transport)
+    controller.data_received(struct.pack(">HH", 4, 999))
+    await asyncio.sleep(0.01)
+    transport.write.assert_not_called()
+    transport.close.assert_called_once()
+
+
+@pytest.mark.asyncio
+async def test_api_pauses_reading_at_in_flight_limit(mocker):
+    controller = ApiController(SlowNode())
+    controller._max_in_flight = 2
+    transport = mocker.Mock()
+    controller.connection_made(transport)
+
+    controller.data_received(b"".join(get_message(i)[1] for i in range(3)))
+    assert len(controller._pending) == 2
+    transport.pause_reading.assert_called_once()
+
+    await asyncio.sleep(0.1)
+    assert transport.write.call_count == 3
+    transport.resume_reading.assert_called_once()
+
+
+@pytest.mark.asyncio
+async def test_api_rejects_requests_when_overloaded(mocker):
+    controller = ApiController(SlowNode())
+    controller._max_in_flight_total = 1
+    transport = mocker.Mock()
+    controller.connection_made(transport)
+
+    controller.data_received(get_message(0)[1] + get_message(1)[1])
+    await asyncio.sleep(0.1)
+
+    key, _ = get_message(1)
+    replies = [call.args[0] for call in transport.write.call_args_list]
+    assert replies[1] == struct.pack(">HH", 4 + 32, 653) + key
+    assert ApiController.in_flight_total == 0
+
+
+@pytest.mark.asyncio
+async def test_api_multi_get_and_put(mocker):
+    store = {}
+
+    class BatchNode:
+        async def put_keys(self, items, ttl):
+            store.update(items)
+            return [key for key, _ in items]
+
+        async def find_keys(self, keys):
+            return [store.get(key) for key in keys]
+
+    controller = ApiController(BatchNode())
+    keys = [bytes([i]).ljust(32, b"\0") for i in range(3)]
+    body = b"".join(key + struct.pack(">H", 2) + b"v" + key[:1] for key in keys[:2])
+    put = struct.pack(">HHHBB", 8 + len(body), 655, 60, 3, 0) + body
+    assert await controller.process_data(put) is None
+    assert store == {keys[0]: b"v\x00", keys[1]: b"v\x01"}
+
+    get = struct.pack(">HH", 4 + 32 * 3, 654) + b"".join(keys)
+    assert await controller.process_data(get) == (
+        struct.pack(">HH", 4 + 32 + 2, 652) + keys[0] + b"v\x00"
+        + struct.pack(">HH", 4 + 32 + 2, 652) + keys[1] + b"v\x01"
+        + struct.pack(">HH", 4 + 32, 653) + keys[2]
+    )
+
+    # truncated entry
+    assert await controller.process_data(struct.pack(">HHHBB", 8 + 33, 655, 60, 3, 0) + keys[0] + b"\0") is False
@@ -0,0 +1,65 @@
+import asyncio
+
+import pytest
+
+from chord.batch import Coalescer
+
+
+@pytest.mark.asyncio
+async def test_batches_per_peer_and_method():
+    sent = []
+
+    async def call(addr, method, items):
+        sent.append((addr, method, items))
+        return [item * 2 for item in items]
+
+    coalescer = Coalescer(call, delay=0.01, max_batch=10)
+    results = await asyncio.gather(
+        coalescer.call("a", "m", 1), coalescer.call("b", "m", 2), coalescer.call("a", "m", 3)
+    )
+    assert results == [2, 4, 6]
+    assert sorted(sent) == [("a", "m", [1, 3]), ("b", "m", [2])]
+
+
+@pytest.mark.asyncio
+async def test_failed_batch_fails_every_call():
+    async def call(addr, method, items):
+        raise ConnectionRefusedError()
+
+    coalescer = Coalescer(call, delay=0.01, max_batch=10)
+    results = await asyncio.gather(
+        coalescer.call("a", "m", 1), coalescer.call("a", "m", 2), return_exceptions=True
+    )
+    assert all(isinstance(res, ConnectionRefusedError) for res in results)
+
+
+@pytest.mark.asyncio
+async def test_no_delay_sends_right_away():
+    sent = []
+
+    async def call(addr, method, items):
+        sent.append(items)
+        return items
+
+    coalescer = Coalescer(call, delay=0, max_batch=10)
+    assert await coalescer.call("a", "m", 1) == 1
+    assert sent == [[1]]
+
+
+@pytest.mark.asyncio
+async def test_close_fails_batches_being_sent():
+    started = asyncio.Event()
+
+    async def call(addr, method, items):
+        started.set()
+        await asyncio.sleep(10)
+
+    coalescer = Coalescer(call, delay=0.001, max_batch=1)
+    pending = asyncio.ensure_future(coalescer.call("a", "m", 1))
+    await started.wait()
+    assert len(coalescer._sending) == 1
+    coalescer.close()
+    with pytest.raises(ConnectionError):
+        await pending
+    await asyncio.sleep(0)
+    assert not coalescer._sending
@@ -0,0 +1,31 @@
+import time
+
+from chord.cache import HotCache
+
+
+def test_evicts_least_recently_used_by_size():
+    cache = HotCache(max_bytes=10)
+    cache.put(1, "aaaa")
+    cache.put(2, "bbbb")
+    assert cache.get(1) == "aaaa"
+    cache.put(3, "cccc")
+    assert 2 not in cache
+    assert cache.get(1) == "aaaa"
+    assert cache.get(3) == "cccc"
+    assert cache.size == 8
+
+
+def test_expired_and_invalidated_values_are_dropped():
+    cache = HotCache(max_bytes=100)
+    cache.put(1, "a", expire_time=time.time() - 1)
+    assert cache.get(1) is None
+    cache.put(2, "b")
+    cache.invalidate(2)
+    assert cache.get(2) is None
+    assert cache.size == 0
+
+
+def test_values_larger_than_the_cache_are_not_cached():
+    cache = HotCache(max_bytes=2)
+    cache.put(1, "abc")
+    assert len(cache) == 0
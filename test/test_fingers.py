@@ -0,0 +1,58 @@
+import random
+
+from chord.fingers import FingerTable
+from chord.helpers import between, gen_finger, ring
+
+
+def linear_closest_preceding(owner_id, fingers, numeric_id):
+    best = None
+    for finger in fingers:
+        if finger and between(finger["numeric_id"], owner_id, numeric_id, inclusive_right=False):
+            dist = (finger["numeric_id"] - owner_id) & ring.mask
+            if best is None or dist > (best["numeric_id"] - owner_id) & ring.mask:
+                best = finger
+    return best
+
+
+def test_closest_preceding_matches_linear_scan():
+    rnd = random.Random(7)
+    owner = gen_finger("127.0.0.1:5000")
+    nodes = [gen_finger(f"127.0.0.1:{port}") for port in range(5001, 5021)]
+    table = FingerTable(owner["numeric_id"], ring.bits)
+    for i in range(ring.bits):
+        table[i] = rnd.choice(nodes)
+
+    fingers = [table[i] for i in range(ring.bits)]
+    for _ in range(200):
+        target = rnd.randrange(ring.size)
+        assert table.closest_preceding(target) == linear_closest_preceding(owner["numeric_id"], fingers, target)
+
+
+def test_empty_and_self_fingers_do_not_precede():
+    owner = gen_finger("127.0.0.1:5000")
+    table = FingerTable(owner["numeric_id"], ring.bits)
+    assert table.closest_preceding(owner["numeric_id"] + 1) is None
+    table.fill(owner)
+    assert table.closest_preceding(owner["numeric_id"] - 1) is None
+
+
+def test_runs_group_consecutive_fingers():
+    owner = gen_finger("127.0.0.1:5000")
+    other = gen_finger("127.0.0.1:5001")
+    table = FingerTable(owner["numeric_id"], 4)
+    table.fill(owner)
+    table[2] = other
+    table[3] = other
+    assert [run["fingers"] for run in table.runs()] == ["0-1", "2-3"]
+    assert table.runs()[1]["addr"] == other["addr"]
+
+
+def test_replace_points_fingers_to_new_node():
+    owner = gen_finger("127.0.0.1:5000")
+    other = gen_finger("127.0.0.1:5001")
+    table = FingerTable(owner["numeric_id"], 4)
+    table.fill(owner)
+    table[2] = other
+    table.replace(owner["addr"], other)
+    assert [table[i] for i in range(4)] == [other] * 4
+    assert table.closest_preceding(other["numeric_id"] - 1) is None
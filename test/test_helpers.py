@@ -0,0 +1,29 @@
+from chord.helpers import RingGeometry, between, generate_id, replica_ids, ring
+
+
+def test_ring_geometry():
+    geometry = RingGeometry(8)
+    assert geometry.size == 256
+    assert geometry.mask == 255
+    assert geometry.finger_offsets[:4] == (1, 2, 4, 8)
+    assert geometry.finger_start(250, 3) == 2
+
+
+def test_between_wraps_around_the_ring():
+    assert between(5, 2, 10)
+    assert not between(2, 2, 10)
+    assert between(2, 2, 10, inclusive_left=True)
+    assert between(10, 2, 10)
+    assert not between(10, 2, 10, inclusive_right=False)
+    assert between(1, ring.size - 4, 3)
+    assert between(ring.size - 1, ring.size - 4, 3)
+    assert not between(5, ring.size - 4, 3)
+
+
+def test_generate_id_is_an_integer_on_the_ring():
+    _id = generate_id("127.0.0.1:6501")
+    assert isinstance(_id, int)
+    assert 0 <= _id < ring.size
+    # raw keys keep the ring position of their hex form
+    assert generate_id(b"\x01\xff") == generate_id("01ff")
+    assert replica_ids("key", 2) == [generate_id("key"), generate_id(generate_id("key"))]
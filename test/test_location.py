@@ -0,0 +1,49 @@
+import time
+
+from chord.helpers import ring
+from chord.location import LocationCache
+
+
+def node(numeric_id, addr=None):
+    return {"addr": addr or f"localhost:{numeric_id}", "numeric_id": numeric_id}
+
+
+def test_span_in_front_of_the_node_is_cached():
+    cache = LocationCache(ttl=60, max_nodes=10)
+    cache.add(40, node(100))
+    assert cache.get(40) == node(100)
+    assert cache.get(99) == node(100)
+    assert cache.get(100) == node(100)
+    assert cache.get(39) is None
+    assert cache.get(101) is None
+    cache.add(10, node(100))
+    assert cache.get(20) == node(100)
+
+
+def test_span_wraps_around_the_ring():
+    cache = LocationCache(ttl=60, max_nodes=10)
+    cache.add(ring.size - 5, node(3))
+    assert cache.get(ring.size - 1) == node(3)
+    assert cache.get(0) == node(3)
+    assert cache.get(4) is None
+
+
+def test_expired_and_invalidated_nodes_are_dropped():
+    cache = LocationCache(ttl=60, max_nodes=10)
+    cache.add(10, node(20))
+    cache.add(30, node(40))
+    cache.invalidate("localhost:20")
+    assert cache.get(15) is None
+    assert cache.get(35) == node(40)
+    cache._entries[40] = (node(40), 10, time.monotonic() - 1)
+    assert cache.get(35) is None
+    assert len(cache) == 0
+
+
+def test_oldest_node_is_evicted():
+    cache = LocationCache(ttl=60, max_nodes=2)
+    for numeric_id in (10, 20, 30):
+        cache.add(numeric_id, node(numeric_id))
+    assert len(cache) == 2
+    assert cache.get(10) is None
+    assert cache.get(30) == node(30)
@@ -0,0 +1,23 @@
+from chord.log import HotLogger
+
+
+def test_disabled_levels_skip_loguru(mocker):
+    opt = mocker.patch("chord.log.logger.opt")
+    sample = mocker.patch("chord.log.random.random", return_value=0.0)
+    hot = HotLogger(sample_rate=0.5, level="WARNING")
+
+    hot.debug("key {}", 1)
+    hot.info("key {}", 1)
+    assert not opt.called
+    assert not sample.called
+
+    hot.warning("key {}", 1)
+    assert opt.call_count == 1
+
+
+def test_set_level_enables_lower_levels(mocker):
+    opt = mocker.patch("chord.log.logger.opt")
+    hot = HotLogger(level="WARNING")
+    hot.set_level("DEBUG")
+    hot.debug("key {}", 1)
+    assert opt.call_count == 1
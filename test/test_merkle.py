@@ -0,0 +1,44 @@
+import hashlib
+import random
+
+from chord.helpers import ring
+from chord.merkle import interval_length, split, summarize
+
+
+def test_split_covers_interval():
+    left, right = ring.size - ring.size // 8, ring.size // 4
+    children = split(left, right, 16)
+    assert children[0][0] == left and children[-1][1] == right
+    assert all(a[1] == b[0] for a, b in zip(children, children[1:]))
+    assert sum(interval_length(*child) for child in children) == interval_length(left, right) == ring.size * 3 // 8
+
+
+def test_split_whole_ring():
+    children = split(5, 5, 4)
+    assert children[0][0] == 5 and children[-1][1] == 5
+    assert sum(interval_length(*child) for child in children) == ring.size
+
+
+def digests(ids, value=b"value"):
+    return [[i, hashlib.sha1(value).digest()] for i in ids]
+
+
+def test_summarize_matches_children():
+    left, right = ring.size - ring.size // 4, ring.size // 4
+    ids = [(left + random.randint(1, ring.size // 2)) & ring.mask for _ in range(200)]
+    ids.sort(key=lambda i: (i - left) & ring.mask)
+    summary = summarize(digests(ids), left, right, 8)
+    for (l, r), (_, count) in zip(split(left, right, 8), summary):
+        assert count == sum(1 for i in ids if 0 < (i - l) & ring.mask <= interval_length(l, r))
+    assert sum(count for _, count in summary) == len(ids)
+
+
+def test_summarize_hash_detects_difference():
+    ids = [10, 20, 30]
+    same = summarize(digests(ids), 0, 100, 4)
+    assert summarize(digests(list(ids)), 0, 100, 4) == same
+    moved = summarize(digests([10, 20, 60]), 0, 100, 4)
+    assert [c[0] == s[0] for c, s in zip(moved, same)] == [True, False, False, True]
+    # a changed value shows in the hash of its child
+    changed = summarize(digests([10]) + digests([20], b"other") + digests([30]), 0, 100, 4)
+    assert [c == s for c, s in zip(changed, same)] == [False, True, True, True]
@@ -1,13 +1,113 @@
+import asyncio
+import hashlib
+import hmac
+
 import pytest
+from diskcache import Cache
 
-from chord.helpers import generate_id
+from chord.helpers import gen_finger, generate_id, replica_ids, ring as ring_geometry
 from chord.node import Node
+from chord.rpc import rpc_get_keys
+from chord.storage import Storage
 
 
 def convert_key_val(key: str, val: str):
-    hex_key = generate_id(key)
-    hex_val = val.encode("utf-8").hex()
-    return hex_key, hex_val
+    dht_key = generate_id(key)
+    return dht_key, val.encode("utf-8")
+
+
+def distinct_items(count, replicas=4):
+    """
+    Key value pairs whose replica ids do not collide, small rings have only a few hundred ids.
+    """
+    items, used, idx = [], set(), 0
+    while len(items) < count:
+        key = f"batch_key_{idx}".encode("utf-8")
+        ids = set(replica_ids(key, replicas))
+        if len(ids) == replicas and not ids & used:
+            used |= ids
+            items.append([key, f"value_{idx}".encode("utf-8")])
+        idx += 1
+    return items
+
+
+def make_ring(tmp_path, ports):
+    """
+    Build a stable ring of in-process nodes whose fingers all point to their successor,
+    each node knows its next successors and stores its keys below `tmp_path`.
+    """
+    nodes = sorted((Node("localhost", port) for port in ports), key=lambda n: n._numeric_id)
+    for idx, n in enumerate(nodes):
+        n._storage = Storage(n._addr, directory=str(tmp_path / n._addr))
+        n._successor = gen_finger(nodes[(idx + 1) % len(nodes)]._addr)
+        n._predecessor = gen_finger(nodes[idx - 1]._addr)
+        n._init_empty_fingers()
+        n._successors = [gen_finger(nodes[(idx + k) % len(nodes)]._addr) for k in range(1, 1 + n._MAX_SUCC)]
+    return {n._addr: n for n in nodes}
+
+
+def patch_ring_pools(ring, mocker, down=()):
+    """
+    Route the RPCs sent through the connection pools of the nodes in `ring` to the called node,
+    nodes with their address in `down` do not answer.
+    """
+
+    async def call(addr, method, *args, **kwargs):
+        if addr in down:
+            raise ConnectionError(f"{addr} is down")
+        result = getattr(ring[addr], method)(*args, **kwargs)
+        if asyncio.iscoroutine(result):
+            result = await result
+        return result
+
+    async def call_batched(addr, method, item):
+        return (await call(addr, method, [item]))[0]
+
+    for n in ring.values():
+        mocker.patch.object(n._pool, "call", side_effect=call)
+        mocker.patch.object(n._pool, "call_batched", side_effect=call_batched)
+
+
+def rpc_calls(node, method):
+    """
+    Number of `method` RPCs `node` sent through its patched connection pool.
+    """
+    return sum(1 for call in node._pool.call.call_args_list if call.args[1] == method)
+
+
+def make_handoff(tmp_path, mocker, down=()):
+    """
+    A node joining in front of `source`, halfway between the predecessor of `source` at id 0
+    and `source`. Their RPCs are routed through the patched connection pools.
+    """
+    source, joining = Node("localhost", "5004"), Node("localhost", "5006")
+    for n in (source, joining):
+        n._storage = Storage(n._addr, directory=str(tmp_path / n._addr))
+    source._predecessor = {"addr": "localhost:5005", "numeric_id": 0}
+    source._numeric_id = ring_geometry.size // 2
+    joining._numeric_id = ring_geometry.size // 4
+    joining._handoff = {"source": gen_finger(source._addr), "after": 0}
+    patch_ring_pools({n._addr: n for n in (source, joining)}, mocker, down=down)
+    return source, joining
+
+
+def patch_ring_rpcs(ring, mocker):
+    async def ask_for_succ(next_node, numeric_id, pool):
+        return await ring[next_node["addr"]].find_successor(numeric_id)
+
+    async def find_successor_step(next_node, numeric_id, pool):
+        return ring[next_node["addr"]].find_successor_step(numeric_id)
+
+    async def route_successor(next_node, numeric_id, origin, request_id, hops, pool):
+        return ring[next_node["addr"]].route_successor(numeric_id, origin, request_id, hops)
+
+    async def deliver_successor(origin, request_id, successor, pool):
+        ring[origin].deliver_successor(request_id, successor)
+
+    mocker.patch("chord.node.rpc_ask_for_succ", side_effect=ask_for_succ)
+    mocker.patch("chord.node.rpc_find_successor_step", side_effect=find_successor_step)
+    mocker.patch("chord.node.rpc_route_successor", side_effect=route_successor)
+    mocker.patch("chord.node.rpc_deliver_successor", side_effect=deliver_successor)
 
 
 key, val = convert_key_val("test_node", "node_value")
@@ -28,7 +128,7 @@ async def test_node_put_key(node, mocker):
     await node.join(None)
     mocker.patch(
         "chord.node.rpc_ask_for_succ",
-        return_value=(True, {"addr": node._addr, "id": node._id, "numeric_id": node._numeric_id}),
+        return_value=(True, gen_finger(node._addr)),
     )
     mocker.patch("chord.node.rpc_save_key", side_effect=mock_rpc_save_key)
     key, val = convert_key_val("test_node", "node_value")
@@ -45,7 +145,7 @@ async def test_node_get_key(node, mocker):
     await node.join(None)
     mocker.patch(
         "chord.node.rpc_ask_for_succ",
-        return_value=(True, {"addr": node._addr, "id": node._id, "numeric_id": node._numeric_id}),
+        return_value=(True, gen_finger(node._addr)),
     )
     mocker.patch("chord.node.rpc_get_key", side_effect=mock_rpc_get_key)
     for k in shared_data["keys"]:
@@ -62,10 +162,590 @@ async def test_node_replication(node, mocker):
     await node.join(None)
     mocker.patch(
         "chord.node.rpc_ask_for_succ",
-        return_value=(True, {"addr": node._addr, "id": node._id, "numeric_id": node._numeric_id}),
+        return_value=(True, gen_finger(node._addr)),
     )
     mocker.patch("chord.node.rpc_get_key", side_effect=mock_rpc_get_key)
     node._storage.del_keys(shared_data["keys"][1:])
 
     ret_val = await node.find_key(shared_data["keys"][0])
     assert ret_val == shared_data["value"]
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("mode", ["nested", "iterative", "recursive"])
+async def test_node_lookup_modes(mocker, tmp_path, mode):
+    ring = make_ring(tmp_path, ["5001", "5002", "5003", "5004", "5005"])
+    patch_ring_rpcs(ring, mocker)
+    for n in ring.values():
+        n._LOOKUP_MODE = mode
+
+    origin = next(iter(ring.values()))
+    for target in ring.values():
+        found, succ = await origin.find_successor(target._numeric_id)
+        assert found
+        assert succ["addr"] == target._addr
+
+
+@pytest.mark.asyncio
+async def test_node_put_key_writes_replicas_concurrently(node, mocker):
+    in_flight = {"now": 0, "peak": 0}
+
+    async def mock_rpc_save_key(**kwargs):
+        in_flight["now"] += 1
+        in_flight["peak"] = max(in_flight["peak"], in_flight["now"])
+        await asyncio.sleep(0.01)
+        in_flight["now"] -= 1
+        return True
+
+    await node.join(None)
+    mocker.patch("chord.node.rpc_save_key", side_effect=mock_rpc_save_key)
+    node._WRITE_QUORUM = 1 + node._REPLICATION_COUNT
+    key, val = convert_key_val("concurrent_key", "value")
+
+    keys = await node.put_key(key=key, value=val, ttl=3600)
+    assert len(keys) == 1 + node._REPLICATION_COUNT
+    assert in_flight["peak"] == 1 + node._REPLICATION_COUNT
+
+
+@pytest.mark.asyncio
+async def test_node_find_key_hedges_slow_replica(node, mocker):
+    key, val = convert_key_val("hedged_key", "hedged_value")
+    primary = generate_id(key)
+
+    async def mock_rpc_get_key(**kwargs):
+        if kwargs["key"] == key:
+            # the primary replica hangs
+            await asyncio.sleep(10)
+        return val
+
+    await node.join(None)
+    mocker.patch(
+        "chord.node.rpc_ask_for_succ",
+        return_value=(True, {"addr": "remote:1", "numeric_id": primary}),
+    )
+    mocker.patch("chord.node.rpc_get_key", side_effect=mock_rpc_get_key)
+    mocker.patch.object(node, "_find_key", return_value=(False, None))
+    node._HEDGE_DELAY = 0.01
+
+    assert await asyncio.wait_for(node.find_key(key), 1) == val
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("quorum, confirmed", [(2, 2), (3, 0)])
+async def test_node_put_key_write_quorum(node, mocker, quorum, confirmed):
+    key, val = convert_key_val("quorum_key", "value")
+    failing = set(replica_ids(key, 2))
+
+    async def mock_rpc_save_key(**kwargs):
+        return kwargs["key"] not in failing
+
+    await node.join(None)
+    mocker.patch("chord.node.rpc_save_key", side_effect=mock_rpc_save_key)
+    node._WRITE_QUORUM = quorum
+    warning = mocker.patch("chord.node.logger.warning")
+
+    keys = await node.put_key(key=key, value=val, ttl=3600)
+    assert len(keys) == confirmed
+    # the writes still running after the quorum are tracked until they finish
+    for _ in range(10):
+        await asyncio.sleep(0)
+    assert not node._background
+    assert warning.call_count == 2
+
+
+@pytest.mark.asyncio
+async def test_node_find_key_read_quorum(node, mocker):
+    key, val = convert_key_val("read_quorum_key", "value")
+    stale = generate_id(key)
+
+    async def mock_rpc_get_key(**kwargs):
+        return "stale" if generate_id(kwargs["key"]) == stale else val
+
+    await node.join(None)
+    mocker.patch("chord.node.rpc_get_key", side_effect=mock_rpc_get_key)
+    mocker.patch.object(node, "_find_key", return_value=(False, None))
+    node._READ_QUORUM = 2
+
+    assert await node.find_key(key) == val
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize(
+    "anti_entropy, mode",
+    [(0, Node.REPLICATION_HASH), (1, Node.REPLICATION_HASH), (0, Node.REPLICATION_SUCCESSORS)],
+)
+async def test_node_streams_keys_to_joining_node(mocker, tmp_path, anti_entropy, mode):
+    source, joining = make_handoff(tmp_path, mocker)
+    source._ANTI_ENTROPY_SUCCESSORS = anti_entropy
+    source._REPLICATION_MODE = mode
+    copies = anti_entropy or mode == Node.REPLICATION_SUCCESSORS
+
+    val = "handoff".encode("utf-8")
+    moved = [1, 2, 3, 4, 5, joining._numeric_id]
+    kept = [joining._numeric_id + 1, source._numeric_id]
+    for key in moved + kept:
+        source._storage.put_key(key, val)
+
+    batches = mocker.spy(source, "get_keys_batch")
+    joining._HANDOFF_BATCH = 4
+    await joining._pull_keys()
+
+    # every call acknowledges the previous batch of 4 keys
+    assert [call.args[2] for call in batches.call_args_list] == [None, [0, moved[3]], [moved[3], moved[5]]]
+    assert joining._handoff is None
+    assert joining._storage.get_keys(0, source._numeric_id + 1)[0] == moved
+    if not copies:
+        assert source._storage.get_keys(0, source._numeric_id + 1)[0] == kept
+        return
+
+    # the source keeps a copy of the handed off keys, the first sync finds no difference
+    assert source._storage.get_keys(0, source._numeric_id + 1)[0] == moved + kept
+    joining._predecessor = source._predecessor
+    joining._successor = gen_finger(source._addr)
+    joining._successors = [joining._successor]
+    joining._ANTI_ENTROPY_SUCCESSORS = 1
+    assert await joining.anti_entropy() == 0
+
+
+@pytest.mark.asyncio
+async def test_node_put_key_uses_location_cache(node, mocker):
+    key, val = convert_key_val("cached_key", "value")
+    owner = {"addr": "remote:1", "numeric_id": generate_id(key)}
+    saved = []
+
+    async def mock_rpc_save_key(**kwargs):
+        saved.append(kwargs["next_node"]["addr"])
+        return kwargs["next_node"]["addr"] != "remote:1"
+
+    await node.join(None)
+    node._WRITE_QUORUM = 1
+    node._REPLICATION_COUNT = 0
+    node._locations.add(owner["numeric_id"], owner)
+    mocker.patch("chord.node.rpc_save_key", side_effect=mock_rpc_save_key)
+    lookup = mocker.spy(node, "find_successor")
+
+    # the cached owner fails, the write is routed again and the owner forgotten
+    assert await node.put_key(key=key, value=val, ttl=3600) == [key]
+    assert saved == ["remote:1", node._addr]
+    assert lookup.call_count == 1
+
+    # the freshly resolved owner is cached now
+    assert await node.put_key(key=key, value=val, ttl=3600) == [key]
+    assert lookup.call_count == 1
+
+
+@pytest.mark.asyncio
+async def test_node_batches_keys_per_owner(mocker, tmp_path):
+    ring = make_ring(tmp_path, range(5010, 5014))
+    patch_ring_pools(ring, mocker)
+    node = next(iter(ring.values()))
+    lookup = mocker.spy(node._locations, "add")
+    items = distinct_items(13)
+    # a key that is never written, with ids apart from the others
+    missing = items.pop()[0]
+    keys = await node.put_keys(items, ttl=3600)
+    assert keys == [key for key, _ in items]
+    # one write per node, one lookup per node and one for the ids past the last node
+    assert rpc_calls(node, "save_keys") <= len(ring)
+    assert lookup.call_count <= len(ring) + 1
+
+    values = await node.find_keys([key for key, _ in items] + [missing])
+    assert values == [val for _, val in items] + [None]
+    assert rpc_calls(node, "get_keys") <= len(ring) + node._REPLICATION_COUNT + 1
+
+
+@pytest.mark.asyncio
+async def test_node_put_keys_with_duplicated_key(mocker, tmp_path):
+    ring = make_ring(tmp_path, range(5015, 5018))
+    patch_ring_pools(ring, mocker)
+    node = next(iter(ring.values()))
+    node._WRITE_QUORUM = 1 + node._REPLICATION_COUNT
+    items = [[b"dup", b"first"], [b"other", b"value"], [b"dup", b"last"]]
+
+    assert await node.put_keys(items, ttl=3600) == [b"dup", b"other", b"dup"]
+    # every replica is written once, with the last value
+    saved = [entry[0] for call in node._pool.call.call_args_list if call.args[1] == "save_keys" for entry in call.args[2]]
+    assert sorted(saved) == sorted(replica_ids(b"dup", 4) + replica_ids(b"other", 4))
+    assert await node.find_keys([b"dup"]) == [b"last"]
+
+
+def test_node_maintenance_backs_off_while_stable(node):
+    node._MIN_FIX_INTERVAL, node._MAX_FIX_INTERVAL = 1, 8
+    intervals = [1]
+    for changed in [False, False, False, False, True, False]:
+        intervals.append(node._next_interval(intervals[-1], changed))
+    assert intervals == [1, 2, 4, 8, 8, 1, 2]
+
+
+@pytest.mark.asyncio
+async def test_node_maintenance_wakes_up_on_churn(node, mocker):
+    node._MIN_FIX_INTERVAL, node._MAX_FIX_INTERVAL, node._FIX_JITTER = 0.01, 10, 0
+    steps = [
+        mocker.patch.object(node, step, return_value=False)
+        for step in ("check_predecessor", "stabilize", "fix_fingers")
+    ]
+    task = asyncio.ensure_future(node.maintain())
+
+    # 0.01 + 0.02 + 0.04, then the wait grows to 0.08
+    await asyncio.sleep(0.1)
+    rounds = steps[1].call_count
+    assert 2 <= rounds <= 4
+
+    node.notify(gen_finger("localhost:5999"))
+    await asyncio.sleep(0.005)
+    assert steps[1].call_count == rounds + 1
+    task.cancel()
+
+
+@pytest.mark.asyncio
+async def test_node_refreshes_all_fingers_in_one_walk(mocker, tmp_path):
+    ring = make_ring(tmp_path, range(5020, 5036))
+    nodes = list(ring.values())
+    patch_ring_pools(ring, mocker)
+    node = nodes[0]
+    lookup = mocker.spy(node, "find_successor")
+
+    assert await node.refresh_fingers()
+    ids = sorted(n._numeric_id for n in nodes)
+    for i in range(len(node._fingers)):
+        start = ring_geometry.finger_start(node._numeric_id, i)
+        expected = next((_id for _id in ids if _id >= start), ids[0])
+        assert node._fingers[i]["numeric_id"] == expected
+    distinct = len({node._fingers[i]["addr"] for i in range(len(node._fingers))})
+    assert lookup.call_count <= distinct
+    assert not await node.refresh_fingers()
+
+
+@pytest.mark.asyncio
+async def test_node_leave_hands_over_keys_and_relinks(mocker, tmp_path):
+    ring = make_ring(tmp_path, range(5040, 5043))
+    pred, leaving, succ = ring.values()
+    for key in range(1, 6):
+        leaving._storage.put_key(key, b"value")
+    patch_ring_pools(ring, mocker)
+    # the pool is closed when leaving, keep the patched one
+    mocker.patch.object(leaving._pool, "close", new=mocker.AsyncMock())
+    leaving._HANDOFF_BATCH = 2
+
+    await leaving.leave()
+
+    assert succ._storage.get_keys(0, 6)[0] == [1, 2, 3, 4, 5]
+    assert leaving._storage.get_keys(0, 6)[0] == []
+    assert pred._successor["addr"] == succ._addr
+    assert pred._successors[0]["addr"] == succ._addr
+    assert succ._predecessor["addr"] == pred._addr
+    assert all(pred._fingers[i]["addr"] != leaving._addr for i in range(len(pred._fingers)))
+
+
+@pytest.mark.asyncio
+async def test_node_anti_entropy_transfers_only_differences(mocker, tmp_path):
+    ring = make_ring(tmp_path, range(5050, 5052))
+    replica, owner = ring.values()
+    for n in ring.values():
+        # small leaves, the ring may hold only a few hundred ids
+        n._MERKLE_FANOUT, n._MERKLE_LEAF_SIZE = 4, 4
+    # the owner covers half of the ring, with up to 2000 stored ids
+    left = (owner._numeric_id - ring_geometry.size // 2) & ring_geometry.mask
+    owner._predecessor["numeric_id"] = left
+    count = min(2000, ring_geometry.size // 2)
+    ids = sorted({(left + 1 + k * (ring_geometry.size // 2 // count)) & ring_geometry.mask for k in range(count)})
+    for key in ids:
+        owner._storage.put_key(key, b"value")
+        replica._storage.put_key(key, b"value")
+    lost, missing = ids[:3], ids[-2:]
+    owner._storage.del_keys(lost)
+    replica._storage.del_keys(missing)
+    # overwritten on the owner only, the owner's value wins
+    owner._storage.put_key(ids[100], b"new")
+    patch_ring_pools(ring, mocker)
+    compared = []
+    range_digests = replica.range_digests
+
+    def record_digests(left, right):
+        result = range_digests(left, right)
+        compared.extend(result)
+        return result
+
+    mocker.patch.object(replica, "range_digests", side_effect=record_digests)
+
+    assert await owner.anti_entropy() == 6
+    assert owner._storage.get_ids(left, owner._numeric_id) == ids
+    assert replica._storage.get_ids(left, owner._numeric_id) == ids
+    assert replica._storage.get_key(ids[100]) == owner._storage.get_key(ids[100]) == b"new"
+    assert len(compared) < len(ids) // 10
+    assert await owner.anti_entropy() == 0
+
+
+@pytest.mark.asyncio
+async def test_node_successor_replication(mocker, tmp_path):
+    ring = make_ring(tmp_path, range(5060, 5065))
+    nodes = list(ring.values())
+    for n in nodes:
+        n._REPLICATION_MODE = Node.REPLICATION_SUCCESSORS
+    patch_ring_pools(ring, mocker)
+
+    key, val = convert_key_val("successor_key", "value")
+    dht_key = generate_id(key)
+    owner = ring[(await nodes[0].find_successor(dht_key))[1]["addr"]]
+    client = next(n for n in nodes if n is not owner and n not in owner._replica_successors())
+    lookup = mocker.spy(client, "_locate")
+    spawn = mocker.spy(owner, "_spawn")
+    remote_finds = [mocker.spy(n, "find_key") for n in nodes if n is not client]
+
+    assert await client.put_key(key=key, value=val, ttl=3600) == [dht_key] * 2
+    assert lookup.call_count == 1
+    # the forwards, some still running after the quorum, are tracked by the owner
+    assert spawn.call_count == len(owner._replica_successors())
+    await asyncio.gather(*owner._background)
+    holders = [n._addr for n in nodes if n._storage.get_key(dht_key) == val]
+    assert sorted(holders) == sorted([owner._addr] + [n["addr"] for n in owner._replica_successors()])
+
+    # the owner lost the key, the read fails over to its successors
+    owner._storage.del_keys([dht_key])
+    assert await client.find_key(key) == val
+    assert await client.find_keys([key]) == [val]
+    # copies are read from the storage of the successors, without another lookup there
+    assert not any(find.called for find in remote_finds)
+
+    items = [[b"dup", b"first"], [b"dup", b"last"]]
+    assert await client.put_keys(items, ttl=3600) == [b"dup", b"dup"]
+    assert await client.find_keys([b"dup"]) == [b"last"]
+
+
+@pytest.mark.asyncio
+async def test_node_keeps_and_logs_background_tasks(node, mocker):
+    error = mocker.patch("chord.node.logger.error")
+
+    async def fail():
+        raise RuntimeError("boom")
+
+    task = node._spawn(fail())
+    assert task in node._background
+    await asyncio.gather(task, return_exceptions=True)
+    await asyncio.sleep(0)
+    assert task not in node._background
+    assert "boom" in error.call_args[0][0]
+
+
+@pytest.mark.skipif(ring_geometry.bits != 8, reason="the first version ran an 8 bit ring")
+def test_node_reads_store_of_first_version(tmp_path):
+    # 2 hex char keys of the 8 bit ring
+    node = Node("localhost", "5070")
+    # the first version keyed the HMAC with the hex id of the node
+    legacy_id = hashlib.sha1(b"localhost:5070").hexdigest()[:2]
+    assert node._id == legacy_id
+    key, val = convert_key_val("legacy_key", "legacy_value")
+    legacy = Cache(str(tmp_path))
+    tag = hmac.new(legacy_id.encode("utf-8"), val, hashlib.sha256).hexdigest()
+    legacy.set(f"{key:02x}", val.hex(), expire=60, tag=tag)
+    legacy.close()
+
+    storage = Storage(node_id=node._id, directory=str(tmp_path))
+    assert storage.get_key(key) == val
+    assert storage.get_entries_for([key])[0][:2] == [key, val]
+
+
+@pytest.mark.asyncio
+async def test_node_handoff_retries_until_complete(mocker, tmp_path):
+    down = set()
+    source, joining = make_handoff(tmp_path, mocker, down)
+    for key in range(1, 6):
+        source._storage.put_key(key, b"handoff")
+    down.add(source._addr)
+    delays = []
+
+    async def sleep(delay):
+        # reads of the range still go to the source
+        assert joining._in_handoff(3)
+        delays.append(delay)
+        if len(delays) == 5:
+            down.clear()
+
+    mocker.patch("chord.node.asyncio.sleep", side_effect=sleep)
+    await joining._pull_keys()
+
+    assert len(delays) == 5
+    assert joining._handoff is None
+    assert joining._storage.get_keys(0, 6)[0] == [1, 2, 3, 4, 5]
+
+
+@pytest.mark.asyncio
+async def test_node_handoff_retry_after_notify(mocker, tmp_path):
+    down = set()
+    source, joining = make_handoff(tmp_path, mocker, down)
+    for key in range(1, 6):
+        source._storage.put_key(key, b"handoff")
+    down.add(source._addr)
+
+    async def sleep(delay):
+        # the joining node notifies the source before the first batch is retried
+        source.notify({"addr": joining._addr, "numeric_id": joining._numeric_id})
+        down.clear()
+
+    mocker.patch("chord.node.asyncio.sleep", side_effect=sleep)
+    await joining._pull_keys()
+
+    assert source._predecessor["numeric_id"] == joining._numeric_id
+    assert joining._storage.get_keys(0, 6)[0] == [1, 2, 3, 4, 5]
+    # a node that is not in front of us anymore gets nothing
+    assert source.get_keys_batch(ring_geometry.size // 8, 0, None, 10) == ([], None)
+
+
+@pytest.mark.asyncio
+async def test_node_replica_reads_go_to_handoff_source(mocker, tmp_path):
+    ring = make_ring(tmp_path, ["5004", "5006"])
+    source, joining = ring["localhost:5004"], ring["localhost:5006"]
+    patch_ring_pools(ring, mocker)
+    left = joining._predecessor["numeric_id"]
+    moved, arrived = (left + 1) & ring_geometry.mask, joining._numeric_id
+    source._storage.put_key(moved, b"moved")
+    joining._storage.put_key(arrived, b"arrived")
+    joining._handoff = {"source": gen_finger(source._addr), "after": left}
+
+    # a remote replica read, batched through the pool of the reading node
+    assert await rpc_get_keys(gen_finger(joining._addr), [moved, arrived], pool=source._pool) == [
+        b"moved",
+        b"arrived",
+    ]
+    joining._handoff = None
+    assert await joining.get_keys([moved]) == [None]
+
+
+@pytest.mark.asyncio
+async def test_node_accepts_writes_while_handing_off(mocker, tmp_path):
+    source, joining = make_handoff(tmp_path, mocker)
+    source._REPLICATION_MODE = Node.REPLICATION_SUCCESSORS
+    source._WRITE_QUORUM = 1
+    for key in range(1, 6):
+        source._storage.put_key(key, b"old")
+    entries, cursor = source.get_keys_batch(joining._numeric_id, 0, None, 2)
+    joining._storage.put_entries(entries)
+    source.notify({"addr": joining._addr, "numeric_id": joining._numeric_id})
+
+    # a writer that still sees the source as owner of the range is not rejected
+    assert await source.replicate_keys([[1, b"new", 60], [4, b"new", 60]]) == [1, 1]
+    await asyncio.gather(*source._background)
+    # the streamed key is forwarded, the other one goes with the next batch
+    assert joining._storage.get_key(1) == b"new"
+    assert joining._storage.get_key(4) is None
+    while cursor is not None:
+        entries, cursor = source.get_keys_batch(joining._numeric_id, 0, cursor, 2)
+        joining._storage.put_entries(entries)
+    assert joining._storage.get_key(4) == b"new"
+    assert source._handing_off is None
+    assert source.save_keys([[4, b"late", 60]]) == [False]
+
+
+@pytest.mark.asyncio
+async def test_node_handoff_gives_up_after_retries(mocker, tmp_path):
+    down = set()
+    source, joining = make_handoff(tmp_path, mocker, down)
+    down.add(source._addr)
+    joining._HANDOFF_RETRIES = 3
+    sleep = mocker.patch("chord.node.asyncio.sleep", new=mocker.AsyncMock())
+    await joining._pull_keys()
+
+    assert rpc_calls(joining, "get_keys_batch") == 4
+    assert max(call.args[0] for call in sleep.call_args_list) <= joining._HANDOFF_MAX_BACKOFF
+    assert joining._handoff is None
+    assert not joining._in_handoff(3)
+
+
+@pytest.mark.asyncio
+async def test_node_handoff_stops_when_source_fails(mocker, tmp_path):
+    down = set()
+    source, joining = make_handoff(tmp_path, mocker, down)
+    down.add(source._addr)
+    joining._successor = gen_finger(source._addr)
+    joining._successors = [joining._successor, gen_finger("localhost:5009")]
+
+    async def sleep(delay):
+        # stabilization notices the failed source before the batch is retried
+        await joining.stabilize()
+
+    mocker.patch("chord.node.asyncio.sleep", side_effect=sleep)
+    await joining._pull_keys()
+
+    assert rpc_calls(joining, "get_keys_batch") == 2
+    assert joining._handoff is None
+    assert joining._successor["addr"] == "localhost:5009"
+
+
+@pytest.mark.asyncio
+async def test_node_stale_cached_owner_rejects_writes(mocker, tmp_path):
+    ring = make_ring(tmp_path, range(5080, 5083))
+    patch_ring_pools(ring, mocker)
+    client = next(iter(ring.values()))
+    client._REPLICATION_COUNT = 0
+    client._WRITE_QUORUM = 1
+    key, val = convert_key_val("moved_key", "value")
+    batch_key = b"moved_batch_key"
+    for dht_key in (generate_id(key), generate_id(batch_key)):
+        owner = ring[(await client.find_successor(dht_key))[1]["addr"]]
+        stale = next(n for n in ring.values() if n is not owner)
+        # the cached owner is alive but no longer responsible for the key
+        client._locations.clear()
+        client._locations.add(dht_key, gen_finger(stale._addr))
+
+        if dht_key == generate_id(key):
+            assert await client.put_key(key=key, value=val, ttl=3600) == [key]
+        else:
+            assert await client.put_keys([[batch_key, val]], ttl=3600) == [batch_key]
+        assert owner._storage.get_key(dht_key) == val
+        assert stale._storage.get_key(dht_key) is None
+
+
+@pytest.mark.asyncio
+async def test_node_scrubs_in_slices(node, mocker):
+    scrub = mocker.patch.object(node._storage, "scrub", return_value=1)
+    sleep = mocker.spy(asyncio, "sleep")
+
+    assert await node.scrub_batch(40, slice_size=16) == 3
+    assert [call.args[0] for call in scrub.call_args_list] == [16, 16, 8]
+    assert sleep.call_count == 3
+
+
+@pytest.mark.asyncio
+async def test_node_leave_skips_failing_successor(mocker, tmp_path):
+    ring = make_ring(tmp_path, range(5090, 5094))
+    pred, leaving, dead, succ = ring.values()
+    for key in range(1, 6):
+        leaving._storage.put_key(key, b"value")
+    maintenance = asyncio.ensure_future(asyncio.sleep(10))
+    patch_ring_pools(ring, mocker, down={dead._addr})
+    mocker.patch.object(leaving._pool, "close", new=mocker.AsyncMock())
+
+    def patch_relink(node):
+        relink = node.relink
+
+        def checked(*args):
+            # maintenance is stopped before anyone relinks
+            assert maintenance.cancelled()
+            return relink(*args)
+
+        return mocker.patch.object(node, "relink", side_effect=checked)
+
+    relinks = [patch_relink(n) for n in (succ, pred)]
+
+    assert await leaving.leave([maintenance])
+    assert all(relink.call_count == 1 for relink in relinks)
+    assert succ._storage.get_keys(0, 6)[0] == [1, 2, 3, 4, 5]
+    assert pred._successor["addr"] == succ._addr
+    # writes after the final handoff are rejected
+    assert leaving.save_keys([[1, b"late", 60]]) == [False]
+    assert not leaving.put_entries([[1, b"late", 60, ""]])
+
+
+@pytest.mark.asyncio
+async def test_node_leave_aborts_without_successor(mocker, tmp_path):
+    ring = make_ring(tmp_path, range(5095, 5097))
+    leaving, other = ring.values()
+    leaving._storage.put_key(1, b"value")
+    maintenance = asyncio.ensure_future(asyncio.sleep(10))
+    patch_ring_pools(ring, mocker, down={other._addr})
+
+    assert not await leaving.leave([maintenance])
+    assert rpc_calls(leaving, "relink") == 0
+    assert not maintenance.done()
+    assert leaving._storage.get_key(1) == b"value"
+    maintenance.cancel()
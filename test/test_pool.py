@@ -0,0 +1,167 @@
+import asyncio
+
+import aiomas
+import pytest
+
+from chord.codec import MsgPack
+from chord.pool import ConnectionPool
+
+
+class EchoNode:
+    router = aiomas.rpc.Service()
+    batches = []
+    # calls of blocked_echo running on the server and the most at once
+    running = 0
+    peak = 0
+    release = None
+
+    @aiomas.expose
+    def echo_batch(self, items):
+        self.batches.append(items)
+        return items
+
+    @aiomas.expose
+    def echo(self, value):
+        return value
+
+    @aiomas.expose
+    async def blocked_echo(self, value):
+        EchoNode.running += 1
+        EchoNode.peak = max(EchoNode.peak, EchoNode.running)
+        await EchoNode.release.wait()
+        EchoNode.running -= 1
+        return value
+
+    @aiomas.expose
+    async def slow_echo(self, value, delay):
+        await asyncio.sleep(delay)
+        return value
+
+
+async def start_server():
+    server = await aiomas.rpc.start_server(("127.0.0.1", 0), EchoNode(), codec=MsgPack)
+    host, port = server.sockets[0].getsockname()[:2]
+    return server, f"{host}:{port}"
+
+
+@pytest.mark.asyncio
+async def test_pool_reuses_connection():
+    server, addr = await start_server()
+    pool = ConnectionPool(ssl_ctx=None)
+    assert await pool.call(addr, "echo", 1) == 1
+    rpc_con = pool._peers[addr].idle[-1][0]
+    assert await pool.call(addr, "echo", 2) == 2
+    assert pool._peers[addr].idle[-1][0] is rpc_con
+    assert len(pool._peers[addr].idle) == 1
+    await pool.close()
+    server.close()
+
+
+@pytest.mark.asyncio
+async def test_pool_drops_expired_connections():
+    server, addr = await start_server()
+    pool = ConnectionPool(ssl_ctx=None, idle_timeout=0)
+    await pool.call(addr, "echo", 1)
+    rpc_con = pool._peers[addr].idle[-1][0]
+    await pool.call(addr, "echo", 2)
+    assert pool._peers[addr].idle[-1][0] is not rpc_con
+    await pool.close()
+    server.close()
+
+
+@pytest.mark.asyncio
+async def test_pool_skips_closed_connections():
+    server, addr = await start_server()
+    pool = ConnectionPool(ssl_ctx=None)
+    await pool.call(addr, "echo", 1)
+    rpc_con = pool._peers[addr].idle[-1][0]
+    rpc_con.channel.transport.close()
+    assert await pool.call(addr, "echo", 2) == 2
+    assert pool._peers[addr].idle[-1][0] is not rpc_con
+    await pool.close()
+    server.close()
+
+
+@pytest.mark.asyncio
+async def test_pool_evicts_peer_on_failure():
+    server, addr = await start_server()
+    pool = ConnectionPool(ssl_ctx=None)
+    await pool.call(addr, "echo", 1)
+    with pytest.raises(ConnectionError):
+        async with pool.connection(addr):
+            raise ConnectionResetError()
+    assert len(pool._peers[addr].idle) == 0
+    await pool.close()
+    server.close()
+
+
+@pytest.mark.asyncio
+async def test_pool_multiplexes_calls_over_one_channel():
+    server, addr = await start_server()
+    pool = ConnectionPool(ssl_ctx=None, multiplex=True)
+    results = await asyncio.gather(*[pool.call(addr, "slow_echo", i, 0.01) for i in range(50)])
+    assert results == list(range(50))
+    assert len(pool._peers[addr].shared) == 1
+    await pool.close()
+    server.close()
+
+
+@pytest.mark.asyncio
+async def test_pool_bounds_calls_in_flight():
+    server, addr = await start_server()
+    pool = ConnectionPool(ssl_ctx=None, multiplex=True, max_in_flight=2)
+    EchoNode.running = EchoNode.peak = 0
+    EchoNode.release = asyncio.Event()
+
+    calls = [asyncio.ensure_future(pool.call(addr, "blocked_echo", i)) for i in range(6)]
+    for _ in range(100):
+        if EchoNode.running == 2:
+            break
+        await asyncio.sleep(0.01)
+    await asyncio.sleep(0.05)
+    # the calls beyond the limit wait in the pool
+    assert EchoNode.running == EchoNode.peak == 2
+    assert not any(call.done() for call in calls)
+
+    EchoNode.release.set()
+    assert await asyncio.gather(*calls) == list(range(6))
+    assert EchoNode.peak == 2
+    await pool.close()
+    server.close()
+
+
+@pytest.mark.asyncio
+async def test_pool_call_timeout_keeps_channel():
+    server, addr = await start_server()
+    pool = ConnectionPool(ssl_ctx=None, multiplex=True)
+    with pytest.raises(asyncio.TimeoutError):
+        await pool.call(addr, "slow_echo", 1, 0.2, timeout=0.01)
+    assert await pool.call(addr, "echo", 2) == 2
+    await asyncio.sleep(0.3)
+    assert await pool.call(addr, "echo", 3) == 3
+    assert len(pool._peers[addr].shared) == 1
+    await pool.close()
+    server.close()
+
+
+@pytest.mark.asyncio
+async def test_pool_sends_bytes_and_ring_ids():
+    server, addr = await start_server()
+    pool = ConnectionPool(ssl_ctx=None, multiplex=True)
+    payload = [b"\x00\xff", 2 ** 159 + 1, -(2 ** 70), [1, "a"]]
+    assert await pool.call(addr, "echo", payload) == payload
+    await pool.close()
+    server.close()
+
+
+@pytest.mark.asyncio
+async def test_pool_coalesces_batched_calls():
+    server, addr = await start_server()
+    pool = ConnectionPool(ssl_ctx=None, multiplex=True, batch_delay=0.01, max_batch=4)
+    EchoNode.batches.clear()
+    results = await asyncio.gather(*[pool.call_batched(addr, "echo_batch", i) for i in range(6)])
+    assert results == list(range(6))
+    # the first batch is sent when full, the rest after the delay
+    assert EchoNode.batches == [[0, 1, 2, 3], [4, 5]]
+    await pool.close()
+    server.close()
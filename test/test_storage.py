@@ -1,15 +1,17 @@
 import asyncio
+import hashlib
+import hmac
+import time
 
 import pytest
 
-from chord.helpers import generate_id
+from chord.helpers import generate_id, ring
 from chord.storage import Storage
 
 
 def convert_key_val(key: str, val: str):
-    hex_key = generate_id(key)
-    hex_val = val.encode("utf-8").hex()
-    return hex_key, hex_val
+    dht_key = generate_id(key)
+    return dht_key, val.encode("utf-8")
 
 
 @pytest.fixture(scope="session", autouse=True)
@@ -54,3 +56,122 @@ async def test_gets_key(storage):
     key, val = convert_key_val("hello2", "world2")
     storage.put_key(key, val)
     assert storage.get_key(key) == val
+
+
+def test_migrates_legacy_hex_keys(storage):
+    key, val = convert_key_val("legacy", "value")
+    legacy_key = f"{key:0{ring.bits // 4}x}"
+    storage._store.set(legacy_key, val.hex(), tag=storage.make_digest(val))
+    # a key of a ring with another id width is kept as it is
+    other_width = "ab" * (ring.bits // 8 + 1)
+    storage._store.set(other_width, val.hex())
+
+    migrated = Storage(node_id=storage.node_id)
+    assert migrated.get_key(key) == val
+    assert legacy_key not in migrated._store
+    assert migrated._store.get(other_width) == val.hex()
+    assert int(other_width, 16) not in migrated._index
+    migrated._store.delete(other_width)
+
+
+def test_migrates_hex_values(tmp_path):
+    key, val = convert_key_val("hex_value", "value")
+    legacy = Storage(node_id="test_node", directory=str(tmp_path))
+    legacy._store.set(key, val.hex(), expire=60, tag=legacy.make_digest(val))
+    legacy._store.delete(Storage._FORMAT_KEY)
+
+    migrated = Storage(node_id="test_node", directory=str(tmp_path))
+    assert migrated._store.get(key) == val
+    assert migrated.get_key(key) == val
+    assert migrated._store.get(key, expire_time=True)[1] - time.time() <= 60
+
+
+def test_get_keys_in_ring_range(tmp_path):
+    storage = Storage(node_id="test_node", directory=str(tmp_path))
+    ids = [10, 20, 30, ring.size - 10]
+    val = "range".encode("utf-8")
+    for _id in ids:
+        storage.put_key(_id, val)
+
+    keys, values = storage.get_keys(10, 30)
+    assert keys == [20]
+    assert values == [val]
+
+    # wraps around zero
+    keys, _ = storage.get_keys(ring.size - 20, 15)
+    assert keys == [ring.size - 10, 10]
+
+    storage.del_keys(ids)
+    assert not set(ids) & set(storage.get_keys(0, 0)[0])
+
+
+def test_entries_keep_expiry_and_tag(storage, tmp_path):
+    val = "entry".encode("utf-8")
+    storage.put_key(100, val, ttl=60)
+    storage.put_key(101, val, ttl=None)
+    entries = storage.get_entries(99, 102)
+    assert [entry[0] for entry in entries] == [100, 101]
+    assert 0 < entries[0][2] <= 60
+    assert entries[1][2] is None
+
+    receiver = Storage(node_id=storage.node_id, directory=str(tmp_path))
+    receiver.put_entries(entries + [[102, val, -1, entries[0][3]]])
+    assert receiver.get_key(100) == val
+    _, expire_time = receiver._store.get(100, expire_time=True)
+    assert expire_time - time.time() <= 60
+    assert receiver._store.get(101, expire_time=True)[1] is None
+    assert 102 not in receiver._store
+    storage.del_keys([100, 101])
+
+
+def test_hot_cache_serves_verified_values(tmp_path):
+    storage = Storage(node_id="test_node", directory=str(tmp_path), cache_bytes=1024)
+    key, val = convert_key_val("hot", "value")
+    storage.put_key(key, val)
+    assert storage.get_key(key) == val
+    assert storage._hot.get(key) == val
+
+    # served from memory without touching the disk
+    storage._store.set(key, b"\0", tag="corrupt")
+    assert storage.get_key(key) == val
+
+    new_val = "other".encode("utf-8")
+    storage.put_key(key, new_val)
+    assert storage.get_key(key) == new_val
+    storage.del_keys([key])
+    assert storage.get_key(key) is None
+
+
+def test_digest_uses_cached_hmac_key(storage):
+    expected = hmac.new(storage.node_id.encode("utf-8"), b"value", hashlib.sha256).hexdigest()
+    assert storage.make_digest(b"value") == expected
+    assert storage.make_digest(b"value") == expected
+
+
+def test_scrub_deletes_corrupted_values(tmp_path):
+    storage = Storage(node_id="test_node", directory=str(tmp_path), verify_reads=Storage.VERIFY_SCRUB)
+    for key in range(1, 6):
+        storage.put_key(key, b"value")
+    storage._store.set(3, b"corrupt", tag=storage.make_digest(b"value"))
+
+    # reads are not verified with this policy
+    assert storage.get_key(3) == b"corrupt"
+    assert storage.scrub(limit=2) == 0
+    assert storage.scrub(limit=2) == 1
+    assert 3 not in storage._store
+    # wraps around
+    assert storage.scrub(limit=2) == 0
+    assert storage._scrub_after == 1
+
+
+def test_hot_cache_skips_unverified_values(tmp_path):
+    storage = Storage(
+        node_id="test_node", directory=str(tmp_path), cache_bytes=1024, verify_reads=Storage.VERIFY_SCRUB
+    )
+    storage.put_key(1, b"value")
+    storage._store.set(1, b"corrupt", tag=storage.make_digest(b"value"))
+
+    assert storage.get_key(1) == b"corrupt"
+    assert storage._hot.get(1) is None
+    assert storage.scrub() == 1
+    assert storage.get_key(1) is None